@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Asyncio HTTP API around ``DocumentProcessor``.
+
+One processor (and so one loaded index) is shared by every client.
+Blocking work runs on a thread pool so the event loop only parses requests
+and writes responses:
+- Searches and chat retrieval run there. FAISS and NumPy release the GIL
+  while they work.
+- Ingestion runs there too, and its PDF extraction fans out to the
+  processor's process pool.
+
+Searches share the index concurrently. An ingest extracts, chunks and embeds
+its files while searches go on. It holds the index exclusively only while
+adding its vectors, and saves the workspace after that. A chat turn holds
+the index only while it retrieves, not while the model answers.
+
+Endpoints:
+    GET  /health              liveness and index size
+    GET  /summary             documents, chunks and cache statistics
+    GET  /metrics             stage timings and counters (Prometheus text, or JSON with ?format=json)
+    POST /search              {"query", "k", "mode", "filter"} -> scored chunks
+    POST /chat                {"question", "k", "max_tokens", "stream"} -> answer
+    POST /ingest              multipart PDF upload, or {"paths": [...]} under --ingest-root; appends by default
+
+    python api_server.py --workspace .cache/workspace --port 8080
+"""
+
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterator
+
+from aiohttp import web
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+
+from document_processor import (DocumentProcessor, DEFAULT_CONTEXT_TOKENS, EMBEDDING_BACKENDS,
+                                IN_MEMORY_PDF_MAX_BYTES, RETRIEVAL_MODES)
+
+# Threads running searches, chat turns and ingests off the event loop
+DEFAULT_API_THREADS = 32
+
+# Largest accepted request body (multipart uploads included)
+MAX_REQUEST_BYTES = 512 * 1024 * 1024
+
+# Largest k a search may ask for
+MAX_SEARCH_K = 100
+
+# Largest context budget a chat turn may ask for
+MAX_CONTEXT_TOKENS = 100_000
+
+
+class ReadWriteLock:
+    """Asyncio lock admitting many concurrent readers or a single writer.
+
+    Waiting writers block new readers, so a steady stream of searches cannot
+    starve an ingest.
+    """
+
+    def __init__(self):
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writer and not self._writers_waiting)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self._condition:
+            self._writers_waiting += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writer and self._readers == 0)
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+def chunk_payload(doc: Document, score: Optional[float] = None) -> Dict[str, Any]:
+    """JSON view of a retrieved chunk."""
+    payload = {"text": doc.page_content, "metadata": doc.metadata}
+    if score is not None:
+        payload["score"] = float(score)
+    return payload
+
+
+def result_payload(result: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON view of one file's processing result (without its text and chunks)."""
+    return {key: value for key, value in result.items() if key not in ("text", "chunks")}
+
+
+async def _json_body(request: web.Request) -> Dict[str, Any]:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text='{"error": "Request body must be JSON"}', content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text='{"error": "Request body must be a JSON object"}',
+                                 content_type="application/json")
+    return body
+
+
+def _bad_request(message: str) -> web.Response:
+    return web.json_response({"error": message}, status=400)
+
+
+def _retrieval_error(body: Dict[str, Any]) -> Optional[str]:
+    """Why the ``k`` and ``mode`` of a search or chat request are invalid, or None."""
+    k = body.get("k", 5)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= MAX_SEARCH_K:
+        return f"'k' must be an integer between 1 and {MAX_SEARCH_K}"
+    if body.get("mode", "hybrid") not in RETRIEVAL_MODES:
+        return f"'mode' must be one of {', '.join(RETRIEVAL_MODES)}"
+    return None
+
+
+def _within(path: str, root: str) -> bool:
+    """Whether ``path`` resolves (symlinks included) to a location under ``root``."""
+    root = os.path.realpath(root)
+    return os.path.commonpath([os.path.realpath(path), root]) == root
+
+
+class DocumentService:
+    """Request handlers sharing one processor across all clients."""
+
+    def __init__(self, processor: DocumentProcessor, workspace: Optional[str] = None,
+                 chat_model: Optional[Any] = None, threads: int = DEFAULT_API_THREADS,
+                 ingest_workers: Optional[int] = None, ingest_root: Optional[str] = None):
+        self.processor = processor
+        self.workspace = workspace
+        self.chat_model = chat_model
+        self.ingest_workers = ingest_workers
+        self.ingest_root = ingest_root
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="api")
+        self.lock = ReadWriteLock()
+        # Ingests run one at a time, so their saves cannot interleave
+        self._ingest_lock = asyncio.Lock()
+
+    async def _run(self, function, *args, **kwargs):
+        """Run a blocking call on the service's thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: function(*args, **kwargs))
+
+    async def _iterate(self, iterator: Iterator[str]) -> AsyncIterator[str]:
+        """Pull items from a blocking iterator on the thread pool."""
+        done = object()
+        while True:
+            item = await self._run(next, iterator, done)
+            if item is done:
+                return
+            yield item
+
+    async def health(self, request: web.Request) -> web.Response:
+        store = self.processor.vector_store
+        return web.json_response({"status": "ok", "chunks": int(store.index.ntotal) if store is not None else 0})
+
+    async def summary(self, request: web.Request) -> web.Response:
+        async with self.lock.read():
+            summary = await self._run(self.processor.get_document_summary)
+        summary["query_cache"] = self.processor.query_cache.stats()
+        summary["answer_cache"] = self.processor.answer_cache.stats()
+        return web.json_response(summary)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        # Exports read cache statistics from disk, so they stay off the event loop
+        if request.query.get("format") == "json":
+            return web.json_response(await self._run(self.processor.metrics_snapshot))
+        return web.Response(text=await self._run(self.processor.export_metrics, "prometheus"),
+                            content_type="text/plain", charset="utf-8")
+
+    async def search(self, request: web.Request) -> web.Response:
+        body = await _json_body(request)
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            return _bad_request("'query' must be a non-empty string")
+        error = _retrieval_error(body)
+        if error:
+            return _bad_request(error)
+
+        async with self.lock.read():
+            try:
+                results = await self._run(self.processor.retrieve, query, k=body.get("k", 5),
+                                          mode=body.get("mode", "hybrid"),
+                                          filter=body.get("filter"))
+            except ValueError as e:
+                return _bad_request(str(e))
+        return web.json_response({"results": [chunk_payload(doc, score) for doc, score in results]})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await _json_body(request)
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            return _bad_request("'question' must be a non-empty string")
+        error = _retrieval_error(body)
+        if error:
+            return _bad_request(error)
+        max_tokens = body.get("max_tokens", DEFAULT_CONTEXT_TOKENS)
+        if (not isinstance(max_tokens, int) or isinstance(max_tokens, bool)
+                or not 1 <= max_tokens <= MAX_CONTEXT_TOKENS):
+            return _bad_request(f"'max_tokens' must be an integer between 1 and {MAX_CONTEXT_TOKENS}")
+        if self.processor.vector_store is None:
+            return web.json_response({"error": "No documents processed"}, status=409)
+        chat_model = self.chat_model or await self._run(self.processor.get_chat_model)
+        if chat_model is None:
+            return web.json_response({"error": "No chat model available"}, status=503)
+
+        # Only retrieval reads the index; the model answers from the prompt built by then
+        async with self.lock.read():
+            try:
+                answer = await self._run(self.processor.stream_answer, question, chat_model,
+                                         k=body.get("k", 5), mode=body.get("mode", "hybrid"),
+                                         filter=body.get("filter"), max_tokens=max_tokens)
+            except ValueError as e:
+                return _bad_request(str(e))
+
+        if not body.get("stream"):
+            await self._run(answer.consume)
+            return web.json_response(self._answer_payload(answer))
+
+        # Plain-text fragments as the model produces them; a dropped client cancels the turn
+        response = web.StreamResponse(headers={"Content-Type": "text/plain; charset=utf-8"})
+        await response.prepare(request)
+        try:
+            async for token in self._iterate(iter(answer)):
+                await response.write(token.encode("utf-8"))
+        except (ConnectionResetError, asyncio.CancelledError):
+            answer.cancel()
+            await self._run(answer.close)
+            raise
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def _answer_payload(answer) -> Dict[str, Any]:
+        return {
+            "answer": answer.text,
+            "sources": answer.sources,
+            "cached": answer.cached,
+            "cancelled": answer.cancelled,
+            "ttft": answer.ttft,
+            "latency": answer.latency,
+            "context_tokens": answer.context_tokens,
+            "tokens_saved": answer.tokens_saved
+        }
+
+    async def ingest(self, request: web.Request) -> web.Response:
+        uploads = []
+        names = None
+        try:
+            if request.content_type.startswith("multipart/"):
+                paths, names, append = await self._read_uploads(request, uploads)
+            else:
+                if self.ingest_root is None:
+                    return web.json_response({"error": "Ingesting server-side paths is disabled; upload the files"},
+                                             status=403)
+                body = await _json_body(request)
+                paths = body.get("paths")
+                append = body.get("append", True)
+                if not isinstance(paths, list) or not paths or not all(isinstance(path, str) for path in paths):
+                    return _bad_request("'paths' must be a non-empty list of file paths")
+                paths = [os.path.join(self.ingest_root, path) for path in paths]
+                outside = [path for path in paths if not _within(path, self.ingest_root)]
+                if outside:
+                    return web.json_response({"error": f"Paths outside the ingest root: {', '.join(outside)}"},
+                                             status=403)
+                missing = [path for path in paths if not os.path.isfile(path)]
+                if missing:
+                    return _bad_request(f"Files not found: {', '.join(missing)}")
+            if not paths:
+                return _bad_request("No PDF files uploaded")
+
+            async with self._ingest_lock:
+                # Extraction and embedding do not touch the index, so searches carry on meanwhile
+                prepared = await self._run(self.processor.prepare_documents, paths, parallel=True,
+                                           max_workers=self.ingest_workers, source_names=names)
+                async with self.lock.write():
+                    results = await self._run(self.processor.index_documents, prepared,
+                                              append=append and self.processor.vector_store is not None)
+                    # Replaced documents leave tombstones; drop them before searches see the index again
+                    await self._run(self.processor.compact)
+                # The index is compacted, so the save only reads it; the ingest lock keeps other writers out
+                if self.workspace and self.processor.vector_store is not None:
+                    async with self.lock.read():
+                        await self._run(self.processor.save, self.workspace, compact=False)
+        finally:
+            for upload in uploads:
+                upload.close()
+
+        payload = {key: value for key, value in results.items() if key not in ("successful", "failed")}
+        payload["successful"] = [result_payload(result) for result in results["successful"]]
+        payload["failed"] = [result_payload(result) for result in results["failed"]]
+        return web.json_response(payload, status=500 if "vector_store_error" in results else 200)
+
+    @staticmethod
+    async def _read_uploads(request: web.Request, uploads: List[Any]):
+        """Read uploaded PDFs into files that stay in memory unless large; they are added to ``uploads``."""
+        names = []
+        append = True
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "append":
+                append = (await part.text()).strip().lower() not in ("0", "false", "no")
+            elif part.filename:
+                upload = tempfile.SpooledTemporaryFile(max_size=IN_MEMORY_PDF_MAX_BYTES)
+                uploads.append(upload)
+                while True:
+                    block = await part.read_chunk()
+                    if not block:
+                        break
+                    upload.write(block)
+                names.append(os.path.basename(part.filename))
+        return list(uploads), names, append
+
+    async def close(self, app: web.Application):
+        self.executor.shutdown(wait=False)
+
+
+def create_app(processor: DocumentProcessor, workspace: Optional[str] = None, chat_model: Optional[Any] = None,
+               threads: int = DEFAULT_API_THREADS, ingest_workers: Optional[int] = None,
+               ingest_root: Optional[str] = None) -> web.Application:
+    """Build the aiohttp application serving ``processor``.
+
+    ``/ingest`` only accepts server-side paths when ``ingest_root`` is set,
+    and then only paths under it (relative ones are taken from it).
+    """
+    service = DocumentService(processor, workspace, chat_model, threads, ingest_workers, ingest_root)
+    app = web.Application(client_max_size=MAX_REQUEST_BYTES)
+    app["service"] = service
+    app.router.add_get("/health", service.health)
+    app.router.add_get("/summary", service.summary)
+    app.router.add_get("/metrics", service.metrics)
+    app.router.add_post("/search", service.search)
+    app.router.add_post("/chat", service.chat)
+    app.router.add_post("/ingest", service.ingest)
+    app.on_cleanup.append(service.close)
+    return app
+
+
+def main(argv: Optional[List[str]] = None):
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="HTTP API for document ingest, search and chat")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workspace", default=None,
+                        help="Workspace folder to load at startup and save after each ingest")
+    parser.add_argument("--cache-dir", default=".cache", help="Extraction and embedding cache folder")
+    parser.add_argument("--threads", type=int, default=DEFAULT_API_THREADS)
+    parser.add_argument("--ingest-workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--ingest-root", default=None,
+                        help="Folder whose PDFs /ingest may read by path (default: uploads only)")
+    parser.add_argument("--embeddings", default="openai", choices=EMBEDDING_BACKENDS,
+                        help="Embedding backend for a new workspace (a saved one keeps its own)")
+    args = parser.parse_args(argv)
+
+    openai_api_key = os.getenv("OPENAI_API_KEY", "")
+    if args.workspace and os.path.exists(os.path.join(args.workspace, "manifest.json")):
+        processor = DocumentProcessor.load(args.workspace, openai_api_key, cache_dir=args.cache_dir)
+    else:
+        processor = DocumentProcessor(openai_api_key, cache_dir=args.cache_dir, embedding_backend=args.embeddings)
+
+    app = create_app(processor, args.workspace, threads=args.threads, ingest_workers=args.ingest_workers,
+                     ingest_root=args.ingest_root)
+    print(f"🌐 Serving {processor.get_document_summary().get('total_documents', 0)} documents "
+          f"on http://{args.host}:{args.port}")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,33 @@
 import streamlit as st
 import os
-import tempfile
 import pandas as pd
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import time
-from document_processor import DocumentProcessor
+import uuid
+from langchain_core.embeddings import Embeddings
+from document_processor import DocumentProcessor, DEFAULT_PREVIEW_PAGES
+from field_extraction import extract_result_fields
 from dotenv import load_dotenv
 import json
 
 # Load environment variables
 load_dotenv()
 
+# On-disk cache for extracted documents, shared across sessions
+CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+# Embedding backends offered in the sidebar
+EMBEDDING_BACKEND_LABELS = {"openai": "OpenAI API", "local": "Local (offline, CPU)"}
+
+# Chunk units offered in the sidebar, with (min, max, default) chunk size and overlap for each
+CHUNK_UNIT_OPTIONS = {
+    "characters": {"label": "Characters", "size": (500, 2000, 1000), "overlap": (100, 500, 200)},
+    "tokens": {"label": "Tokens", "size": (100, 1000, 250), "overlap": (0, 200, 50)}
+}
+
+# Folder holding each session's persisted index, so a restart does not require reprocessing
+WORKSPACES_DIR = os.getenv("DOCUMENT_WORKSPACES_DIR", os.path.join(CACHE_DIR, "workspaces"))
+
 # Page configuration
 st.set_page_config(
     page_title="Document Intelligence & AI Chat",
@@ -244,57 +261,95 @@ def initialize_session_state():
         st.session_state.chat_model = None
     if 'extracted_data' not in st.session_state:
         st.session_state.extracted_data = []
+    if 'last_results' not in st.session_state:
+        st.session_state.last_results = None
+    if 'workspace_dir' not in st.session_state:
+        # Sessions save to their own folder unless the user picks another
+        st.session_state.workspace_dir = os.path.join(WORKSPACES_DIR, uuid.uuid4().hex[:12])
 
-def save_uploaded_files(uploaded_files) -> List[str]:
-    """Save uploaded files to temporary directory and return file paths."""
-    file_paths = []
-    temp_dir = tempfile.mkdtemp()
-    
-    for uploaded_file in uploaded_files:
-        file_path = os.path.join(temp_dir, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        file_paths.append(file_path)
-    
-    return file_paths
+@st.cache_resource(show_spinner=False)
+def get_embeddings_client(openai_api_key: str, embedding_backend: str = "openai") -> Embeddings:
+    """Embeddings client, created once per API key and backend and shared across reruns."""
+    return DocumentProcessor.create_embeddings(embedding_backend, openai_api_key)
 
-def extract_document_fields(text: str, filename: str) -> Dict[str, Any]:
-    """Extract meaningful fields from document text."""
-    fields = {
-        "Document Name": filename,
-        "Total Words": len(text.split()),
-        "Total Characters": len(text),
-        "Estimated Pages": max(1, len(text.split()) // 250),
-        "Language": "English",  # Could be enhanced with language detection
-        "Document Type": "PDF Document",
-        "Processing Date": pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
+@st.cache_resource(show_spinner=False)
+def get_chat_model(openai_api_key: str):
+    """Chat model, created once per API key and shared across reruns."""
+    return DocumentProcessor.create_chat_model(openai_api_key)
+
+def create_processor(openai_api_key: str, embedding_backend: str = "openai",
+                     chunk_settings: Optional[Dict[str, Any]] = None) -> DocumentProcessor:
+    """New processor reusing the cached embeddings client; ``chunk_settings`` go to the constructor."""
+    return DocumentProcessor(openai_api_key, cache_dir=CACHE_DIR, embedding_backend=embedding_backend,
+                             embeddings=get_embeddings_client(openai_api_key, embedding_backend),
+                             **(chunk_settings or {}))
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def read_chunk_records(workspace_path: str, saved_at: float):
+    """Chunk ids and metadata of a saved workspace, read once per save (``saved_at`` is the manifest mtime).
     
-    # Extract common business document fields
-    if any(keyword in text.lower() for keyword in ['invoice', 'bill', 'receipt']):
-        fields["Document Category"] = "Financial Document"
-    elif any(keyword in text.lower() for keyword in ['contract', 'agreement', 'terms']):
-        fields["Document Category"] = "Legal Document"
-    elif any(keyword in text.lower() for keyword in ['report', 'analysis', 'summary']):
-        fields["Document Category"] = "Report Document"
-    elif any(keyword in text.lower() for keyword in ['email', 'message', 'communication']):
-        fields["Document Category"] = "Communication Document"
-    else:
-        fields["Document Category"] = "General Document"
-    
-    # Extract potential key topics (simple keyword extraction)
-    words = text.lower().split()
-    word_freq = {}
-    for word in words:
-        if len(word) > 4 and word.isalpha():
-            word_freq[word] = word_freq.get(word, 0) + 1
-    
-    top_words = sorted(word_freq.items(), key=lambda x: x[1], reverse=True)[:5]
-    fields["Key Topics"] = ", ".join([word for word, freq in top_words])
-    
-    return fields
+    Processors only read them, so every session opening the workspace shares one copy.
+    """
+    return DocumentProcessor.read_chunk_records(workspace_path)
+
+def open_workspace(workspace_path: str, openai_api_key: str) -> DocumentProcessor:
+    """A processor of this session's own over a saved workspace.
+    
+    Processors are changed by appends, so they are never shared between
+    sessions; the index and texts are memory-mapped, which keeps this cheap.
+    """
+    saved_at = os.path.getmtime(os.path.join(workspace_path, "manifest.json"))
+    embedding_backend = DocumentProcessor.workspace_embedding_backend(workspace_path)
+    return DocumentProcessor.load(workspace_path, openai_api_key,
+                                  chunk_records=read_chunk_records(workspace_path, saved_at),
+                                  cache_dir=CACHE_DIR, embedding_backend=embedding_backend,
+                                  embeddings=get_embeddings_client(openai_api_key, embedding_backend))
+
+def build_document_views(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-document field tables and previews for a processing run."""
+    views = []
+    for doc in results["successful"]:
+        # Extract fields for this document from its first pages (counts cover the whole document)
+        extracted_fields = extract_result_fields(doc)
+        
+        # Create a proper data table for better visibility
+        field_data = []
+        for field, value in extracted_fields.items():
+            field_data.append({
+                "Field": field,
+                "Value": str(value)
+            })
+        
+        text = doc["text"]
+        views.append({
+            "file_name": doc["file_name"],
+            "chunk_count": doc["chunk_count"],
+            "word_count": doc["word_count"],
+            "char_count": doc["char_count"],
+            "page_count": doc["page_count"],
+            "fields": pd.DataFrame(field_data),
+            "preview": text[:1000] + "..." if len(text) > 1000 else text
+        })
+    return views
+
+def session_results(results: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of processing results without each file's full text and chunks, to keep in the session.
+    
+    The chunks already live in the processor's docstore; keeping them here too
+    would hold every document in memory twice more.
+    """
+    slim = dict(results)
+    for group in ("successful", "failed"):
+        slim[group] = [{key: value for key, value in result.items() if key not in ("text", "chunks")}
+                       for result in results[group]]
+    return slim
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_document_summary(fingerprint: str, _processor: DocumentProcessor) -> Dict[str, Any]:
+    """Document summary of a processor, recomputed only when its document set changes."""
+    return _processor.get_document_summary()
 
-def display_document_summary(results: Dict[str, Any]):
+def display_document_summary(results: Dict[str, Any], views: List[Dict[str, Any]]):
     """Display a beautiful, comprehensive summary of processed documents."""
     st.markdown('<div class="section-header">📊 Document Processing Results</div>', unsafe_allow_html=True)
     
@@ -333,14 +388,24 @@ def display_document_summary(results: Dict[str, Any]):
         </div>
         """, unsafe_allow_html=True)
     
+    # Cache effectiveness for this run
+    if "embedding_cache" in results:
+        cache = results["embedding_cache"]
+        st.caption(f"♻️ Embedding cache: {cache['hits']} reused, {cache['misses']} newly embedded "
+                   f"({cache['hit_ratio']:.0%} hit ratio)")
+    
+    # Where the processing time went
+    if "timings" in results:
+        timings = results["timings"]
+        st.caption(f"⏱️ Extraction {timings['extraction']:.2f}s · embedding {timings.get('embed', 0):.2f}s · "
+                   f"indexing {timings.get('index_build', 0):.2f}s · total {timings['total']:.2f}s "
+                   f"({results['pages_per_second']:.1f} pages/s)")
+    
     # Display successful files with beautiful formatting
     if results["successful"]:
         st.markdown("### 📋 Processed Documents")
         
-        for i, doc in enumerate(results["successful"], 1):
-            # Extract fields for this document
-            extracted_fields = extract_document_fields(doc["text"], doc["file_name"])
-            
+        for i, doc in enumerate(views, 1):
             with st.expander(f"📄 Document {i}: {doc['file_name']}", expanded=True):
                 # Document metrics
                 col1, col2, col3, col4 = st.columns(4)
@@ -352,25 +417,16 @@ def display_document_summary(results: Dict[str, Any]):
                     st.metric("Words", f"{doc['word_count']:,}")
                 
                 with col3:
-                    st.metric("Characters", f"{len(doc['text']):,}")
+                    st.metric("Characters", f"{doc['char_count']:,}")
                 
                 with col4:
-                    st.metric("Pages", f"~{max(1, doc['word_count'] // 250)}")
+                    st.metric("Pages", doc["page_count"])
                 
                 # Extracted fields in a beautiful, well-formatted table
                 st.markdown("**📋 Extracted Document Information:**")
                 
-                # Create a proper data table for better visibility
-                field_data = []
-                for field, value in extracted_fields.items():
-                    field_data.append({
-                        "Field": field,
-                        "Value": str(value)
-                    })
-                
-                df_fields = pd.DataFrame(field_data)
                 st.dataframe(
-                    df_fields, 
+                    doc["fields"], 
                     use_container_width=True,
                     hide_index=True,
                     column_config={
@@ -388,8 +444,8 @@ def display_document_summary(results: Dict[str, Any]):
                 )
                 
                 # Content preview - make it properly visible
-                if doc["text"]:
-                    preview_text = doc["text"][:1000] + "..." if len(doc["text"]) > 1000 else doc["text"]
+                if doc["preview"]:
+                    preview_text = doc["preview"]
                     st.markdown("**📖 Content Preview:**")
                     
                     # Create a beautiful content preview box
@@ -432,8 +488,12 @@ def display_document_summary(results: Dict[str, Any]):
         </div>
         """, unsafe_allow_html=True)
 
-def display_chat_interface():
-    """Display a beautiful, professional chat interface."""
+def display_chat_interface(stream_answers: bool = True, context_tokens: int = 3000):
+    """Display a beautiful, professional chat interface.
+    
+    Answers render token by token when ``stream_answers``; ``context_tokens``
+    caps the document context sent with each question.
+    """
     st.markdown('<div class="section-header">💬 AI Document Assistant</div>', unsafe_allow_html=True)
     
     st.markdown("""
@@ -463,55 +523,54 @@ def display_chat_interface():
     # Process chat input
     if send_button and user_input:
         if st.session_state.chat_model and st.session_state.processor:
-            with st.spinner("🤔 AI is thinking..."):
+            try:
+                # Retrieve once: the same scored chunks feed the prompt and the source list
+                with st.spinner("🔍 Searching your documents..."):
+                    answer = st.session_state.processor.stream_answer(
+                        user_input, st.session_state.chat_model, k=5, mode="hybrid", max_tokens=context_tokens)
+                
+                # Clicking Stop reruns the script, which interrupts the answer below
+                st.button("⏹️ Stop answer", key="stop_answer")
                 try:
-                    # Get context from documents
-                    context = st.session_state.processor.get_context_for_query(user_input, k=5)
-                    
-                    # Create enhanced prompt with context
-                    prompt = f"""You are an intelligent document assistant. Based on the following document context, please provide a helpful and accurate response to the user's question.
-
-Document Context:
-{context}
-
-User Question: {user_input}
-
-Instructions:
-- Provide a comprehensive and well-structured response
-- If the context contains relevant information, use it to answer the question
-- If the context doesn't contain enough information, clearly state this
-- Be specific and cite relevant parts of the documents when possible
-- Format your response in a clear, easy-to-read manner
-- If applicable, suggest follow-up questions the user might want to ask
-
-Response:"""
-                    
-                    # Get AI response
-                    response = st.session_state.chat_model.invoke(prompt)
-                    
-                    # Get source documents for display
-                    source_docs = st.session_state.processor.search_documents(user_input, k=3)
-                    sources = [doc.metadata.get("source", "Unknown") for doc in source_docs]
-                    
-                    # Add to chat history
-                    st.session_state.chat_history.append({
-                        "user": user_input,
-                        "ai": response.content,
-                        "sources": sources,
-                        "timestamp": pd.Timestamp.now().strftime("%H:%M:%S")
-                    })
-                    
-                    # Clear input by rerunning
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"❌ Error processing chat: {str(e)}")
+                    if stream_answers:
+                        st.markdown("**🤖 AI Assistant:**")
+                        st.write_stream(answer)
+                    else:
+                        with st.spinner("🤔 AI is thinking..."):
+                            answer.consume()
+                finally:
+                    # Record the turn, including a partial answer when it was stopped
+                    answer.close()
+                    if answer.text:
+                        st.session_state.chat_history.append({
+                            "user": user_input,
+                            "ai": answer.text,
+                            "sources": answer.sources,
+                            "timestamp": pd.Timestamp.now().strftime("%H:%M:%S"),
+                            "ttft": answer.ttft,
+                            "latency": answer.latency,
+                            "cancelled": answer.cancelled,
+                            "cached": answer.cached,
+                            "context_tokens": answer.context_tokens,
+                            "tokens_saved": answer.tokens_saved
+                        })
+                
+                # Clear input by rerunning
+                st.rerun()
+                
+            except Exception as e:
+                st.error(f"❌ Error processing chat: {str(e)}")
+        elif st.session_state.processor:
+            st.error("❌ Please enter your OpenAI API key in the sidebar to chat about the documents.")
         else:
             st.error("❌ Please process documents first to enable chat functionality.")
     
     # Display chat history
     if st.session_state.chat_history:
         st.markdown("### 💬 Conversation History")
+        answer_cache = st.session_state.processor.answer_cache.stats()
+        st.caption(f"⚡ Answer cache: {answer_cache['hits']} hits, {answer_cache['misses']} misses "
+                   f"({answer_cache['hit_ratio']:.0%} hit ratio)")
         
         for i, chat in enumerate(st.session_state.chat_history):
             # User message
@@ -530,6 +589,19 @@ Response:"""
             </div>
             """, unsafe_allow_html=True)
             
+            # Response timing
+            if chat.get("latency") is not None:
+                timing = f"⏱️ Total {chat['latency']:.2f}s"
+                if chat.get("ttft") is not None:
+                    timing = f"⏱️ First token {chat['ttft']:.2f}s · total {chat['latency']:.2f}s"
+                if chat.get("cancelled"):
+                    timing += " · ⏹️ stopped"
+                if chat.get("cached"):
+                    timing += " · ⚡ cached answer"
+                elif chat.get("context_tokens"):
+                    timing += f" · 🧮 {chat['context_tokens']} context tokens ({chat['tokens_saved']} saved)"
+                st.caption(timing)
+            
             # Sources
             if chat["sources"]:
                 unique_sources = list(set(chat["sources"]))
@@ -542,6 +614,32 @@ Response:"""
         st.session_state.chat_history = []
         st.rerun()
 
+def display_diagnostics():
+    """Sidebar panel with the processor's stage timings, counters and metric exports."""
+    processor = st.session_state.processor
+    with st.expander("📈 Diagnostics"):
+        if processor is None:
+            st.caption("No processor yet. Process or open documents to collect metrics.")
+            return
+        
+        snapshot = processor.metrics_snapshot()
+        if snapshot["stages"]:
+            st.dataframe(pd.DataFrame([
+                {"Stage": stage, "Runs": stats["count"], "Total (s)": round(stats["total"], 3),
+                 "p50 (ms)": round(stats["p50"] * 1000, 1), "p95 (ms)": round(stats["p95"] * 1000, 1)}
+                for stage, stats in snapshot["stages"].items()
+            ]), hide_index=True, use_container_width=True)
+        else:
+            st.caption("No timings recorded yet.")
+        for counter, value in snapshot["counters"].items():
+            st.caption(f"{counter.replace('_', ' ')}: {value:g}")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("JSON", json.dumps(snapshot, indent=2), "metrics.json", "application/json")
+        with col2:
+            st.download_button("Prometheus", processor.export_metrics("prometheus"), "metrics.prom", "text/plain")
+
 def main():
     """Main application function."""
     initialize_session_state()
@@ -569,8 +667,28 @@ def main():
         # Document processing options
         st.markdown("## 📋 Processing Options")
         max_files = st.slider("Maximum files to process", 1, 10, 5)
-        chunk_size = st.slider("Chunk size", 500, 2000, 1000)
-        chunk_overlap = st.slider("Chunk overlap", 100, 500, 200)
+        chunk_unit = st.selectbox("✂️ Chunk unit", list(CHUNK_UNIT_OPTIONS),
+                                  format_func=lambda unit: CHUNK_UNIT_OPTIONS[unit]["label"],
+                                  help="Measure chunk size and overlap in characters or in tiktoken tokens")
+        size_min, size_max, size_default = CHUNK_UNIT_OPTIONS[chunk_unit]["size"]
+        overlap_min, overlap_max, overlap_default = CHUNK_UNIT_OPTIONS[chunk_unit]["overlap"]
+        chunk_size = st.slider(f"Chunk size ({chunk_unit})", size_min, size_max, size_default,
+                               key=f"chunk_size_{chunk_unit}")
+        # The overlap must stay below the chunk size
+        overlap_max = min(overlap_max, chunk_size // 2)
+        chunk_overlap = st.slider(f"Chunk overlap ({chunk_unit})", overlap_min, overlap_max,
+                                  min(overlap_default, overlap_max), key=f"chunk_overlap_{chunk_unit}")
+        chunk_settings = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap, "chunk_unit": chunk_unit}
+        stream_answers = st.checkbox("⚡ Stream chat answers", value=True,
+                                     help="Show answers token by token as they are generated")
+        context_tokens = st.slider("Context token budget", 500, 8000, 3000, step=250,
+                                   help="Maximum document tokens sent to the AI with each question")
+        st.text_input("💾 Save workspace to", key="workspace_dir",
+                      help="Folder the index is saved to after processing; each session has its own by default")
+        embedding_backend = st.selectbox(
+            "🧮 Embeddings", list(EMBEDDING_BACKEND_LABELS), format_func=EMBEDDING_BACKEND_LABELS.get,
+            help="Local embeddings index documents on this machine without an API key; "
+                 "chat still needs OpenAI")
         
         # App info
         st.markdown("## ℹ️ About")
@@ -605,36 +723,84 @@ def main():
             else:
                 st.success(f"✅ {len(uploaded_files)} file(s) selected for processing")
                 
+                # Optionally extend the current knowledge base instead of rebuilding it
+                append_to_existing = False
+                if st.session_state.processor is not None:
+                    append_to_existing = st.checkbox(
+                        "➕ Add to already processed documents",
+                        value=True,
+                        help="Only the new files are embedded; re-uploaded files replace their previous version"
+                    )
+                
                 # Process documents button
                 if st.button("🚀 Process Documents", type="primary", use_container_width=True):
-                    if not openai_api_key:
+                    if not openai_api_key and embedding_backend == "openai":
                         st.error("❌ Please enter your OpenAI API key in the sidebar")
                     else:
                         with st.spinner("🔄 Processing documents..."):
                             try:
-                                # Save uploaded files
-                                file_paths = save_uploaded_files(uploaded_files)
-                                
-                                # Initialize processor
-                                processor = DocumentProcessor(openai_api_key)
+                                # Initialize processor, or reuse the current one when appending
+                                if append_to_existing:
+                                    processor = st.session_state.processor
+                                    for key, value in chunk_settings.items():
+                                        setattr(processor, key, value)
+                                else:
+                                    processor = create_processor(openai_api_key, embedding_backend, chunk_settings)
                                 
-                                # Process documents
-                                results = processor.process_multiple_documents(file_paths)
+                                # Process the uploads in memory (extraction runs across all CPU cores);
+                                # only the first pages' text comes back for previews and fields
+                                results = processor.process_multiple_documents(
+                                    uploaded_files, parallel=True, append=append_to_existing,
+                                    source_names=[uploaded_file.name for uploaded_file in uploaded_files],
+                                    preview_pages=DEFAULT_PREVIEW_PAGES)
                                 
                                 # Update session state
                                 st.session_state.processor = processor
                                 st.session_state.documents_processed = True
-                                st.session_state.chat_model = processor.get_chat_model()
+                                st.session_state.chat_model = get_chat_model(openai_api_key) if openai_api_key else None
                                 
-                                # Display results
-                                display_document_summary(results)
+                                # Persist the index so it survives restarts and can be reopened
+                                if processor.vector_store is not None:
+                                    processor.save(st.session_state.workspace_dir)
+                                    st.info(f"💾 Workspace saved to {st.session_state.workspace_dir}")
+                                
+                                # Keep a slim copy of the results and their views so later reruns redraw them
+                                st.session_state.last_results = (session_results(results),
+                                                                 build_document_views(results))
                                 
                             except Exception as e:
                                 st.error(f"❌ Error processing documents: {str(e)}")
+        
+        # Display results of the latest processing run
+        if st.session_state.last_results is not None:
+            results, views = st.session_state.last_results
+            display_document_summary(results, views)
+        
+        # Reopen a previously processed workspace instead of uploading again
+        st.markdown('<div class="section-header">📂 Open Existing Workspace</div>', unsafe_allow_html=True)
+        workspace_path = st.text_input("Workspace folder", value=st.session_state.workspace_dir,
+                                       help="Folder written after documents are processed")
+        if st.button("📂 Open Workspace", use_container_width=True):
+            if not os.path.exists(os.path.join(workspace_path, "manifest.json")):
+                st.error("❌ No saved workspace found in that folder")
+            elif not openai_api_key and DocumentProcessor.workspace_embedding_backend(workspace_path) == "openai":
+                st.error("❌ Please enter your OpenAI API key in the sidebar")
+            else:
+                try:
+                    processor = open_workspace(workspace_path, openai_api_key)
+                    st.session_state.processor = processor
+                    st.session_state.documents_processed = True
+                    st.session_state.chat_model = get_chat_model(openai_api_key) if openai_api_key else None
+                    st.session_state.last_results = None
+                    summary = get_document_summary(processor.document_set_fingerprint(), processor)
+                    st.success(f"✅ Opened workspace with {summary['total_documents']} documents "
+                               f"and {summary['total_chunks']} chunks")
+                except Exception as e:
+                    st.error(f"❌ Error opening workspace: {str(e)}")
     
     with tab2:
         if st.session_state.documents_processed and st.session_state.chat_model:
-            display_chat_interface()
+            display_chat_interface(stream_answers, context_tokens)
         else:
             st.markdown("""
             <div class="info-banner">
@@ -656,7 +822,8 @@ def main():
         
         if st.session_state.documents_processed and st.session_state.processor:
             # Document summary
-            summary = st.session_state.processor.get_document_summary()
+            processor = st.session_state.processor
+            summary = get_document_summary(processor.document_set_fingerprint(), processor)
             
             col1, col2, col3 = st.columns(3)
             with col1:
@@ -669,10 +836,23 @@ def main():
             # Search functionality
             st.markdown("### 🔍 Search Documents")
             search_query = st.text_input("Search for specific content:", placeholder="Enter search terms...")
+            search_modes = {"Hybrid": "hybrid", "Semantic": "vector", "Keyword (policy / claim IDs)": "lexical"}
+            search_mode = st.radio("Search mode", list(search_modes), horizontal=True)
+            filter_col1, filter_col2 = st.columns(2)
+            with filter_col1:
+                selected_sources = st.multiselect("Only in documents", summary["document_sources"])
+            with filter_col2:
+                selected_categories = st.multiselect("Only in categories", summary["document_categories"])
+            search_filter = {}
+            if selected_sources:
+                search_filter["source"] = selected_sources
+            if selected_categories:
+                search_filter["category"] = selected_categories
             
             if search_query:
                 with st.spinner("🔍 Searching..."):
-                    search_results = st.session_state.processor.search_documents(search_query, k=5)
+                    search_results = st.session_state.processor.search_documents(
+                        search_query, k=5, mode=search_modes[search_mode], filter=search_filter or None)
                     
                     if search_results:
                         st.markdown(f"### Found {len(search_results)} relevant chunks:")
@@ -681,6 +861,9 @@ def main():
                                 st.text(doc.page_content)
                     else:
                         st.info("No relevant content found for your search query.")
+                
+                query_cache = st.session_state.processor.query_cache.stats()
+                st.caption(f"⚡ Query embedding cache: {query_cache['hits']} hits, {query_cache['misses']} misses")
             
             # Document sources
             st.markdown("### 📚 Document Sources")
@@ -692,6 +875,10 @@ def main():
                 ℹ️ <strong>No documents processed yet.</strong> Please upload and process documents first to explore them.
             </div>
             """, unsafe_allow_html=True)
+    
+    # Rendered last so it includes the work done in this run
+    with st.sidebar:
+        display_diagnostics()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the document pipeline.
+
+Generates a synthetic corpus of claim PDFs and times each stage against
+deterministic fake embedding and chat backends (or the built-in local
+embedding backend), so the numbers depend only on this code and the machine:
+- extraction
+- chunking
+- embedding
+- index build
+- end-to-end ingest
+- search
+- field extraction
+- prompt assembly
+- chat
+
+Each stage reports its throughput and, where work is done per item, latency
+percentiles. Peak RSS, the git commit and the processor's own stage metrics
+are recorded as well. Write the report to a file and pass it back as ``--baseline`` on a later commit to see
+the change per stage:
+
+    python benchmark.py --docs 200 --pages 5 --output baseline.json
+    python benchmark.py --docs 200 --pages 5 --baseline baseline.json
+
+``--chunker-pages`` instead times the offset-based chunker against
+LangChain's RecursiveCharacterTextSplitter on that many synthetic pages:
+
+    python benchmark.py --chunker-pages 1000000
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any, Optional, Callable, Iterable
+
+import faiss
+import numpy as np
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from chunking import TextChunker
+from document_processor import DocumentProcessor, create_faiss_index
+from field_extraction import FieldExtractor
+
+# Corpus defaults: documents, pages per document and words per page
+DEFAULT_DOCS = 50
+DEFAULT_PAGES = 4
+DEFAULT_WORDS_PER_PAGE = 300
+
+# Fake embedding width and number of timed queries
+DEFAULT_DIMENSIONS = 256
+DEFAULT_QUERIES = 200
+
+# Distinct synthetic pages cycled through by the chunker comparison
+DEFAULT_DISTINCT_PAGES = 1000
+
+# Words per line when laying out synthetic page text
+WORDS_PER_LINE = 12
+
+# Vocabulary for synthetic claim text
+_VOCABULARY = (
+    "policy holder reported water damage kitchen ceiling claim adjuster inspection vehicle collision "
+    "rear bumper repair estimate invoice receipt payment deductible coverage liability agreement contract "
+    "terms report analysis summary medical treatment hospital bill physician email message communication "
+    "property storm roof hail wind theft burglary police statement witness insured premium renewal "
+    "settlement approved denied pending review documentation photos appraisal replacement depreciation"
+).split()
+
+# Answer returned by the fake chat model
+_FAKE_ANSWER = ("Based on the documents, the policy holder reported water damage to the kitchen ceiling "
+                "and the adjuster approved the repair estimate.")
+
+
+def write_pdf(path: str, pages: List[str]) -> str:
+    """Write a minimal text-only PDF with one entry of ``pages`` per page."""
+    def escape(line):
+        return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page_text in enumerate(pages):
+        lines = " ".join(f"({escape(line)}) '" for line in page_text.split("\n"))
+        stream = f"BT /F1 10 Tf 12 TL 72 760 Td {lines} ET"
+        objects.append("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+
+def synthetic_page(rng: random.Random, doc_number: int, page_number: int, words: int) -> str:
+    """Claim-like page text with a claim number, a date and an amount among random vocabulary."""
+    header = (f"Claim number CLM-{doc_number:05d} page {page_number} dated "
+              f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} amount ${rng.randint(100, 99999):,}.00").split()
+    words = header + [rng.choice(_VOCABULARY) for _ in range(max(0, words - len(header)))]
+    return "\n".join(" ".join(words[i:i + WORDS_PER_LINE]) for i in range(0, len(words), WORDS_PER_LINE))
+
+
+def generate_corpus(directory: str, docs: int = DEFAULT_DOCS, pages: int = DEFAULT_PAGES,
+                    words_per_page: int = DEFAULT_WORDS_PER_PAGE, seed: int = 0) -> List[str]:
+    """Write ``docs`` synthetic claim PDFs into ``directory`` and return their paths.
+
+    The same arguments always produce byte-identical files.
+    """
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for n in range(docs):
+        page_texts = [synthetic_page(rng, n, p + 1, words_per_page) for p in range(pages)]
+        paths.append(write_pdf(os.path.join(directory, f"claim_{n:05d}.pdf"), page_texts))
+    return paths
+
+
+def synthetic_queries(count: int, seed: int = 1) -> List[str]:
+    """Distinct search questions built from the corpus vocabulary."""
+    rng = random.Random(seed)
+    return [f"{' '.join(rng.sample(_VOCABULARY, 4))} claim CLM-{n:05d}" for n in range(count)]
+
+
+def fake_chat_model() -> GenericFakeChatModel:
+    """Chat model streaming the same fixed answer for every question."""
+    return GenericFakeChatModel(messages=itertools.repeat(AIMessage(_FAKE_ANSWER)))
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p90/p99/max of latencies in seconds, reported in milliseconds."""
+    values = np.asarray(samples) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p90": float(np.percentile(values, 90)),
+            "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far, in MiB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def time_each(function: Callable[[Any], Any], items: Iterable[Any]) -> Dict[str, Any]:
+    """Call ``function`` on each item and report throughput and per-item latency."""
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        item_started = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - item_started)
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "items": len(latencies),
+            "per_second": len(latencies) / seconds if seconds else 0.0,
+            "latency_ms": percentiles(latencies) if latencies else {}}
+
+
+def time_once(function: Callable[[], Any], items: int) -> Dict[str, Any]:
+    """Time one call that handles ``items`` items at once."""
+    started = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "items": items, "per_second": items / seconds if seconds else 0.0}
+
+
+def compare_chunkers(pages: int, words_per_page: int = DEFAULT_WORDS_PER_PAGE, chunk_size: int = 1000,
+                     chunk_overlap: int = 200, seed: int = 0,
+                     distinct: int = DEFAULT_DISTINCT_PAGES) -> Dict[str, Any]:
+    """Time the recursive splitter and the offset-based chunker on ``pages`` pages.
+    
+    ``distinct`` generated pages are cycled so memory stays flat for any page
+    count. Both produce chunk texts, the chunker by slicing its spans.
+    """
+    rng = random.Random(seed)
+    texts = [synthetic_page(rng, n, 1, words_per_page) for n in range(min(pages, distinct))]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len)
+    chunker = TextChunker(chunk_size, chunk_overlap)
+    splitters = {
+        "recursive_splitter": splitter.split_text,
+        "offset_chunker": lambda text: [text[start:end] for start, end in chunker.split(text)]
+    }
+
+    report = {"config": {"pages": pages, "words_per_page": words_per_page, "chunk_size": chunk_size,
+                         "chunk_overlap": chunk_overlap, "seed": seed, "distinct": len(texts)}}
+    for name, split in splitters.items():
+        chunks = 0
+        started = time.perf_counter()
+        for text in itertools.islice(itertools.cycle(texts), pages):
+            chunks += len(split(text))
+        seconds = time.perf_counter() - started
+        report[name] = {"seconds": seconds, "items": pages, "per_second": pages / seconds if seconds else 0.0,
+                        "chunks": chunks}
+    report["speedup"] = report["recursive_splitter"]["seconds"] / report["offset_chunker"]["seconds"]
+    return report
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(docs: int = DEFAULT_DOCS, pages: int = DEFAULT_PAGES,
+                  words_per_page: int = DEFAULT_WORDS_PER_PAGE, queries: int = DEFAULT_QUERIES,
+                  dimensions: int = DEFAULT_DIMENSIONS, index_type: str = "auto", workers: Optional[int] = None,
+                  seed: int = 0, corpus_dir: Optional[str] = None, embeddings: str = "fake",
+                  progress: Callable[[str], None] = lambda message: None) -> Dict[str, Any]:
+    """Run every stage on a synthetic corpus and return the report.
+    
+    ``embeddings`` is ``"fake"`` (DeterministicFakeEmbedding of ``dimensions``
+    width) or ``"local"`` (the processor's local hashing backend).
+    """
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as scratch:
+        corpus_dir = corpus_dir or os.path.join(scratch, "corpus")
+        progress(f"📝 Generating {docs} documents × {pages} pages")
+        paths = generate_corpus(corpus_dir, docs, pages, words_per_page, seed)
+
+        if embeddings == "local":
+            processor = DocumentProcessor("offline", embedding_backend="local", index_type=index_type)
+        else:
+            processor = DocumentProcessor("offline", embeddings=DeterministicFakeEmbedding(size=dimensions),
+                                          index_type=index_type)
+        stages = {}
+
+        progress("📄 Extraction")
+        page_texts = []
+        stages["extraction"] = time_each(
+            lambda path: page_texts.extend(text for _, text in processor.iter_pdf_pages(path)), paths)
+        stages["extraction"]["pages_per_second"] = len(page_texts) / stages["extraction"]["seconds"]
+
+        progress("✂️ Chunking")
+        chunks = []
+        # Chunked with the processor's settings through the public chunker
+        chunker = TextChunker(processor.chunk_size, processor.chunk_overlap, processor.chunk_unit)
+        stages["chunking"] = time_each(
+            lambda text: chunks.extend(text[start:end] for start, end in chunker.split(text)), page_texts)
+        stages["chunking"]["chunks"] = len(chunks)
+
+        progress("🧮 Embedding")
+        vectors = []
+        stages["embedding"] = time_once(lambda: vectors.extend(processor.embedding_pipeline.embed(chunks)), len(chunks))
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        progress("🗂️ Index build")
+        built = {}
+
+        def build_index():
+            # Training and adding every vector, as the processor does
+            built["index"] = create_faiss_index(vectors, index_type)
+            built["index"].add(vectors)
+
+        stages["index_build"] = time_once(build_index, len(vectors))
+        stages["index_build"]["index"] = type(built["index"]).__name__
+        stages["index_build"]["vectors"] = int(built["index"].ntotal)
+
+        progress("🏭 End-to-end ingest")
+        results = {}
+        stages["ingest"] = time_once(lambda: results.update(processor.process_multiple_documents(
+            paths, parallel=workers != 1, max_workers=workers)), len(paths))
+        stages["ingest"]["pages_per_second"] = len(page_texts) / stages["ingest"]["seconds"]
+        stages["ingest"]["failed"] = len(results["failed"])
+
+        questions = synthetic_queries(queries, seed + 1)
+        for mode in ("vector", "lexical", "hybrid"):
+            progress(f"🔍 Search ({mode})")
+            processor.query_cache.clear()
+            stages[f"search_{mode}"] = time_each(lambda query: processor.retrieve(query, k=5, mode=mode), questions)
+
+        progress("🏷️ Field extraction")
+        extractor = FieldExtractor(cache_size=0)
+        texts = [(result["text"], result["file_name"]) for result in results["successful"]]
+        stages["field_extraction"] = time_each(lambda document: extractor.extract(*document), texts)
+
+        progress("🧩 Prompt assembly")
+        retrieved = {query: [doc for doc, _ in processor.retrieve(query, k=5, mode="vector")] for query in questions}
+        stages["prompt_assembly"] = time_each(
+            lambda query: processor.build_chat_prompt(query, processor.build_context(retrieved[query])["context"]),
+            questions)
+
+        progress("💬 Chat")
+        chat_model = fake_chat_model()
+        ttfts = []
+
+        def chat(query):
+            answer = processor.stream_answer(query, chat_model, use_cache=False)
+            answer.consume()
+            ttfts.append(answer.ttft)
+
+        stages["chat"] = time_each(chat, questions)
+        stages["chat"]["ttft_ms"] = percentiles(ttfts)
+
+    return {
+        "commit": _git_commit(),
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "faiss": faiss.__version__, "numpy": np.__version__},
+        "config": {"docs": docs, "pages": pages, "words_per_page": words_per_page, "queries": queries,
+                   "dimensions": dimensions, "index_type": index_type, "workers": workers, "seed": seed,
+                   "embeddings": embeddings},
+        "stages": stages,
+        "pipeline_metrics": processor.metrics_snapshot(),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per-stage throughput and p50 latency of ``current`` relative to ``baseline``."""
+    rows = []
+    for stage, stats in current["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if not before:
+            continue
+        row = {"stage": stage, "per_second": stats["per_second"],
+               "throughput_change": stats["per_second"] / before["per_second"] - 1 if before["per_second"] else None}
+        if stats.get("latency_ms") and before.get("latency_ms"):
+            row["p50_ms"] = stats["latency_ms"]["p50"]
+            row["p50_change"] = stats["latency_ms"]["p50"] / before["latency_ms"]["p50"] - 1
+        rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmark of extraction, indexing, search and chat")
+    parser.add_argument("--docs", type=int, default=DEFAULT_DOCS)
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="Pages per document")
+    parser.add_argument("--words-per-page", type=int, default=DEFAULT_WORDS_PER_PAGE, help="Text density")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--embeddings", default="fake", choices=("fake", "local"),
+                        help="Deterministic fake embedder, or the local hashing backend")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="Fake embedding width")
+    parser.add_argument("--index-type", default="auto")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes for ingest (1 = serial)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", default=None, help="Keep the generated PDFs here instead of a temp folder")
+    parser.add_argument("--output", default=None, help="Write the JSON report to this file")
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    parser.add_argument("--chunker-pages", type=int, default=None,
+                        help="Only compare the chunker with the recursive splitter on this many pages")
+    args = parser.parse_args(argv)
+
+    if args.chunker_pages:
+        print(json.dumps(compare_chunkers(args.chunker_pages, args.words_per_page, seed=args.seed), indent=2))
+        return 0
+
+    report = run_benchmark(args.docs, args.pages, args.words_per_page, args.queries, args.dimensions,
+                           args.index_type, args.workers, args.seed, args.corpus_dir, args.embeddings,
+                           progress=lambda message: print(message, file=sys.stderr))
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        report["comparison"] = {"baseline_commit": baseline.get("commit"),
+                                "stages": compare_reports(baseline, report)}
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Offset-based text chunking.
+
+``TextChunker`` splits a page into overlapping chunks of at most
+``chunk_size`` characters or tiktoken tokens. It returns their
+``[start, end)`` character spans, so no chunk text is copied until a caller
+slices it out.
+
+A chunk ends at the coarsest break (blank line, line end, space) in the back
+part of its window, or at the window's end when there is none. The next chunk
+starts at the first word boundary ``chunk_overlap`` units before that end.
+Break searches use ``str.rfind`` over a bounded window. Each character is
+examined a bounded number of times, so the cost is linear in the page length
+rather than in the number of separators and merges, as it is for a recursive
+splitter.
+"""
+
+import bisect
+import logging
+import re
+from typing import List, Optional, Sequence
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+# Units a chunk size can be measured in
+CHUNK_UNITS = ("characters", "tokens")
+
+# Break points tried in order, coarsest first
+SEPARATORS = ("\n\n", "\n", " ")
+
+# Characters per token assumed when the tiktoken encoding is unavailable (e.g. offline)
+CHARS_PER_TOKEN = 4
+
+# Next word start at or after a position
+_WORD_START = re.compile(r"\s+")
+
+_encoding = None
+
+
+def get_token_encoding() -> Optional["tiktoken.Encoding"]:
+    """The cl100k_base tiktoken encoding, or None when it cannot be loaded offline."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"tiktoken encoding unavailable, estimating token counts: {str(e)}")
+            _encoding = False
+    return _encoding or None
+
+
+class TextChunker:
+    """Splits text into overlapping chunks and returns their character spans.
+
+    ``unit`` is ``"characters"`` or ``"tokens"`` (counted with ``encoding``,
+    by default tiktoken's cl100k_base). Without an encoding, tokens are
+    estimated as ``CHARS_PER_TOKEN`` characters each. Spans exclude leading
+    and trailing whitespace.
+    """
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200, unit: str = "characters",
+                 encoding: Optional[object] = None):
+        if unit not in CHUNK_UNITS:
+            raise ValueError(f"Unknown chunk unit: {unit}")
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, not {chunk_size}")
+        if not 0 <= chunk_overlap < chunk_size:
+            raise ValueError(f"chunk_overlap must be at least 0 and smaller than chunk_size ({chunk_size}), "
+                             f"not {chunk_overlap}")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        self.encoding = encoding
+
+    @property
+    def settings(self) -> tuple:
+        return self.chunk_size, self.chunk_overlap, self.unit
+
+    def split(self, text: str) -> List[List[int]]:
+        """[start, end) character spans of the chunks of ``text``."""
+        if self.unit == "characters":
+            return self._spans(text, self.chunk_size, self.chunk_overlap)
+        encoding = self.encoding or get_token_encoding()
+        if encoding is None:
+            return self._spans(text, self.chunk_size * CHARS_PER_TOKEN, self.chunk_overlap * CHARS_PER_TOKEN)
+        _, offsets = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+        return self._spans(text, self.chunk_size, self.chunk_overlap, offsets)
+
+    @staticmethod
+    def _spans(text: str, size: int, overlap: int, offsets: Optional[Sequence[int]] = None) -> List[List[int]]:
+        """Chunk spans with sizes counted in characters, or in tokens starting at the character ``offsets``."""
+        length = len(text)
+        if offsets is None:
+            units = length
+            position = lambda unit: unit
+            unit_at = lambda character: character
+        else:
+            units = len(offsets)
+            position = lambda unit: offsets[unit] if unit < units else length
+            unit_at = lambda character: bisect.bisect_left(offsets, character)
+        # Breaks are looked for past this share of the window, so consecutive chunks always advance
+        earliest_break = (size + overlap) // 2
+
+        spans = []
+        match = _WORD_START.match(text)
+        start = match.end() if match else 0
+        while start < length:
+            first = unit_at(start)
+            limit = min(position(first + size), length)
+            end = limit
+            if limit < length:
+                low = max(position(first + earliest_break), start + 1)
+                for separator in SEPARATORS:
+                    found = text.rfind(separator, low, limit + len(separator))
+                    if found >= 0:
+                        end = found
+                        break
+
+            stop = end
+            while stop > start and text[stop - 1].isspace():
+                stop -= 1
+            if stop > start:
+                spans.append([start, stop])
+            trailing = _WORD_START.match(text, end)
+            if end >= length or (trailing and trailing.end() == length):
+                break
+
+            # Start the overlap at a word boundary, and always move forward
+            restart = max(position(unit_at(end) - overlap), start + 1) if overlap else end
+            if restart < end and not text[restart - 1].isspace():
+                # Mid-word: skip to the next word, or drop the overlap when no word starts before the end
+                match = _WORD_START.search(text, restart, end)
+                restart = match.end() if match else end
+            match = _WORD_START.match(text, restart)
+            start = match.end() if match else restart
+        return spans
@@ -1,95 +1,1931 @@
 import os
+import io
+import re
+import json
+import mmap
+import time
+import hashlib
+import signal
+import shutil
+import sqlite3
 import tempfile
+import threading
+import uuid
+import random
 import logging
-from typing import List, Dict, Any, Optional
+import contextlib
+from array import array
+from collections import OrderedDict, deque
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable, Union, BinaryIO
 import PyPDF2
+import faiss
 import pandas as pd
 import numpy as np
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.base import AddableMixin, Docstore
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 # Note: ConversationalRetrievalChain is not available in the current LangChain version
 # We'll implement a simpler chat interface
 from langchain_openai import ChatOpenAI
 import streamlit as st
+from chunking import CHARS_PER_TOKEN, TextChunker, get_token_encoding
+from field_extraction import DEFAULT_DOCUMENT_CATEGORY, category_keywords, classify_keywords, find_date
+from local_embeddings import HashingEmbeddings, is_local_embedding_model
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default per-file timeout (seconds) for the process-pool ingestion mode
+DEFAULT_FILE_TIMEOUT = 300
+
+# Version of the extraction + chunking logic; bump to invalidate cached extractions
+EXTRACTOR_VERSION = 2
+
+# Pages of text kept in processing results for previews and field extraction
+DEFAULT_PREVIEW_PAGES = 3
+
+# Default size bound for the on-disk extraction cache
+DEFAULT_EXTRACTION_CACHE_BYTES = 512 * 1024 * 1024
+
+# In-memory PDFs up to this size are parsed in place and sent to ingest workers as bytes;
+# larger ones, and unseekable streams past this size, go through temporary files
+IN_MEMORY_PDF_MAX_BYTES = 64 * 1024 * 1024
+
+# Fraction of tombstoned vectors in the index that triggers a compaction
+COMPACTION_RATIO = 0.25
+
+# Embedding stage defaults: tokens per request batch, inputs per batch and concurrent batches
+DEFAULT_EMBEDDING_BATCH_TOKENS = 50000
+DEFAULT_EMBEDDING_BATCH_SIZE = 2048
+DEFAULT_EMBEDDING_CONCURRENCY = 4
+
+# Query embedding cache defaults: entries kept and seconds before an entry expires
+DEFAULT_QUERY_CACHE_SIZE = 1024
+DEFAULT_QUERY_CACHE_TTL = 3600
+
+# Answer cache defaults: entries kept, seconds before an entry expires and the cosine
+# similarity above which a new question reuses a stored answer
+DEFAULT_ANSWER_CACHE_SIZE = 256
+DEFAULT_ANSWER_CACHE_TTL = 3600
+DEFAULT_ANSWER_CACHE_SIMILARITY = 0.95
+
+# Retrievers a search can use
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid")
+
+# Reciprocal rank fusion constant and candidates fetched per retriever in hybrid mode
+RRF_K = 60
+HYBRID_CANDIDATES = 50
+
+# Over-fetch factor for filtered searches whose conditions are only on chunk-level metadata
+FILTER_FETCH_MULTIPLIER = 20
+
+# Metadata keys that are constant across a document's chunks; filters on them use per-source partitions
+DOCUMENT_FILTER_KEYS = ("source", "category", "date", "ingest_id")
+
+# Integer chunk metadata that ChunkStore keeps in typed columns rather than per-chunk dicts
+CHUNK_INT_FIELDS = ("chunk_id", "page", "start_index", "end_index")
+
+# ANN index selection: supported index types, "auto" size thresholds and search/training defaults
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "sq8", "ivf_sq8", "ivf_pq")
+FLAT_INDEX_MAX_VECTORS = 50000
+HNSW_INDEX_MAX_VECTORS = 1000000
+INDEX_TRAIN_SAMPLE = 100000
+# Index types "auto" picks, smallest corpus first; an append that crosses into a later one rebuilds the index
+AUTO_INDEX_TYPES = ("flat", "hnsw", "ivf_sq8")
+# 8-bit PQ trains 256 centroids per sub-quantizer, so smaller corpora get an SQ8 index instead
+PQ_MIN_TRAINING_VECTORS = 256
+HNSW_M = 32
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+
+# Default token budget for the document context of a chat prompt
+DEFAULT_CONTEXT_TOKENS = 3000
+
+# Prompt sent to the chat model; filled with the retrieved context and the user's question
+CHAT_PROMPT_TEMPLATE = """You are an intelligent document assistant. Based on the following document context, please provide a helpful and accurate response to the user's question.
+
+Document Context:
+{context}
+
+User Question: {question}
+
+Instructions:
+- Provide a comprehensive and well-structured response
+- If the context contains relevant information, use it to answer the question
+- If the context doesn't contain enough information, clearly state this
+- Be specific and cite relevant parts of the documents when possible
+- Format your response in a clear, easy-to-read manner
+- If applicable, suggest follow-up questions the user might want to ask
+
+Response:"""
+
+# Embedding backends selectable by name: the OpenAI API, or hashed features computed on the CPU
+EMBEDDING_BACKENDS = ("openai", "local")
+
+# Most recent durations kept per stage for latency percentiles
+METRICS_SAMPLE_SIZE = 1024
+
+# Name prefix of exported Prometheus metrics
+METRICS_PREFIX = "claims"
+
+# On-disk workspace layout version written by DocumentProcessor.save
+WORKSPACE_FORMAT_VERSION = 1
+
+# Processor owned by each ingestion pool worker, created once per process
+_worker_processor = None
+
+
+class DocumentTimeoutError(BaseException):
+    """Raised inside an ingestion worker when a document exceeds its time budget.
+
+    Derives from BaseException so the broad ``except Exception`` handlers in the
+    extraction path (ours and PyPDF2's) cannot swallow it.
+    """
+
+
+def _raise_document_timeout(signum, frame):
+    raise DocumentTimeoutError()
+
+
+def _init_ingest_worker(processor_kwargs: Dict[str, Any]):
+    """Create the per-process DocumentProcessor used by pool workers."""
+    global _worker_processor
+    _worker_processor = DocumentProcessor(**processor_kwargs)
+    # The parent owns eviction, so workers never scan the cache directory
+    if _worker_processor.extraction_cache is not None:
+        _worker_processor.extraction_cache.evict = False
+
+
+def _process_document_worker(file_path: "PDFSource", file_name: str, timeout: Optional[float],
+                             preview_pages: Optional[int] = None) -> Dict[str, Any]:
+    """Process one document inside a pool worker, enforcing the per-file timeout."""
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_document_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return _worker_processor.process_single_document(file_path, file_name, preview_pages)
+    except DocumentTimeoutError:
+        logger.error(f"Timed out processing {file_name} after {timeout}s")
+        return DocumentProcessor._failed_result(file_name, f"Processing timed out after {timeout}s")
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+# A PDF to process: a file path, its bytes, or a binary file object (such as a Streamlit upload)
+PDFSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only raw stream over a bytes-like object, reading it in place."""
+    
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def readinto(self, target) -> int:
+        count = max(0, min(len(target), len(self._view) - self._position))
+        target[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(0, base + offset)
+        return self._position
+    
+    def tell(self) -> int:
+        return self._position
+    
+    def close(self):
+        self._view.release()
+        super().close()
+
+
+def _is_seekable_stream(source: Any) -> bool:
+    seekable = getattr(source, "seekable", None)
+    return callable(seekable) and seekable()
+
+
+@contextlib.contextmanager
+def open_pdf_source(source: PDFSource, spool_bytes: int = IN_MEMORY_PDF_MAX_BYTES) -> Iterator[BinaryIO]:
+    """Open a PDF source as a seekable binary stream positioned at its start.
+    
+    Paths are opened from disk and bytes-like objects are read in place,
+    without a copy. Seekable file objects are rewound and used as they are
+    (and left open). Other streams are copied into a temporary file that
+    stays in memory up to ``spool_bytes`` and is deleted on exit.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as file:
+            yield file
+    elif isinstance(source, bytes):
+        yield io.BytesIO(source)
+    elif isinstance(source, (bytearray, memoryview)):
+        with io.BufferedReader(_BufferReader(source)) as stream:
+            yield stream
+    elif _is_seekable_stream(source):
+        source.seek(0)
+        yield source
+    else:
+        with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as spooled:
+            shutil.copyfileobj(source, spooled)
+            spooled.seek(0)
+            yield spooled
+
+
+class ExtractionCache:
+    """Content-addressed on-disk cache of extracted page text and chunk boundaries.
+    
+    Entries are JSON-lines files (one ``[page_number, text, [[start, end], ...]]``
+    record per page) named by a key derived from the SHA-256 of the PDF bytes,
+    the extractor version and the chunking parameters. Files are written
+    atomically, so pool workers can share one cache directory. Least recently
+    used entries (by mtime, refreshed on every hit) are evicted once the
+    directory grows beyond ``max_bytes``.
+    
+    The directory is only scanned when its size is first needed and when the
+    entries listed by the last scan run out during eviction. With
+    ``evict=False`` (pool workers) it is never scanned; the process owning the
+    pool accounts for their writes through ``record_written``.
+    """
+    
+    def __init__(self, cache_dir: str, max_bytes: int = DEFAULT_EXTRACTION_CACHE_BYTES, evict: bool = True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict = evict
+        self.hits = 0
+        self.misses = 0
+        # Bytes of entries written by this instance
+        self.bytes_written = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size: Optional[int] = None
+        # Entries of the last scan not yet evicted, least recently used first
+        self._lru: deque = deque()
+    
+    @staticmethod
+    def file_digest(source: PDFSource) -> str:
+        """SHA-256 of a PDF's bytes, read in blocks (a stream is rewound first)."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(source).hexdigest()
+        digest = hashlib.sha256()
+        with open_pdf_source(source) as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    
+    def key_for(self, source: PDFSource, chunk_size: int, chunk_overlap: int, chunk_unit: str = "characters") -> str:
+        """Cache key for a PDF under the current extractor version and chunking parameters."""
+        raw = f"{self.file_digest(source)}:{EXTRACTOR_VERSION}:{chunk_size}:{chunk_overlap}:{chunk_unit}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+    
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.jsonl")
+    
+    def get(self, key: str) -> Optional[Iterator[Tuple[int, str, List[List[int]]]]]:
+        """Return an iterator over the cached page records, or None on a miss."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._read(path)
+    
+    @staticmethod
+    def _read(path: str) -> Iterator[Tuple[int, str, List[List[int]]]]:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                page_num, text, spans = json.loads(line)
+                yield page_num, text, spans
+    
+    def store(self, key: str, records: Iterator[Tuple[int, str, List[List[int]]]]) -> Iterator[Tuple[int, str, List[List[int]]]]:
+        """Pass page records through while writing them to the cache.
+        
+        The entry only becomes visible once ``records`` is fully consumed, so
+        a failed or abandoned extraction never leaves a partial entry behind.
+        """
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        committed = False
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+                    yield record
+            os.replace(tmp_path, path)
+            committed = True
+            size = os.path.getsize(path)
+            self.bytes_written += size
+            if self.evict:
+                self.record_written(size)
+        finally:
+            if not committed and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _scan(self) -> Tuple[List[Tuple[float, int, str]], int]:
+        """List (mtime, size, path) for every entry along with the total size."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".jsonl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries, sum(size for _, size, _ in entries)
+    
+    def record_written(self, size: int):
+        """Account for ``size`` new bytes in the cache, evicting if it is now over ``max_bytes``."""
+        if self._size is None:
+            # The first scan already sees the new entries
+            self._size = self._scan()[1]
+        else:
+            self._size += size
+        if self._size > self.max_bytes:
+            self._evict()
+    
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in ``max_bytes``."""
+        rescanned = False
+        while self._size > self.max_bytes:
+            if not self._lru:
+                if rescanned:
+                    break
+                entries, self._size = self._scan()
+                self._lru = deque(sorted(entries))
+                rescanned = True
+                continue
+            mtime, size, path = self._lru.popleft()
+            try:
+                # An entry hit since the scan is no longer least recently used
+                if os.stat(path).st_mtime != mtime:
+                    continue
+                os.remove(path)
+                self._size -= size
+            except OSError:
+                pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size of the cache."""
+        if self._size is None:
+            self._size = self._scan()[1]
+        return {"hits": self.hits, "misses": self.misses, "size_bytes": self._size}
+
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """Identify an embedding model (name plus output size when configured) for cache keys."""
+    name = getattr(embeddings, "model", None) or type(embeddings).__name__
+    dimensions = getattr(embeddings, "dimensions", None) or getattr(embeddings, "size", None)
+    return f"{name}:{dimensions}" if dimensions else name
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken's cl100k_base, estimating when the encoding is unavailable offline."""
+    encoding = get_token_encoding()
+    if encoding is None:
+        return max(1, len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "rate limit" in str(error).lower()
+
+
+def _retry_after_seconds(error: Exception) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class EmbeddingPipeline:
+    """Explicit embedding stage: token-bounded batches embedded concurrently.
+    
+    Batches run on a thread pool. A rate-limit response from any batch puts
+    every worker into a shared cool-down (honouring ``Retry-After``) whose
+    length doubles on consecutive 429s and decays again on success. Vectors of
+    batches that finished during a failed run are kept and reused by the next
+    run, so a retry only embeds what is still missing.
+    """
+    
+    def __init__(self, embeddings: Embeddings, batch_tokens: Optional[int] = DEFAULT_EMBEDDING_BATCH_TOKENS,
+                 batch_size: int = DEFAULT_EMBEDDING_BATCH_SIZE, concurrency: int = DEFAULT_EMBEDDING_CONCURRENCY,
+                 max_retries: int = 8, initial_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.embeddings = embeddings
+        # Local vectors skip the list conversion, and batches already run on this pipeline's threads
+        if isinstance(embeddings, HashingEmbeddings):
+            self._embed_documents = lambda texts: embeddings.embed_matrix(texts, workers=1)
+        else:
+            self._embed_documents = embeddings.embed_documents
+        self.batch_tokens = batch_tokens
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.batches = 0
+        self.rate_limited = 0
+        self._completed: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._backoff = 0.0
+        self._resume_at = 0.0
+    
+    def make_batches(self, texts: List[str]) -> List[List[str]]:
+        """Group texts into batches bounded by total tokens (unless ``batch_tokens`` is None) and input count."""
+        if self.batch_tokens is None:
+            return [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text in texts:
+            tokens = count_tokens(text)
+            if batch and (batch_tokens + tokens > self.batch_tokens or len(batch) >= self.batch_size):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _wait_for_cooldown(self):
+        while True:
+            with self._lock:
+                wait = self._resume_at - time.monotonic()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+    
+    def _on_rate_limit(self, retry_after: float):
+        with self._lock:
+            self.rate_limited += 1
+            self._backoff = min(self.max_backoff, max(self.initial_backoff, self._backoff * 2))
+            delay = max(retry_after, self._backoff * (0.5 + random.random() / 2))
+            self._resume_at = max(self._resume_at, time.monotonic() + delay)
+    
+    def _on_success(self):
+        with self._lock:
+            self.batches += 1
+            self._backoff /= 2
+    
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        attempt = 0
+        while True:
+            self._wait_for_cooldown()
+            try:
+                vectors = self._embed_documents(batch)
+                self._on_success()
+                return vectors
+            except Exception as e:
+                if not _is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"Embedding batch rate limited, retry {attempt}/{self.max_retries}")
+                self._on_rate_limit(_retry_after_seconds(e))
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts in order; raises the first batch error after keeping finished batches."""
+        hashes = [CachedEmbeddings._hash(text) for text in texts]
+        pending = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in self._completed:
+                pending.setdefault(text_hash, text)
+        
+        errors = []
+        batches = self.make_batches(list(pending.values()))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(batches)))) as executor:
+            futures = {executor.submit(self._embed_batch, batch): batch for batch in batches}
+            for future in as_completed(futures):
+                try:
+                    vectors = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                for text, vector in zip(futures[future], vectors):
+                    self._completed[CachedEmbeddings._hash(text)] = vector
+        
+        if errors:
+            logger.error(f"{len(errors)} of {len(batches)} embedding batches failed; "
+                         f"finished batches are kept for the next attempt")
+            raise errors[0]
+        
+        vectors = [self._completed[text_hash] for text_hash in hashes]
+        self._completed = {}
+        return vectors
+    
+    def stats(self) -> Dict[str, Any]:
+        """Batches embedded, rate-limit responses seen and vectors held for resumption."""
+        return {"batches": self.batches, "rate_limited": self.rate_limited, "pending_resume": len(self._completed)}
+
+
+class QueryEmbeddingCache:
+    """Bounded, thread-safe LRU cache of query embeddings with a time-to-live.
+    
+    Keys are (embedding model, whitespace-normalized query text), so repeated
+    searches and chat questions skip the embedding call entirely.
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_QUERY_CACHE_SIZE, ttl: Optional[float] = DEFAULT_QUERY_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Collapse whitespace so trivially different spellings share an entry."""
+        return " ".join(query.split())
+    
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """Return the cached vector for a normalized query, or None."""
+        key = (model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, model: str, query: str, vector: List[float]):
+        """Store a vector, evicting the least recently used entries beyond capacity."""
+        with self._lock:
+            self._entries[(model, query)] = (time.monotonic(), vector)
+            self._entries.move_to_end((model, query))
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, hit ratio and current size."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries), "capacity": self.capacity}
+
+
+class SemanticAnswerCache:
+    """Bounded, thread-safe LRU cache of chat answers looked up by question similarity.
+    
+    Entries are keyed by a fingerprint (of the document set and the
+    retrieval settings) and the question's embedding. A lookup returns the
+    stored answer of the most similar earlier question under the same
+    fingerprint when their cosine similarity is at least ``threshold``.
+    Entries expire after ``ttl`` seconds.
+    """
+    
+    def __init__(self, capacity: int = DEFAULT_ANSWER_CACHE_SIZE, ttl: Optional[float] = DEFAULT_ANSWER_CACHE_TTL,
+                 threshold: float = DEFAULT_ANSWER_CACHE_SIMILARITY):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Tuple[float, str, np.ndarray, Dict[str, Any]]]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _unit(vector: List[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def get(self, fingerprint: str, vector: List[float]) -> Optional[Dict[str, Any]]:
+        """Return the answer stored for the most similar question on these documents, or None."""
+        query = self._unit(vector)
+        with self._lock:
+            if self.ttl is not None:
+                expired = time.monotonic() - self.ttl
+                for key in [key for key, entry in self._entries.items() if entry[0] < expired]:
+                    del self._entries[key]
+            
+            keys = [key for key, entry in self._entries.items() if entry[1] == fingerprint]
+            if keys:
+                similarities = np.stack([self._entries[key][2] for key in keys]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]][3]
+            self.misses += 1
+            return None
+    
+    def put(self, fingerprint: str, vector: List[float], answer: Dict[str, Any]):
+        """Store an answer, evicting the least recently used entries beyond capacity."""
+        with self._lock:
+            self._entries[self._next_key] = (time.monotonic(), fingerprint, self._unit(vector), answer)
+            self._next_key += 1
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, hit ratio and current size."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries), "capacity": self.capacity}
+
+
+class _StageTimer:
+    """Context manager timing one run of a stage into a ``PipelineMetrics``."""
+    
+    __slots__ = ("_metrics", "_stage", "_started")
+    
+    def __init__(self, metrics: "PipelineMetrics", stage: str):
+        self._metrics = metrics
+        self._stage = stage
+    
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self._metrics.observe(self._stage, time.perf_counter() - self._started)
+
+
+# Handed out by a disabled PipelineMetrics instead of a timer
+_NO_TIMER = contextlib.nullcontext()
+
+
+class PipelineMetrics:
+    """Thread-safe per-stage timings and event counters for the processing and chat pipeline.
+    
+    ``time(stage)`` times a ``with`` block; ``observe`` records a duration
+    measured elsewhere and ``increment`` bumps a counter. Each stage keeps its
+    count, total and maximum plus its last ``sample_size`` durations for
+    percentiles. When disabled nothing is recorded: ``time`` returns a shared
+    no-op context manager and the other calls return at once.
+    """
+    
+    def __init__(self, enabled: bool = True, sample_size: int = METRICS_SAMPLE_SIZE):
+        self.enabled = enabled
+        self.sample_size = sample_size
+        self._stages: Dict[str, List[Any]] = {}
+        self._counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+    
+    def time(self, stage: str):
+        """Context manager recording the duration of its block under ``stage``."""
+        if not self.enabled:
+            return _NO_TIMER
+        return _StageTimer(self, stage)
+    
+    def observe(self, stage: str, seconds: float):
+        """Record one run of ``stage`` that took ``seconds``."""
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                # count, total seconds, max seconds, recent samples
+                entry = self._stages[stage] = [0, 0.0, 0.0, deque(maxlen=self.sample_size)]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3].append(seconds)
+    
+    def increment(self, counter: str, amount: float = 1):
+        """Add ``amount`` to an event counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+    
+    def reset(self):
+        """Drop everything recorded so far."""
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Stage statistics (in seconds) and counters recorded so far."""
+        with self._lock:
+            stages = {stage: (count, total, longest, np.asarray(samples))
+                      for stage, (count, total, longest, samples) in self._stages.items()}
+            counters = dict(self._counters)
+        return {
+            "enabled": self.enabled,
+            "stages": {stage: {"count": count, "total": total, "mean": total / count,
+                               "p50": float(np.percentile(samples, 50)), "p95": float(np.percentile(samples, 95)),
+                               "max": longest}
+                       for stage, (count, total, longest, samples) in sorted(stages.items())},
+            "counters": dict(sorted(counters.items()))
+        }
+    
+    @staticmethod
+    def to_prometheus(snapshot: Dict[str, Any], prefix: str = METRICS_PREFIX) -> str:
+        """Render a snapshot in the Prometheus text exposition format.
+        
+        Stages become a ``<prefix>_stage_seconds`` summary and counters
+        ``<prefix>_events_total``. Numeric fields of an optional ``caches``
+        section become ``<prefix>_cache_<field>`` gauges labelled by cache.
+        """
+        lines = [f"# HELP {prefix}_stage_seconds Time spent in each pipeline stage",
+                 f"# TYPE {prefix}_stage_seconds summary"]
+        for stage, stats in snapshot["stages"].items():
+            for key, quantile in (("p50", "0.5"), ("p95", "0.95")):
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {stats[key]:.9g}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total"]:.9g}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        
+        lines += [f"# HELP {prefix}_events_total Pipeline events such as API calls and cache hits",
+                  f"# TYPE {prefix}_events_total counter"]
+        for counter, value in snapshot["counters"].items():
+            lines.append(f'{prefix}_events_total{{event="{counter}"}} {value:.9g}')
+        
+        gauges: Dict[str, List[str]] = {}
+        for cache, stats in snapshot.get("caches", {}).items():
+            for field, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges.setdefault(field, []).append(f'{prefix}_cache_{field}{{cache="{cache}"}} {value:.9g}')
+        for field, samples in gauges.items():
+            lines.append(f"# TYPE {prefix}_cache_{field} gauge")
+            lines += samples
+        return "\n".join(lines) + "\n"
+
+
+def choose_index_type(n_vectors: int) -> str:
+    """Pick an index type for a corpus size: exact when small, graph or quantized IVF when large."""
+    if n_vectors <= FLAT_INDEX_MAX_VECTORS:
+        return "flat"
+    if n_vectors <= HNSW_INDEX_MAX_VECTORS:
+        return "hnsw"
+    return "ivf_sq8"
+
+
+def _index_factory_string(index_type: str, n_vectors: int, dimension: int) -> str:
+    # Roughly 4 * sqrt(n) inverted lists, keeping the 39 training points per centroid FAISS asks for
+    nlist = int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+    # One 8-bit PQ code per 8 dimensions (32x smaller than float32), when the dimension allows it
+    pq_m = dimension // 8 if dimension % 8 == 0 else dimension
+    factories = {
+        "flat": "Flat",
+        "ivf_flat": f"IVF{nlist},Flat",
+        "hnsw": f"HNSW{HNSW_M}",
+        "sq8": "SQ8",
+        "ivf_sq8": f"IVF{nlist},SQ8",
+        "ivf_pq": f"IVF{nlist},PQ{pq_m}x8",
+    }
+    if index_type not in factories:
+        raise ValueError(f"Unknown index type: {index_type}")
+    return factories[index_type]
+
+
+def set_search_params(index, nprobe: int = DEFAULT_NPROBE, ef_search: int = DEFAULT_EF_SEARCH):
+    """Apply nprobe (IVF) or efSearch (HNSW) to an index; other index types ignore them."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = nprobe
+    except RuntimeError:
+        pass
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = ef_search
+
+
+def index_type_of(index) -> str:
+    """The ``INDEX_TYPES`` name of an index made by ``create_faiss_index``."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVFScalarQuantizer):
+        return "ivf_sq8"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def create_faiss_index(vectors: np.ndarray, index_type: str = "auto", nprobe: int = DEFAULT_NPROBE,
+                       ef_search: int = DEFAULT_EF_SEARCH, seed: int = 0, n_vectors: Optional[int] = None):
+    """Create an empty L2 index for ``vectors``, trained on a random sample when the type needs it.
+    
+    ``n_vectors`` is the corpus size to pick and size the index for when
+    ``vectors`` is only a training sample of it.
+    """
+    dimension = vectors.shape[1]
+    n_vectors = n_vectors or len(vectors)
+    if index_type == "auto":
+        index_type = choose_index_type(n_vectors)
+    if index_type == "ivf_pq" and len(vectors) < PQ_MIN_TRAINING_VECTORS:
+        logger.warning(f"ivf_pq needs {PQ_MIN_TRAINING_VECTORS} vectors to train, not {len(vectors)}; using sq8")
+        index_type = "sq8"
+    index = faiss.index_factory(dimension, _index_factory_string(index_type, n_vectors, dimension))
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > INDEX_TRAIN_SAMPLE:
+            rows = np.random.default_rng(seed).choice(len(vectors), INDEX_TRAIN_SAMPLE, replace=False)
+            sample = vectors[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+    set_search_params(index, nprobe, ef_search)
+    return index
+
+
+def compare_index_types(vectors: np.ndarray, queries: np.ndarray, k: int = 10,
+                        index_types: Tuple[str, ...] = INDEX_TYPES, nprobe: int = DEFAULT_NPROBE,
+                        ef_search: int = DEFAULT_EF_SEARCH) -> List[Dict[str, Any]]:
+    """Recall@k, per-query latency and memory of each index type against exact search.
+    
+    Every candidate index is built over ``vectors`` and queried one query at a
+    time so latency percentiles reflect interactive search.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = faiss.IndexFlatL2(vectors.shape[1])
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+    exact_bytes = len(faiss.serialize_index(exact))
+    
+    report = []
+    for index_type in index_types:
+        started = time.perf_counter()
+        index = create_faiss_index(vectors, index_type, nprobe, ef_search)
+        index.add(vectors)
+        build_seconds = time.perf_counter() - started
+        
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            started = time.perf_counter()
+            _, found = index.search(query[None, :], k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            hits += len(set(found[0]).intersection(expected))
+        
+        memory = len(faiss.serialize_index(index))
+        report.append({
+            "index_type": index_type,
+            "recall_at_k": hits / (len(queries) * k),
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "build_seconds": build_seconds,
+            "memory_bytes": memory,
+            "memory_reduction": exact_bytes / memory
+        })
+    return report
+
+
+def metadata_matches(metadata: Dict[str, Any], filter: Dict[str, Any]) -> bool:
+    """Check chunk metadata against a filter.
+    
+    Each filter value is either a value to compare for equality, a list/tuple/set
+    of accepted values, or a callable predicate on the metadata value (e.g.
+    ``{"date": lambda d: d is not None and d >= "2024-01-01"}``).
+    """
+    for key, condition in filter.items():
+        value = metadata.get(key)
+        if callable(condition):
+            if not condition(value):
+                return False
+        elif isinstance(condition, (list, tuple, set, frozenset)):
+            if value not in condition:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class BM25Index:
+    """In-process BM25 inverted index over chunk texts.
+    
+    Every ``add`` call tokenizes only the new chunks and records them as
+    (row, term, frequency) NumPy arrays. Before searching, all batches are
+    compiled into CSR-style postings (term -> rows, precomputed BM25 weights).
+    A query is then a handful of vectorized adds over its terms' postings and
+    needs no embedding call. Removals only mark rows dead; the next compile
+    drops them.
+    
+    With a ``lookup`` function, rows keep only the chunk ids passed to
+    ``add`` and results are fetched through ``lookup(id)`` (e.g. from the
+    vector store's docstore), so the index does not hold the chunks itself.
+    """
+    
+    # Lowercased alphanumeric runs, keeping identifiers like CLM-0001 or 12/34/56 intact
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+    
+    # Term frequencies are stored as uint16; BM25 saturates long before this cap
+    MAX_TERM_FREQUENCY = np.iinfo(np.uint16).max
+    
+    def __init__(self, k1: float = 1.5, b: float = 0.75, lookup: Optional[Callable[[str], Document]] = None):
+        self.k1 = k1
+        self.b = b
+        self.vocabulary: Dict[str, int] = {}
+        self._lookup = lookup
+        # Chunk per row, or its id when chunks are fetched through ``lookup``
+        self._docs: List[Any] = []
+        self._alive: List[bool] = []
+        # (row, term, frequency) batches added since the last compile
+        self._postings: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        # Postings of the last compile sorted by term, as (indptr, rows, frequencies); term ids follow from indptr
+        self._sorted: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._lengths: List[np.ndarray] = []
+        self._rows_by_ingest: Dict[str, List[int]] = {}
+        self._compiled = None
+        self._compile_lock = threading.Lock()
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Split text into lowercase search terms."""
+        return cls.TOKEN_PATTERN.findall(text.lower())
+    
+    def add(self, docs: List[Document], ids: Optional[List[str]] = None):
+        """Index chunks; only the new chunks are tokenized. ``ids`` are required with a ``lookup``."""
+        if self._lookup is not None and (ids is None or len(ids) != len(docs)):
+            raise ValueError("An index with a lookup needs one id per chunk")
+        tokenized = [self.tokenize(doc.page_content) for doc in docs]
+        terms = list(chain.from_iterable(tokenized))
+        for term in set(terms).difference(self.vocabulary):
+            self.vocabulary[term] = len(self.vocabulary)
+        term_ids = np.fromiter(map(self.vocabulary.__getitem__, terms), dtype=np.int64, count=len(terms))
+        lengths = np.fromiter(map(len, tokenized), dtype=np.int64, count=len(docs))
+        
+        # Count (row, term) pairs in one pass by packing both into a single integer key
+        first_row = len(self._docs)
+        rows = np.repeat(np.arange(first_row, first_row + len(docs), dtype=np.int64), lengths)
+        keys, freqs = np.unique((rows << 32) | term_ids, return_counts=True)
+        self._postings.append(((keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32),
+                               np.minimum(freqs, self.MAX_TERM_FREQUENCY).astype(np.uint16)))
+        self._lengths.append(lengths)
+        
+        for row, doc in enumerate(docs, first_row):
+            self._rows_by_ingest.setdefault(doc.metadata.get("ingest_id"), []).append(row)
+        self._docs.extend(ids if self._lookup is not None else docs)
+        self._alive.extend([True] * len(docs))
+        self._compiled = None
+    
+    def remove(self, ingest_id: str):
+        """Drop every chunk of one document ingest."""
+        for row in self._rows_by_ingest.pop(ingest_id, []):
+            self._alive[row] = False
+        self._compiled = None
+    
+    def _compile(self):
+        batches = list(self._postings)
+        if self._sorted is not None:
+            indptr, rows, freqs = self._sorted
+            terms = np.repeat(np.arange(len(indptr) - 1, dtype=np.int32), np.diff(indptr))
+            batches.insert(0, (rows, terms, freqs))
+        empty = np.zeros(0, dtype=np.int32)
+        rows = np.concatenate([p[0] for p in batches]) if batches else empty
+        terms = np.concatenate([p[1] for p in batches]) if batches else empty
+        freqs = np.concatenate([p[2] for p in batches]) if batches else np.zeros(0, dtype=np.uint16)
+        lengths = np.concatenate(self._lengths) if self._lengths else empty
+        
+        # Physically drop removed chunks and renumber the surviving rows
+        alive = np.array(self._alive, dtype=bool)
+        if not alive.all():
+            renumbered = (np.cumsum(alive) - 1).astype(np.int32)
+            keep = alive[rows]
+            rows = renumbered[rows[keep]]
+            terms, freqs, lengths = terms[keep], freqs[keep], lengths[alive]
+            self._docs = [doc for doc, live in zip(self._docs, self._alive) if live]
+            self._alive = [True] * len(self._docs)
+            # Removed ingests are no longer listed, so every listed row survives
+            self._rows_by_ingest = {ingest_id: renumbered[ingest_rows].tolist()
+                                    for ingest_id, ingest_rows in self._rows_by_ingest.items()}
+        
+        # The sorted postings are kept for the next compile and share their row array with the compiled index.
+        # Rows arrive in ascending order, so the stable sort leaves each term's posting sorted by row
+        order = np.argsort(terms, kind="stable")
+        terms, doc_rows, freqs = terms[order], rows[order], freqs[order]
+        indptr = np.searchsorted(terms, np.arange(len(self.vocabulary) + 1))
+        self._postings = []
+        self._sorted = (indptr, doc_rows, freqs)
+        self._lengths = [lengths]
+        freqs = freqs.astype(np.float32)
+        
+        n_docs = len(self._docs)
+        doc_freq = np.diff(indptr).astype(np.float32)
+        idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = max(float(lengths.mean()), 1.0) if n_docs else 1.0
+        norm = self.k1 * (1 - self.b + self.b * lengths[doc_rows] / avg_length)
+        weights = (idf[terms] * freqs * (self.k1 + 1) / (freqs + norm)).astype(np.float32)
+        self._compiled = (indptr, doc_rows, weights)
+    
+    def __len__(self) -> int:
+        return sum(self._alive)
+    
+    def search(self, query: str, k: int = 5, predicate: Optional[Callable[[Document], bool]] = None,
+               ingest_ids: Optional[List[str]] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k chunks by BM25 score (higher is better).
+        
+        ``ingest_ids`` restricts the search to the chunks of those ingests,
+        which are the only rows scored. ``predicate`` is checked on chunks in
+        score order until ``k`` match, so only that many chunks (plus the
+        rejected ones) are ever built.
+        """
+        with self._compile_lock:
+            if self._compiled is None:
+                self._compile()
+            indptr, doc_rows, weights = self._compiled
+            allowed = None
+            if ingest_ids is not None:
+                allowed = np.unique(np.fromiter(
+                    chain.from_iterable(self._rows_by_ingest.get(ingest_id, ()) for ingest_id in ingest_ids),
+                    dtype=np.int64))
+        
+        term_ids = {self.vocabulary[term] for term in self.tokenize(query) if term in self.vocabulary}
+        postings = [slice(indptr[t], indptr[t + 1]) for t in term_ids if indptr[t + 1] > indptr[t]]
+        if not postings or (allowed is not None and not len(allowed)):
+            return []
+        
+        if allowed is None:
+            rows = np.concatenate([doc_rows[posting] for posting in postings])
+            row_weights = np.concatenate([weights[posting] for posting in postings])
+        else:
+            # Look the selected rows up in each (row-sorted) posting, so the cost follows their count
+            matched_rows = []
+            matched_weights = []
+            for posting in postings:
+                posting_rows = doc_rows[posting]
+                found = np.searchsorted(posting_rows, allowed)
+                hit = found < len(posting_rows)
+                hit[hit] = posting_rows[found[hit]] == allowed[hit]
+                matched_rows.append(allowed[hit])
+                matched_weights.append(weights[posting][found[hit]])
+            rows = np.concatenate(matched_rows)
+            row_weights = np.concatenate(matched_weights)
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=row_weights, minlength=len(candidates))
+        
+        if predicate is None and len(candidates) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            candidates, scores = candidates[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        results = []
+        for i in order:
+            doc = self._document(candidates[i])
+            if predicate is None or predicate(doc):
+                results.append((doc, float(scores[i])))
+                if len(results) == k:
+                    break
+        return results
+    
+    def _document(self, row: int) -> Document:
+        return self._lookup(self._docs[row]) if self._lookup is not None else self._docs[row]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that persists document vectors in SQLite.
+    
+    Vectors are keyed by the SHA-256 of the chunk text and the embedding model
+    name, so only texts never seen before by this model reach the wrapped
+    embedder. Query embeddings are passed straight through.
+    """
+    
+    # Keys per SELECT, kept under SQLite's bound-parameter limit
+    _LOOKUP_BATCH = 500
+    
+    def __init__(self, embeddings: Embeddings, db_path: str, model_name: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model_name = model_name or embedding_model_name(embeddings)
+        self.hits = 0
+        self.misses = 0
+        # Calls that reached the wrapped embedder
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+    
+    @staticmethod
+    def _hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(hashes), self._LOOKUP_BATCH):
+                batch = hashes[i:i + self._LOOKUP_BATCH]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.model_name, *batch]
+                )
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+    
+    def _store(self, items: List[Tuple[str, List[float]]]):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes())
+                 for text_hash, vector in items]
+            )
+            self._conn.commit()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, calling the wrapped embedder only for cache misses."""
+        hashes = [self._hash(text) for text in texts]
+        vectors = self._lookup(list(set(hashes)))
+        
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash in vectors:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing.setdefault(text_hash, text)
+        
+        if missing:
+            self.calls += 1
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), new_vectors))
+            self._store(new_items)
+            vectors.update(new_items)
+        
+        return [vectors[text_hash] for text_hash in hashes]
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query with the wrapped embedder."""
+        return self.embeddings.embed_query(text)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, hit ratio and wrapped-embedder calls since this wrapper was created."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0, "calls": self.calls}
+
+
+class ChunkStore(Docstore, AddableMixin):
+    """In-memory docstore holding chunk texts in one UTF-8 arena and metadata in typed arrays.
+    
+    Each chunk is a row of (offset, length) into the arena plus its
+    ``CHUNK_INT_FIELDS`` in ``array`` columns. Document-level metadata
+    (``DOCUMENT_FILTER_KEYS``) is stored once per ingest and shared by its
+    rows. A chunk that overlaps the previous chunk of the same page (the
+    chunker repeats ``chunk_overlap`` units) only appends its new tail,
+    so each page's text is held once. ``Document`` objects are built on
+    lookup and not kept. Deleted rows are reclaimed once they outnumber the
+    live ones.
+    """
+    
+    # Column value of an integer field the chunk does not have
+    _ABSENT = -(1 << 63)
+    
+    def __init__(self):
+        self._clear()
+    
+    def _clear(self):
+        self._arena = bytearray()
+        self._offsets = array("q")
+        self._lengths = array("l")
+        self._document_refs = array("l")
+        self._columns = {field: array("q") for field in CHUNK_INT_FIELDS}
+        # Document-level metadata dicts, and the row of each by its values
+        self._document_metadata: List[Dict[str, Any]] = []
+        self._document_keys: Dict[tuple, int] = {}
+        # Metadata of a row that fits neither the document table nor the integer columns
+        self._extras: Dict[int, Dict[str, Any]] = {}
+        self._rows: Dict[str, int] = {}
+        # (document, page, start, end, text) of the last chunk, which ends the arena
+        self._last = None
+    
+    def __len__(self) -> int:
+        return len(self._rows)
+    
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+    
+    def stats(self) -> Dict[str, int]:
+        """Stored chunks, UTF-8 bytes of their texts and bytes actually held in the arena."""
+        return {"chunks": len(self._rows),
+                "text_bytes": sum(self._lengths[row] for row in self._rows.values()),
+                "arena_bytes": len(self._arena)}
+    
+    def search(self, search: str):
+        """Return the document stored under an id, or a not-found message."""
+        row = self._rows.get(search)
+        if row is None:
+            return f"ID {search} not found."
+        offset = self._offsets[row]
+        text = self._arena[offset:offset + self._lengths[row]].decode("utf-8")
+        
+        metadata = dict(self._document_metadata[self._document_refs[row]])
+        for field, column in self._columns.items():
+            if column[row] != self._ABSENT:
+                metadata[field] = column[row]
+        metadata.update(self._extras.get(row, ()))
+        return Document(page_content=text, metadata=metadata, id=search)
+    
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Add documents, refusing ids that already exist."""
+        overlapping = set(texts).intersection(self._rows)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for doc_id, doc in texts.items():
+            self._append(doc_id, doc)
+    
+    def delete(self, ids: List) -> None:
+        """Forget documents by id."""
+        for doc_id in ids:
+            self._rows.pop(doc_id, None)
+        if len(self._offsets) > 2 * len(self._rows):
+            self._reclaim()
+    
+    def _append(self, doc_id: str, doc: Document):
+        metadata = doc.metadata
+        document_metadata = {}
+        extras = {}
+        for key, value in metadata.items():
+            if key in DOCUMENT_FILTER_KEYS:
+                document_metadata[key] = value
+            elif key not in self._columns or type(value) is not int:
+                extras[key] = value
+        try:
+            document_key = tuple(document_metadata.items())
+            document = self._document_keys.get(document_key)
+        except TypeError:
+            # Unhashable values are kept with the row instead
+            extras.update(document_metadata)
+            document_metadata = {}
+            document_key = ()
+            document = self._document_keys.get(document_key)
+        if document is None:
+            document = self._document_keys[document_key] = len(self._document_metadata)
+            self._document_metadata.append(document_metadata)
+        
+        row = len(self._offsets)
+        text = doc.page_content
+        self._offsets.append(self._place(text, document, metadata.get("page"), metadata.get("start_index")))
+        self._lengths.append(len(text) if text.isascii() else len(text.encode("utf-8")))
+        self._document_refs.append(document)
+        for field, column in self._columns.items():
+            value = metadata.get(field)
+            column.append(value if type(value) is int else self._ABSENT)
+        if extras:
+            self._extras[row] = extras
+        self._rows[doc_id] = row
+    
+    def _place(self, text: str, document: int, page: Any, start: Any) -> int:
+        """Write a chunk's text to the arena and return its byte offset.
+        
+        When the chunk begins inside the previous chunk of the same page and
+        the overlapping characters match, only the part past the previous
+        chunk's end is written.
+        """
+        last = self._last
+        self._last = (document, page, start, start + len(text) if type(start) is int else None, text)
+        if last is not None and type(start) is int and last[:2] == (document, page):
+            _, _, last_start, last_end, last_text = last
+            shared = (last_end - start) if last_end is not None else -1
+            if 0 <= shared < len(text) and start >= last_start and last_text[start - last_start:] == text[:shared]:
+                head = text[:shared]
+                offset = len(self._arena) - (shared if head.isascii() else len(head.encode("utf-8")))
+                self._arena += text[shared:].encode("utf-8")
+                return offset
+        offset = len(self._arena)
+        self._arena += text.encode("utf-8")
+        return offset
+    
+    def _reclaim(self):
+        """Rebuild the arena and columns from the live rows only."""
+        live = sorted(self._rows.items(), key=lambda item: item[1])
+        documents = {doc_id: self.search(doc_id) for doc_id, _ in live}
+        self._clear()
+        for doc_id, doc in documents.items():
+            self._append(doc_id, doc)
+
+
+class MappedDocstore(Docstore, AddableMixin):
+    """Docstore for a saved workspace whose chunk texts stay in a memory-mapped file.
+    
+    Texts are decoded from the mapping only when a document is looked up, so
+    opening a large workspace costs little more than reading its metadata.
+    Documents added after loading are kept in memory in a ``ChunkStore``.
+    """
+    
+    def __init__(self, texts_path: str, offsets: np.ndarray, ids: List[str], metadatas: List[Dict[str, Any]]):
+        self._file = open(texts_path, 'rb')
+        # mmap cannot map an empty file
+        self._texts = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""
+        self._offsets = offsets
+        self._positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self._metadatas = metadatas
+        self._added = ChunkStore()
+    
+    def search(self, search: str):
+        """Return the document stored under an id, or a not-found message."""
+        if search in self._added:
+            return self._added.search(search)
+        position = self._positions.get(search)
+        if position is None:
+            return f"ID {search} not found."
+        start, end = self._offsets[position], self._offsets[position + 1]
+        return Document(page_content=self._texts[start:end].decode("utf-8"),
+                        metadata=dict(self._metadatas[position]), id=search)
+    
+    def add(self, texts: Dict[str, Document]) -> None:
+        """Add documents, refusing ids that already exist."""
+        overlapping = set(texts).intersection(self._positions)
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        self._added.add(texts)
+    
+    def delete(self, ids: List) -> None:
+        """Forget documents by id."""
+        self._added.delete(ids)
+        for doc_id in ids:
+            self._positions.pop(doc_id, None)
+
+
+class ChatAnswerStream:
+    """Tokens of one chat answer as they arrive from the model, with timing and cancellation.
+    
+    Iterating yields text fragments. ``ttft`` (time to first token) and
+    ``latency`` are seconds since the turn started, retrieval included.
+    ``cancel()`` (safe to call from another thread) or ``close()`` stops the
+    stream and closes the model's response; ``cancelled`` then tells whether
+    the answer was cut short. ``cached`` marks answers served from the
+    semantic answer cache.
+    """
+    
+    def __init__(self, chunks: Iterator[Any], sources: List[str], started: float, cached: bool = False,
+                 on_complete: Optional[Callable[["ChatAnswerStream"], None]] = None,
+                 metrics: Optional[PipelineMetrics] = None):
+        self.sources = sources
+        self.cached = cached
+        # Prompt context size and the tokens its assembly saved (set by stream_answer)
+        self.context_tokens = 0
+        self.tokens_saved = 0
+        self.ttft: Optional[float] = None
+        self.latency: Optional[float] = None
+        self.cancelled = False
+        self._chunks = chunks
+        self._started = started
+        self._parts: List[str] = []
+        self._cancel = threading.Event()
+        self._finished = False
+        self._on_complete = on_complete
+        self._metrics = metrics
+        # Seconds from the start of the turn until the model was asked (retrieval and prompt assembly)
+        self._prepared = time.perf_counter() - started
+    
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._chunks:
+                if self._cancel.is_set():
+                    break
+                text = chunk.content if hasattr(chunk, "content") else str(chunk)
+                if not text:
+                    continue
+                if self.ttft is None:
+                    self.ttft = time.perf_counter() - self._started
+                self._parts.append(text)
+                yield text
+                if self._cancel.is_set():
+                    break
+            else:
+                self._finished = True
+        finally:
+            self.close()
+    
+    @property
+    def text(self) -> str:
+        """Answer text received so far."""
+        return "".join(self._parts)
+    
+    def cancel(self):
+        """Stop the stream before the next token."""
+        self._cancel.set()
+    
+    def close(self):
+        """Finish the turn, marking it cancelled if the model had not finished."""
+        if self.latency is not None:
+            return
+        self.latency = time.perf_counter() - self._started
+        self.cancelled = not self._finished
+        close = getattr(self._chunks, "close", None)
+        if close is not None:
+            close()
+        if self._metrics is not None and not self.cached:
+            self._metrics.observe("llm", self.latency - self._prepared)
+            if self.ttft is not None:
+                self._metrics.observe("llm_first_token", self.ttft - self._prepared)
+            if self.cancelled:
+                self._metrics.increment("chat_cancelled")
+        if self._finished and self._on_complete is not None:
+            self._on_complete(self)
+    
+    def consume(self) -> str:
+        """Read the whole answer without rendering it."""
+        for _ in self:
+            pass
+        return self.text
+
+
 class DocumentProcessor:
     """Main class for processing PDF documents and creating vector stores."""
     
-    def __init__(self, openai_api_key: str):
-        """Initialize the document processor with OpenAI API key."""
+    def __init__(self, openai_api_key: str, cache_dir: Optional[str] = None,
+                 extraction_cache_bytes: int = DEFAULT_EXTRACTION_CACHE_BYTES,
+                 embeddings: Optional[Embeddings] = None,
+                 embedding_concurrency: int = DEFAULT_EMBEDDING_CONCURRENCY,
+                 embedding_batch_tokens: int = DEFAULT_EMBEDDING_BATCH_TOKENS,
+                 query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE,
+                 query_cache_ttl: Optional[float] = DEFAULT_QUERY_CACHE_TTL,
+                 index_type: str = "auto", nprobe: int = DEFAULT_NPROBE,
+                 ef_search: int = DEFAULT_EF_SEARCH,
+                 answer_cache_size: int = DEFAULT_ANSWER_CACHE_SIZE,
+                 answer_cache_ttl: Optional[float] = DEFAULT_ANSWER_CACHE_TTL,
+                 answer_cache_similarity: float = DEFAULT_ANSWER_CACHE_SIMILARITY,
+                 enable_metrics: bool = True, embedding_backend: str = "openai",
+                 chunk_size: int = 1000, chunk_overlap: int = 200, chunk_unit: str = "characters"):
+        """Initialize the document processor with OpenAI API key.
+        
+        When ``cache_dir`` is given, extracted pages and chunk boundaries are
+        cached on disk under ``cache_dir/extraction`` and chunk embeddings in
+        ``cache_dir/embeddings.sqlite``. ``embeddings`` replaces the default
+        backend named by ``embedding_backend``: ``"openai"`` (OpenAIEmbeddings)
+        or ``"local"`` (``HashingEmbeddings``, computed on the CPU without
+        network access; its vectors are not cached on disk since recomputing
+        them is faster). Chunks are embedded in batches of at most
+        ``embedding_batch_tokens`` tokens, ``embedding_concurrency`` at a time.
+        Up to ``query_cache_size`` query embeddings are kept in memory for
+        ``query_cache_ttl`` seconds. ``index_type`` is one of ``INDEX_TYPES``
+        or ``"auto"`` to pick one from the corpus size when the index is built;
+        ``nprobe`` and ``ef_search`` tune IVF and HNSW searches. Chat answers
+        are reused for questions at least ``answer_cache_similarity`` (cosine)
+        similar to an earlier one on the same documents; up to
+        ``answer_cache_size`` answers are kept for ``answer_cache_ttl`` seconds.
+        Stage timings and event counters are recorded in ``metrics`` unless
+        ``enable_metrics`` is False. Pages are split into chunks of at most
+        ``chunk_size`` ``chunk_unit`` (``"characters"`` or ``"tokens"``),
+        repeating ``chunk_overlap`` of them between neighbouring chunks; the
+        three can be changed between ingests.
+        """
         self.openai_api_key = openai_api_key
-        self.embeddings = OpenAIEmbeddings(openai_api_key=openai_api_key)
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
+        self.cache_dir = cache_dir
+        self.extraction_cache_bytes = extraction_cache_bytes
+        if embedding_backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend: {embedding_backend}")
+        self.embedding_backend = embedding_backend
+        self.embeddings = embeddings or self.create_embeddings(embedding_backend, openai_api_key)
+        self.embedding_model = embedding_model_name(self.embeddings)
+        local = isinstance(self.embeddings, HashingEmbeddings)
+        # Local vectors are computed in process, so they never count as API calls
+        self._local_embeddings = local
+        self.embedding_cache = None
+        if cache_dir and not local:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.embedding_cache = CachedEmbeddings(self.embeddings, os.path.join(cache_dir, "embeddings.sqlite"),
+                                                    self.embedding_model)
+            self.embeddings = self.embedding_cache
+        # Token-bounded batches only matter for API request limits
+        self.embedding_pipeline = EmbeddingPipeline(self.embeddings,
+                                                    batch_tokens=None if local else embedding_batch_tokens,
+                                                    concurrency=embedding_concurrency)
+        self.query_cache = QueryEmbeddingCache(query_cache_size, query_cache_ttl)
+        self.answer_cache = SemanticAnswerCache(answer_cache_size, answer_cache_ttl, answer_cache_similarity)
+        self.metrics = PipelineMetrics(enable_metrics)
+        if index_type != "auto" and index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type}")
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._chunker = TextChunker(chunk_size, chunk_overlap, chunk_unit)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.chunk_unit = chunk_unit
+        self.extraction_cache = None
+        if cache_dir:
+            self.extraction_cache = ExtractionCache(os.path.join(cache_dir, "extraction"), extraction_cache_bytes)
         self.vector_store = None
-        self.documents = []
         self.processed_files = []
+        # Process pool shared by parallel ingests inside ``ingest_pool``
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_workers: Optional[int] = None
+        # Set while the index is a read-only mapping of a saved workspace
+        self._mapped_index_path = None
+        # Lexical index kept alongside the vector store (None until built after a workspace load)
+        self.lexical_index = BM25Index(lookup=self._lookup_chunk)
+        self._lexical_lock = threading.Lock()
+        # Live documents by source name, and superseded ingests awaiting compaction
+        self._sources: Dict[str, Dict[str, Any]] = {}
+        self._tombstones: Dict[str, List[str]] = {}
+        # Chat model, created on first use
+        self._chat_model = None
+        # Index position of every docstore id (built on first filtered search, reset when positions change)
+        self._positions: Optional[Dict[str, int]] = None
+        
+    @staticmethod
+    def create_embeddings(backend: str, openai_api_key: str) -> Embeddings:
+        """Embeddings client for a backend in ``EMBEDDING_BACKENDS``."""
+        if backend == "local":
+            return HashingEmbeddings()
+        if backend == "openai":
+            return OpenAIEmbeddings(openai_api_key=openai_api_key)
+        raise ValueError(f"Unknown embedding backend: {backend}")
+    
+    @property
+    def documents(self) -> List[Document]:
+        """Live chunks in index order.
+        
+        Chunks are stored compactly in the docstore, so the list is built anew
+        on every access; prefer ``retrieve`` for searching.
+        """
+        return [doc for _, doc in self._iter_live_chunks()]
+    
+    def _iter_live_chunks(self) -> Iterator[Tuple[str, Document]]:
+        """(docstore id, chunk) of every chunk that is not tombstoned, in index order."""
+        store = self.vector_store
+        if store is None:
+            return
+        dead = set(self._tombstones)
+        for i in range(store.index.ntotal):
+            doc_id = store.index_to_docstore_id[i]
+            doc = store.docstore.search(doc_id)
+            if doc.metadata.get("ingest_id") not in dead:
+                yield doc_id, doc
+    
+    def _lookup_chunk(self, doc_id: str) -> Document:
+        return self.vector_store.docstore.search(doc_id)
+    
+    def iter_pdf_pages(self, pdf_path: PDFSource, max_pages: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+        """Lazily yield (page_number, text) for each page, stopping after ``max_pages``.
         
-    def extract_text_from_pdf(self, pdf_path: str) -> str:
-        """Extract text from a PDF file."""
+        ``pdf_path`` may also be the PDF's bytes or a binary file object (see ``open_pdf_source``).
+        """
+        with open_pdf_source(pdf_path) as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page_num, page in enumerate(pdf_reader.pages, 1):
+                if max_pages is not None and page_num > max_pages:
+                    break
+                yield page_num, page.extract_text() or ""
+    
+    def extract_text_from_pdf(self, pdf_path: PDFSource, max_pages: Optional[int] = None) -> str:
+        """Extract text from a PDF file, optionally only from the first ``max_pages`` pages."""
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page_num in range(len(pdf_reader.pages)):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-                return text
+            return "".join(text + "\n" for _, text in self.iter_pdf_pages(pdf_path, max_pages))
         except Exception as e:
-            logger.error(f"Error extracting text from {pdf_path}: {str(e)}")
+            logger.error(f"Error extracting text from {self.source_name(pdf_path)}: {str(e)}")
             return ""
     
-    def process_single_document(self, file_path: str, file_name: str) -> Dict[str, Any]:
-        """Process a single PDF document and return metadata."""
+    @property
+    def chunker(self) -> TextChunker:
+        """Chunker for the current ``chunk_size``, ``chunk_overlap`` and ``chunk_unit``."""
+        settings = (self.chunk_size, self.chunk_overlap, self.chunk_unit)
+        if self._chunker.settings != settings:
+            self._chunker = TextChunker(*settings)
+        return self._chunker
+    
+    def _split_page(self, page_text: str) -> List[List[int]]:
+        """Split page text into chunks and return their [start, end) character spans."""
+        return self.chunker.split(page_text)
+    
+    def _iter_page_chunks(self, file_path: PDFSource,
+                          timings: Optional[Dict[str, float]] = None) -> Iterator[Tuple[int, str, List[List[int]]]]:
+        """Extract and split pages from the PDF itself, adding the seconds spent on each to ``timings``."""
+        timings = timings if timings is not None else {"extract": 0.0, "split": 0.0}
+        pages = self.iter_pdf_pages(file_path)
+        while True:
+            started = time.perf_counter()
+            page = next(pages, None)
+            extracted = time.perf_counter()
+            timings["extract"] += extracted - started
+            if page is None:
+                return
+            spans = self._split_page(page[1])
+            timings["split"] += time.perf_counter() - extracted
+            yield page[0], page[1], spans
+    
+    def process_single_document(self, file_path: PDFSource, file_name: str,
+                                preview_pages: Optional[int] = None) -> Dict[str, Any]:
+        """Process a single PDF document and return metadata.
+        
+        Pages are streamed straight into the splitter, so only one page of raw
+        text is alive at a time. ``preview_pages`` limits the text kept in the
+        result's ``text`` field to the first N pages (default: all pages); the
+        counts, category and date still cover every page.
+        ``file_path`` may also be the PDF's bytes or a binary file object, which
+        are parsed in memory (see ``open_pdf_source``).
+        """
         try:
-            # Extract text
-            text = self.extract_text_from_pdf(file_path)
-            if not text.strip():
-                return {
-                    "file_name": file_name,
-                    "status": "failed",
-                    "error": "No text extracted from PDF",
-                    "text": "",
-                    "chunks": []
-                }
+            doc_chunks = []
+            kept_pages = []
+            page_count = 0
+            word_count = 0
+            char_count = 0
+            keywords = set()
+            document_date = None
             
-            # Split text into chunks
-            chunks = self.text_splitter.split_text(text)
+            started = time.perf_counter()
+            timings = {"extract": 0.0, "split": 0.0}
+            cache_bytes_before = self.extraction_cache.bytes_written if self.extraction_cache is not None else 0
             
-            # Create document objects
-            doc_chunks = [Document(page_content=chunk, metadata={"source": file_name, "chunk_id": i}) 
-                         for i, chunk in enumerate(chunks)]
+            with open_pdf_source(file_path) as stream:
+                # Reuse a cached extraction of identical file contents when available
+                records = self._iter_page_chunks(stream, timings)
+                cache_hit = False
+                if self.extraction_cache is not None:
+                    cache_key = self.extraction_cache.key_for(stream, self.chunk_size, self.chunk_overlap,
+                                                              self.chunk_unit)
+                    cached = self.extraction_cache.get(cache_key)
+                    cache_hit = cached is not None
+                    records = cached if cache_hit else self.extraction_cache.store(cache_key, records)
+                
+                for page_num, page_text, spans in records:
+                    page_count += 1
+                    word_count += len(page_text.split())
+                    char_count += len(page_text) + 1
+                    if preview_pages is None or page_num <= preview_pages:
+                        kept_pages.append(page_text)
+                    keywords |= category_keywords(page_text)
+                    if document_date is None:
+                        document_date = find_date(page_text)
+                    
+                    # Materialize the page's chunks tagged with their page and character span
+                    for start, end in spans:
+                        doc_chunks.append(Document(
+                            page_content=page_text[start:end],
+                            metadata={"source": file_name, "chunk_id": len(doc_chunks), "page": page_num,
+                                      "start_index": start, "end_index": end}
+                        ))
+            
+            if word_count == 0:
+                return self._failed_result(file_name, "No text extracted from PDF")
+            
+            # Document-level fields are copied onto every chunk so they can be filtered on
+            category = classify_keywords(keywords)
+            for chunk in doc_chunks:
+                chunk.metadata["category"] = category
+                chunk.metadata["date"] = document_date
+            timings["total"] = time.perf_counter() - started
             
             return {
                 "file_name": file_name,
                 "status": "success",
-                "text": text,
+                "text": "".join(text + "\n" for text in kept_pages),
                 "chunks": doc_chunks,
-                "chunk_count": len(chunks),
-                "word_count": len(text.split())
+                "chunk_count": len(doc_chunks),
+                "word_count": word_count,
+                "page_count": page_count,
+                "char_count": char_count,
+                "category": category,
+                "date": document_date,
+                "cache_hit": cache_hit,
+                "cache_bytes_written": self._cache_bytes_since(cache_bytes_before),
+                "timings": timings,
+                "pages_per_second": page_count / timings["total"] if timings["total"] else 0.0
             }
             
         except Exception as e:
             logger.error(f"Error processing {file_name}: {str(e)}")
-            return {
-                "file_name": file_name,
-                "status": "failed",
-                "error": str(e),
-                "text": "",
-                "chunks": []
-            }
+            return self._failed_result(file_name, str(e))
+    
+    def _cache_bytes_since(self, before: int) -> int:
+        return self.extraction_cache.bytes_written - before if self.extraction_cache is not None else 0
     
-    def process_multiple_documents(self, file_paths: List[str]) -> Dict[str, Any]:
-        """Process multiple PDF documents."""
+    @staticmethod
+    def _failed_result(file_name: str, error: str) -> Dict[str, Any]:
+        """Build the per-file result reported for a document that could not be processed."""
+        return {
+            "file_name": file_name,
+            "status": "failed",
+            "error": error,
+            "text": "",
+            "chunks": []
+        }
+    
+    def _worker_kwargs(self) -> Dict[str, Any]:
+        """Constructor arguments used to rebuild this processor inside pool workers."""
+        return {
+            "openai_api_key": self.openai_api_key,
+            "cache_dir": self.cache_dir,
+            "extraction_cache_bytes": self.extraction_cache_bytes,
+            "embedding_backend": self.embedding_backend,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "chunk_unit": self.chunk_unit
+        }
+    
+    @contextlib.contextmanager
+    def ingest_pool(self, max_workers: Optional[int] = None):
+        """Share one process pool between the parallel ingests run inside the block.
+        
+        Workers then build their processor and open the caches once for the
+        whole run instead of once per ``process_multiple_documents`` call.
+        """
+        self._pool_workers = max(1, max_workers or os.cpu_count() or 1)
+        try:
+            yield self
+        finally:
+            self._pool_workers = None
+            self._shutdown_pool()
+    
+    def _new_pool(self, max_workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=max_workers,
+                                   initializer=_init_ingest_worker,
+                                   initargs=(self._worker_kwargs(),))
+    
+    def _shutdown_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+    
+    def _run_ingest_pool(self, jobs: List[tuple], results: Dict[int, Dict[str, Any]],
+                         max_workers: int, file_timeout: Optional[float],
+                         preview_pages: Optional[int] = None) -> List[tuple]:
+        """Run (index, path, name) jobs in a process pool, returning the jobs lost to a pool crash.
+        
+        Inside ``ingest_pool`` the shared pool is used; a crash discards it so
+        the next call starts a fresh one.
+        """
+        if self._pool_workers is None:
+            with self._new_pool(max_workers) as executor:
+                return self._submit_jobs(executor, jobs, results, file_timeout, preview_pages)
+        if self._pool is None:
+            self._pool = self._new_pool(self._pool_workers)
+        crashed = self._submit_jobs(self._pool, jobs, results, file_timeout, preview_pages)
+        if crashed:
+            self._shutdown_pool()
+        return crashed
+    
+    def _submit_jobs(self, executor: ProcessPoolExecutor, jobs: List[tuple], results: Dict[int, Dict[str, Any]],
+                     file_timeout: Optional[float], preview_pages: Optional[int] = None) -> List[tuple]:
+        crashed = []
+        futures = [(job, executor.submit(_process_document_worker, job[1], job[2], file_timeout, preview_pages))
+                   for job in jobs]
+        for job, future in futures:
+            index, _, file_name = job
+            try:
+                results[index] = future.result()
+            except BrokenProcessPool:
+                crashed.append(job)
+            except Exception as e:
+                logger.error(f"Error processing {file_name}: {str(e)}")
+                results[index] = self._failed_result(file_name, str(e))
+        return crashed
+    
+    def _process_files_parallel(self, file_paths: List[PDFSource], source_names: List[str],
+                                max_workers: Optional[int], file_timeout: Optional[float],
+                                preview_pages: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Extract and chunk documents in a process pool, preserving input order."""
+        jobs = []
+        results = {}
+        temp_paths = []
+        try:
+            for i, (source, name) in enumerate(zip(file_paths, source_names)):
+                try:
+                    jobs.append((i, self._worker_source(source, temp_paths), name))
+                except Exception as e:
+                    logger.error(f"Error processing {name}: {str(e)}")
+                    results[i] = self._failed_result(name, str(e))
+            workers = max(1, min(max_workers or os.cpu_count() or 1, len(jobs)))
+            
+            crashed = self._run_ingest_pool(jobs, results, workers, file_timeout, preview_pages) if jobs else []
+            
+            # A worker that dies takes the whole pool down with it; re-run the affected
+            # files one per pool so only the document that actually crashes is failed
+            for job in crashed:
+                with self._new_pool(1) as executor:
+                    lost = self._submit_jobs(executor, [job], results, file_timeout, preview_pages)
+                if lost:
+                    logger.error(f"Worker crashed while processing {job[2]}")
+                    results[job[0]] = self._failed_result(job[2], "Worker process crashed while processing document")
+        finally:
+            for path in temp_paths:
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+        
+        ordered = [results[i] for i in range(len(file_paths))]
+        # Workers leave eviction to this process
+        if self.extraction_cache is not None:
+            written = sum(result.get("cache_bytes_written", 0) for result in ordered)
+            if written:
+                self.extraction_cache.record_written(written)
+        return ordered
+    
+    @staticmethod
+    def _worker_source(source: PDFSource, temp_paths: List[str]) -> Union[str, bytes]:
+        """What to send a pool worker for a source: its path, its bytes, or a temporary copy of a large one.
+        
+        Temporary files are appended to ``temp_paths`` for the caller to delete.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            return os.fspath(source)
+        if isinstance(source, bytes) and len(source) <= IN_MEMORY_PDF_MAX_BYTES:
+            return source
+        with open_pdf_source(source) as stream:
+            size = stream.seek(0, io.SEEK_END)
+            stream.seek(0)
+            if size <= IN_MEMORY_PDF_MAX_BYTES:
+                return stream.read()
+            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+                temp_paths.append(file.name)
+                shutil.copyfileobj(stream, file)
+            return file.name
+    
+    @staticmethod
+    def source_name(source: PDFSource, index: int = 0) -> str:
+        """Default document name for a source: the file name of a path or named file object."""
+        name = source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", None)
+        if isinstance(name, (str, os.PathLike)) and os.fspath(name):
+            return os.path.basename(os.fspath(name))
+        return f"document_{index + 1}.pdf"
+    
+    @staticmethod
+    def unique_source_names(names: List[str]) -> List[str]:
+        """``names`` with repeats renamed ``name (2).pdf``, ``name (3).pdf``, ... so each names one document."""
+        taken = set()
+        unique = []
+        for name in names:
+            candidate = name
+            copy = 1
+            while candidate in taken:
+                copy += 1
+                stem, extension = os.path.splitext(name)
+                candidate = f"{stem} ({copy}){extension}"
+            taken.add(candidate)
+            unique.append(candidate)
+        return unique
+    
+    def process_multiple_documents(self, file_paths: List[PDFSource], parallel: bool = False,
+                                   max_workers: Optional[int] = None,
+                                   file_timeout: Optional[float] = DEFAULT_FILE_TIMEOUT,
+                                   append: bool = False,
+                                   source_names: Optional[List[str]] = None,
+                                   preview_pages: Optional[int] = None) -> Dict[str, Any]:
+        """Process multiple PDF documents.
+        
+        With ``parallel=True`` extraction and chunking run in a process pool of
+        ``max_workers`` processes (default: CPU count), and each file is limited
+        to ``file_timeout`` seconds. With ``append=True`` the documents are added
+        to the existing vector store (replacing any previous version of the same
+        source) instead of rebuilding it. Documents are identified by
+        ``source_names`` (default: the file names); files sharing a name in one
+        call are kept apart as ``name (2).pdf`` and so on. ``preview_pages``
+        limits each result's ``text`` to its first N pages (see
+        ``process_single_document``).
+        
+        Besides paths, ``file_paths`` may hold PDFs already in memory (bytes,
+        ``memoryview`` or binary file objects such as Streamlit uploads), which
+        are parsed without writing them to disk. Pool workers are sent their
+        bytes, or a temporary copy (deleted afterwards) when one is larger
+        than ``IN_MEMORY_PDF_MAX_BYTES``.
+        
+        ``timings`` reports wall-clock seconds for extraction (extraction and
+        splitting of all files), ``embed``, ``index_build`` and ``total``;
+        each successful file's result carries its own ``timings`` and
+        ``pages_per_second``.
+        
+        This is ``prepare_documents`` followed by ``index_documents``; only the
+        second changes the index.
+        """
+        prepared = self.prepare_documents(file_paths, parallel=parallel, max_workers=max_workers,
+                                          file_timeout=file_timeout, source_names=source_names,
+                                          preview_pages=preview_pages)
+        return self.index_documents(prepared, append=append)
+    
+    def prepare_documents(self, file_paths: List[PDFSource], parallel: bool = False,
+                          max_workers: Optional[int] = None,
+                          file_timeout: Optional[float] = DEFAULT_FILE_TIMEOUT,
+                          source_names: Optional[List[str]] = None,
+                          preview_pages: Optional[int] = None) -> Dict[str, Any]:
+        """Extract, chunk and embed documents without touching the index.
+        
+        Arguments are those of ``process_multiple_documents``. The returned
+        results are completed by ``index_documents``, so a caller sharing the
+        processor can keep serving searches until then.
+        """
+        started = time.perf_counter()
         results = {
             "successful": [],
             "failed": [],
@@ -100,47 +1936,652 @@ class DocumentProcessor:
         
         all_chunks = []
         
-        for file_path in file_paths:
-            file_name = os.path.basename(file_path)
-            result = self.process_single_document(file_path, file_name)
-            
+        if source_names is None:
+            source_names = [self.source_name(source, i) for i, source in enumerate(file_paths)]
+        # A repeated name would replace the earlier file's entry while its chunks stay indexed
+        unique_names = self.unique_source_names(source_names)
+        for name, unique_name in zip(source_names, unique_names):
+            if name != unique_name:
+                logger.warning(f"Duplicate document name {name} in one batch; indexing it as {unique_name}")
+        source_names = unique_names
+        if parallel and len(file_paths) > 1:
+            file_results = self._process_files_parallel(file_paths, source_names, max_workers, file_timeout,
+                                                        preview_pages)
+        else:
+            file_results = [self.process_single_document(file_path, source_name, preview_pages)
+                            for file_path, source_name in zip(file_paths, source_names)]
+        
+        timings = {"extraction": time.perf_counter() - started}
+        
+        if self.extraction_cache is not None:
+            hits = sum(1 for result in file_results if result.get("cache_hit"))
+            results["extraction_cache"] = {"hits": hits, "misses": len(file_results) - hits}
+            self.metrics.increment("extraction_cache_hits", hits)
+            self.metrics.increment("extraction_cache_misses", len(file_results) - hits)
+        
+        page_count = 0
+        for result in file_results:
             if result["status"] == "success":
                 results["successful"].append(result)
                 all_chunks.extend(result["chunks"])
                 results["total_chunks"] += result["chunk_count"]
                 results["total_words"] += result["word_count"]
+                page_count += result["page_count"]
+                for stage, seconds in result.get("timings", {}).items():
+                    self.metrics.observe("document" if stage == "total" else stage, seconds)
             else:
                 results["failed"].append(result)
+        self.metrics.increment("documents_processed", len(results["successful"]))
+        self.metrics.increment("documents_failed", len(results["failed"]))
+        self.metrics.increment("pages_processed", page_count)
         
-        # Create vector store if we have successful documents
+        # Embed the chunks of successful documents
         if all_chunks:
+            if self.embedding_cache is not None:
+                hits_before, misses_before = self.embedding_cache.hits, self.embedding_cache.misses
+            batches_before = self.embedding_pipeline.batches
+            api_calls_before = self._embedding_api_calls()
+            rate_limited_before = self.embedding_pipeline.rate_limited
+            try:
+                results["_embedded"] = self._embed_results(results["successful"])
+                timings["embed"] = results["_embedded"]["seconds"]
+            except Exception as e:
+                logger.error(f"Error creating vector store: {str(e)}")
+                results["vector_store_error"] = str(e)
+            results["embedding"] = {
+                "batches": self.embedding_pipeline.batches - batches_before,
+                "api_calls": self._embedding_api_calls() - api_calls_before,
+                "rate_limited": self.embedding_pipeline.rate_limited - rate_limited_before
+            }
+            self.metrics.increment("embedding_api_calls", results["embedding"]["api_calls"])
+            self.metrics.increment("embedding_rate_limited", results["embedding"]["rate_limited"])
+            if self.embedding_cache is not None:
+                hits = self.embedding_cache.hits - hits_before
+                misses = self.embedding_cache.misses - misses_before
+                results["embedding_cache"] = {"hits": hits, "misses": misses,
+                                              "hit_ratio": hits / (hits + misses) if hits + misses else 0.0}
+                self.metrics.increment("embedding_cache_hits", hits)
+                self.metrics.increment("embedding_cache_misses", misses)
+        
+        results["timings"] = timings
+        results["_started"] = started
+        results["_page_count"] = page_count
+        return results
+    
+    def index_documents(self, prepared: Dict[str, Any], append: bool = False) -> Dict[str, Any]:
+        """Add documents from ``prepare_documents`` to the vector store and return the ingest results.
+        
+        With ``append=True`` they are added to the existing store (replacing any
+        previous version of the same source) instead of rebuilding it.
+        """
+        results = prepared
+        started = results.pop("_started")
+        page_count = results.pop("_page_count")
+        embedded = results.pop("_embedded", None)
+        timings = results["timings"]
+        if embedded is not None:
             try:
-                self.vector_store = FAISS.from_documents(all_chunks, self.embeddings)
-                self.documents = all_chunks
-                logger.info(f"Created vector store with {len(all_chunks)} chunks")
+                timings["index_build"] = self._index_results(embedded, append)
             except Exception as e:
                 logger.error(f"Error creating vector store: {str(e)}")
                 results["vector_store_error"] = str(e)
         
+        timings["total"] = time.perf_counter() - started
+        results["pages_per_second"] = page_count / timings["total"] if timings["total"] else 0.0
+        self.metrics.observe("ingest", timings["total"])
         return results
     
-    def search_documents(self, query: str, k: int = 5) -> List[Document]:
-        """Search for relevant documents using vector similarity."""
+    def _embedding_api_calls(self) -> int:
+        """Embedding requests that reached the backend so far; cache hits and local vectors make none."""
+        if self._local_embeddings:
+            return 0
+        if self.embedding_cache is not None:
+            return self.embedding_cache.calls
+        return self.embedding_pipeline.batches
+    
+    def _embed_results(self, successful: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Embed the chunks of successfully processed documents, giving each document a new ingest id."""
+        chunks = []
+        chunk_ids = []
+        sources = {}
+        for result in successful:
+            # Every ingest of a source gets its own id so a later replacement can tombstone it
+            ingest_id = uuid.uuid4().hex
+            ids = [f"{ingest_id}-{chunk.metadata['chunk_id']}" for chunk in result["chunks"]]
+            for chunk in result["chunks"]:
+                chunk.metadata["ingest_id"] = ingest_id
+            sources[result["file_name"]] = {"ingest_id": ingest_id, "ids": ids,
+                                            "metadata": self._document_metadata(result["chunks"][0].metadata)}
+            chunks.extend(result["chunks"])
+            chunk_ids.extend(ids)
+        
+        # Embed explicitly so batching, concurrency and rate limits are under our control
+        texts = [chunk.page_content for chunk in chunks]
+        started = time.perf_counter()
+        vectors = self.embedding_pipeline.embed(texts)
+        seconds = time.perf_counter() - started
+        self.metrics.observe("embed", seconds)
+        return {"chunks": chunks, "ids": chunk_ids, "sources": sources, "vectors": vectors, "seconds": seconds}
+    
+    def _index_results(self, embedded: Dict[str, Any], append: bool) -> float:
+        """Add embedded chunks to the vector store, returning the seconds it took."""
+        started = time.perf_counter()
+        chunks, chunk_ids, sources, vectors = (embedded[key] for key in ("chunks", "ids", "sources", "vectors"))
+        text_embeddings = list(zip((chunk.page_content for chunk in chunks), vectors))
+        metadatas = [chunk.metadata for chunk in chunks]
+        
+        if append and self.vector_store is not None:
+            self._ensure_index_writable()
+            self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=chunk_ids)
+            for source in sources:
+                self.remove_document(source)
+            if self.lexical_index is not None:
+                self.lexical_index.add(chunks, chunk_ids)
+            self._upgrade_auto_index()
+            logger.info(f"Added {len(chunks)} chunks to vector store")
+        else:
+            index = create_faiss_index(np.asarray(vectors, dtype=np.float32), self.index_type,
+                                       self.nprobe, self.ef_search)
+            self.vector_store = FAISS(self.embeddings, index, ChunkStore(), {})
+            self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=chunk_ids)
+            self._sources = {}
+            self._tombstones = {}
+            self.lexical_index = BM25Index(lookup=self._lookup_chunk)
+            self.lexical_index.add(chunks, chunk_ids)
+            logger.info(f"Created vector store with {len(chunks)} chunks")
+        
+        self._sources.update(sources)
+        self._positions = None
+        self._enable_vector_lookup()
+        self.answer_cache.clear()
+        
+        seconds = time.perf_counter() - started
+        self.metrics.observe("index_build", seconds)
+        return seconds
+    
+    @staticmethod
+    def _document_metadata(metadata: Dict[str, Any]) -> Dict[str, Any]:
+        """The document-level part of a chunk's metadata."""
+        return {key: metadata.get(key) for key in DOCUMENT_FILTER_KEYS}
+    
+    def remove_document(self, source: str) -> bool:
+        """Remove a document from search results by source name.
+        
+        Its vectors are tombstoned and physically dropped by the next compaction.
+        """
+        entry = self._sources.pop(source, None)
+        if entry is None:
+            return False
+        
+        self._tombstones[entry["ingest_id"]] = entry["ids"]
+        self.answer_cache.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.remove(entry["ingest_id"])
+        
+        tombstoned = sum(len(ids) for ids in self._tombstones.values())
+        if tombstoned > COMPACTION_RATIO * self.vector_store.index.ntotal:
+            self.compact()
+        return True
+    
+    def compact(self):
+        """Physically delete tombstoned vectors from the index."""
+        if self.vector_store is None or not self._tombstones:
+            return
+        
+        dead_ids = [doc_id for ids in self._tombstones.values() for doc_id in ids]
+        self._ensure_index_writable()
+        try:
+            self.vector_store.delete(dead_ids)
+        except RuntimeError:
+            # Graph indexes (HNSW) and IVF direct maps cannot remove vectors; rebuild from the live ones instead
+            self._rebuild_index_without(set(dead_ids))
+        self._tombstones = {}
+        self._positions = None
+        logger.info(f"Compacted vector store, removed {len(dead_ids)} chunks")
+    
+    def _rebuild_index_without(self, dead_ids: set):
+        """Re-add every live vector to a fresh copy of the index, dropping ``dead_ids``."""
+        store = self.vector_store
+        keep = [i for i in range(store.index.ntotal) if store.index_to_docstore_id[i] not in dead_ids]
+        index = faiss.clone_index(store.index)
+        index.reset()
+        if keep:
+            index.add(store.index.reconstruct_batch(np.array(keep, dtype=np.int64)))
+        store.docstore.delete(list(dead_ids))
+        store.index_to_docstore_id = {n: store.index_to_docstore_id[i] for n, i in enumerate(keep)}
+        store.index = index
+    
+    def _upgrade_auto_index(self):
+        """Rebuild an ``"auto"`` index as the type its grown corpus calls for (e.g. Flat to HNSW).
+        
+        Only upgrades: a corpus shrinking back under a threshold keeps its
+        index, so appends and removals near one do not rebuild repeatedly.
+        """
+        store = self.vector_store
+        if self.index_type != "auto" or store is None:
+            return
+        n_vectors = store.index.ntotal
+        current = index_type_of(store.index)
+        wanted = choose_index_type(n_vectors)
+        if current not in AUTO_INDEX_TYPES or AUTO_INDEX_TYPES.index(wanted) <= AUTO_INDEX_TYPES.index(current):
+            return
+        
+        with self.metrics.time("index_rebuild"):
+            rows = np.arange(n_vectors)
+            if n_vectors > INDEX_TRAIN_SAMPLE:
+                rows = np.sort(np.random.default_rng(0).choice(n_vectors, INDEX_TRAIN_SAMPLE, replace=False))
+            index = create_faiss_index(self._reconstruct(rows), wanted, self.nprobe, self.ef_search,
+                                       n_vectors=n_vectors)
+            # Copy vectors over in slices so the whole corpus is never decoded at once
+            for start in range(0, n_vectors, INDEX_TRAIN_SAMPLE):
+                index.add(self._reconstruct(np.arange(start, min(start + INDEX_TRAIN_SAMPLE, n_vectors))))
+        store.index = index
+        self._mapped_index_path = None
+        logger.info(f"Rebuilt the {current} index as {wanted} for {n_vectors} vectors")
+    
+    def _enable_vector_lookup(self):
+        """Give an IVF index the direct map ``_reconstruct`` needs to read vectors back by position.
+        
+        This mutates the index, so it runs where the index is changed or
+        loaded rather than from searches. The map is saved with the index.
+        """
+        try:
+            ivf = faiss.extract_index_ivf(self.vector_store.index)
+        except RuntimeError:
+            return
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            self._ensure_index_writable()
+            faiss.extract_index_ivf(self.vector_store.index).make_direct_map()
+    
+    def _ensure_index_writable(self):
+        """Replace a memory-mapped (read-only) index with an owned copy before mutating it."""
+        if self._mapped_index_path is not None:
+            self.vector_store.index = faiss.read_index(self._mapped_index_path)
+            set_search_params(self.vector_store.index, self.nprobe, self.ef_search)
+            self._mapped_index_path = None
+    
+    def save(self, path: str, compact: bool = True):
+        """Persist the vector index, chunk texts and metadata to a workspace directory.
+        
+        Layout (``WORKSPACE_FORMAT_VERSION``): ``index.faiss``, the raw FAISS
+        index; ``texts.bin``, all chunk texts concatenated as UTF-8;
+        ``offsets.npy``, byte offsets of each chunk in ``texts.bin``;
+        ``chunks.jsonl``, docstore id and metadata per index position; and
+        ``manifest.json``, written last so a partial save is never loadable.
+        Files are written under temporary names and then renamed, so saving
+        over the workspace this processor was loaded from (whose files are
+        memory-mapped) is safe.
+        
+        Tombstoned vectors are compacted away first. With ``compact=False``
+        the caller must have done that (e.g. while holding the index
+        exclusively); saving then only reads the processor.
+        """
+        if self.vector_store is None:
+            raise ValueError("No documents processed")
+        if compact:
+            self.compact()
+        elif self._tombstones:
+            raise ValueError("Compact the index before saving it without compaction")
+        os.makedirs(path, exist_ok=True)
+        manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        
+        store = self.vector_store
+        offsets = np.zeros(store.index.ntotal + 1, dtype=np.int64)
+        with open(os.path.join(path, "texts.bin.tmp"), "wb") as texts_file, \
+                open(os.path.join(path, "chunks.jsonl.tmp"), "w", encoding="utf-8") as chunks_file:
+            for i in range(store.index.ntotal):
+                doc_id = store.index_to_docstore_id[i]
+                doc = store.docstore.search(doc_id)
+                encoded = doc.page_content.encode("utf-8")
+                texts_file.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+                chunks_file.write(json.dumps({"id": doc_id, "metadata": doc.metadata}) + "\n")
+        with open(os.path.join(path, "offsets.npy.tmp"), "wb") as offsets_file:
+            np.save(offsets_file, offsets)
+        faiss.write_index(store.index, os.path.join(path, "index.faiss.tmp"))
+        for name in ("texts.bin", "chunks.jsonl", "offsets.npy", "index.faiss"):
+            os.replace(os.path.join(path, name + ".tmp"), os.path.join(path, name))
+        
+        with open(manifest_path, "w", encoding="utf-8") as file:
+            json.dump({
+                "format_version": WORKSPACE_FORMAT_VERSION,
+                "embedding_model": self.embedding_model,
+                "chunk_size": self.chunk_size,
+                "chunk_overlap": self.chunk_overlap,
+                "chunk_unit": self.chunk_unit,
+                "chunk_count": int(store.index.ntotal),
+                "dimension": int(store.index.d),
+                "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            }, file, indent=2)
+        logger.info(f"Saved workspace with {store.index.ntotal} chunks to {path}")
+    
+    @classmethod
+    def load(cls, path: str, openai_api_key: str,
+             chunk_records: Optional[Tuple[List[str], List[Dict[str, Any]]]] = None,
+             **kwargs) -> "DocumentProcessor":
+        """Open a workspace written by ``save``; extra arguments go to the constructor.
+        
+        The FAISS index and the chunk texts are memory-mapped, so startup cost
+        does not grow with the size of the corpus' vectors and texts. A
+        workspace embedded locally is opened with the local backend unless
+        ``embeddings`` or ``embedding_backend`` say otherwise.
+        ``chunk_records`` are the workspace's ``read_chunk_records``, when
+        already read; they are never modified, so processors may share them.
+        """
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as file:
+            manifest = json.load(file)
+        if manifest.get("format_version") != WORKSPACE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported workspace format version: {manifest.get('format_version')}")
+        if "embeddings" not in kwargs:
+            kwargs.setdefault("embedding_backend", cls.workspace_embedding_backend(path))
+        # Later ingests are chunked like the saved ones
+        for key in ("chunk_size", "chunk_overlap", "chunk_unit"):
+            if key in manifest:
+                kwargs.setdefault(key, manifest[key])
+        
+        processor = cls(openai_api_key, **kwargs)
+        if manifest["embedding_model"] != processor.embedding_model:
+            raise ValueError(f"Workspace was embedded with {manifest['embedding_model']}, "
+                             f"not {processor.embedding_model}")
+        
+        ids, metadatas = chunk_records or cls.read_chunk_records(path)
+        offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        docstore = MappedDocstore(os.path.join(path, "texts.bin"), offsets, ids, metadatas)
+        
+        index_path = os.path.join(path, "index.faiss")
+        mmap_flags = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+        if mmap_flags is not None:
+            index = faiss.read_index(index_path, mmap_flags | faiss.IO_FLAG_READ_ONLY)
+            processor._mapped_index_path = index_path
+        else:
+            index = faiss.read_index(index_path)
+        set_search_params(index, processor.nprobe, processor.ef_search)
+        
+        processor.vector_store = FAISS(processor.embeddings, index, docstore, dict(enumerate(ids)))
+        processor.lexical_index = None
+        for doc_id, metadata in zip(ids, metadatas):
+            entry = processor._sources.setdefault(metadata["source"], {
+                "ingest_id": metadata["ingest_id"], "ids": [], "metadata": cls._document_metadata(metadata)})
+            entry["ids"].append(doc_id)
+        # Workspaces saved before IVF indexes kept a direct map are given one now, before any search
+        processor._enable_vector_lookup()
+        
+        logger.info(f"Loaded workspace with {len(ids)} chunks from {path}")
+        return processor
+    
+    @staticmethod
+    def read_chunk_records(path: str) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Ids and metadata of a saved workspace's chunks, in index order."""
+        ids = []
+        metadatas = []
+        with open(os.path.join(path, "chunks.jsonl"), encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                ids.append(record["id"])
+                metadatas.append(record["metadata"])
+        return ids, metadatas
+    
+    @staticmethod
+    def workspace_embedding_backend(path: str) -> str:
+        """The entry of ``EMBEDDING_BACKENDS`` whose vectors a saved workspace holds."""
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as file:
+            model = json.load(file)["embedding_model"]
+        return "local" if is_local_embedding_model(model) else "openai"
+    
+    def _search_kwargs(self, k: int) -> Dict[str, Any]:
+        """Similarity search arguments that skip tombstoned chunks."""
+        if not self._tombstones:
+            return {"k": k}
+        
+        dead = set(self._tombstones)
+        return {
+            "k": k,
+            "filter": lambda metadata: metadata.get("ingest_id") not in dead,
+            "fetch_k": k + sum(len(ids) for ids in self._tombstones.values())
+        }
+    
+    def embed_query(self, query: str) -> List[float]:
+        """Embed a search query, serving repeats from the in-memory LRU cache."""
+        query = self.query_cache.normalize(query)
+        vector = self.query_cache.get(self.embedding_model, query)
+        if vector is None:
+            with self.metrics.time("query_embed"):
+                vector = self.embeddings.embed_query(query)
+            if not self._local_embeddings:
+                self.metrics.increment("query_embedding_api_calls")
+            self.query_cache.put(self.embedding_model, query, vector)
+        else:
+            self.metrics.increment("query_cache_hits")
+        return vector
+    
+    def _get_lexical_index(self) -> BM25Index:
+        """The BM25 index, built from the live chunks on first use after a workspace load."""
+        with self._lexical_lock:
+            if self.lexical_index is None:
+                with self.metrics.time("lexical_index_build"):
+                    lexical_index = BM25Index(lookup=self._lookup_chunk)
+                    live = list(self._iter_live_chunks())
+                    lexical_index.add([doc for _, doc in live], [doc_id for doc_id, _ in live])
+                self.lexical_index = lexical_index
+        return self.lexical_index
+    
+    def _vector_search(self, query: str, k: int,
+                       filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        embedding = self.embed_query(query)
+        if filter:
+            return self._filtered_vector_search(embedding, k, filter)
+        results = self.vector_store.similarity_search_with_score_by_vector(embedding, **self._search_kwargs(k))
+        return [(doc, float(score)) for doc, score in results]
+    
+    def _filtered_vector_search(self, embedding: List[float], k: int,
+                                filter: Dict[str, Any]) -> List[Tuple[Document, float]]:
+        """Vector search restricted to chunks whose metadata matches ``filter``.
+        
+        Conditions on document-level keys (``DOCUMENT_FILTER_KEYS``) first
+        select the matching sources; only those sources' vectors are read back
+        from the index and scored exactly, so the cost follows the number of
+        selected chunks rather than the corpus size. Filters on chunk-level keys
+        alone (e.g. ``page``) over-fetch from the whole index instead.
+        """
+        document_filter = {key: value for key, value in filter.items() if key in DOCUMENT_FILTER_KEYS}
+        chunk_filter = {key: value for key, value in filter.items() if key not in DOCUMENT_FILTER_KEYS}
+        
+        if not document_filter:
+            kwargs = self._search_kwargs(k)
+            live = kwargs.get("filter")
+            kwargs["filter"] = lambda metadata: (live is None or live(metadata)) and metadata_matches(metadata, chunk_filter)
+            kwargs["fetch_k"] = kwargs.get("fetch_k", k) + k * FILTER_FETCH_MULTIPLIER
+            results = self.vector_store.similarity_search_with_score_by_vector(embedding, **kwargs)
+            return [(doc, float(score)) for doc, score in results]
+        
+        ids = [doc_id for name in self._matching_sources(document_filter) for doc_id in self._sources[name]["ids"]]
+        
+        docstore = self.vector_store.docstore
+        docs = None
+        if chunk_filter and ids:
+            docs = [docstore.search(doc_id) for doc_id in ids]
+            keep = [i for i, doc in enumerate(docs) if metadata_matches(doc.metadata, chunk_filter)]
+            ids = [ids[i] for i in keep]
+            docs = [docs[i] for i in keep]
+        if not ids:
+            return []
+        
+        vectors = self._reconstruct([self._index_positions()[doc_id] for doc_id in ids])
+        query = np.asarray(embedding, dtype=np.float32)
+        if self.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            scores = -(vectors @ query)
+        else:
+            scores = ((vectors - query) ** 2).sum(axis=1)
+        
+        top = np.arange(len(ids))
+        if len(ids) > k:
+            top = np.argpartition(scores, k - 1)[:k]
+        top = top[np.argsort(scores[top], kind="stable")]
+        sign = -1.0 if self.vector_store.index.metric_type == faiss.METRIC_INNER_PRODUCT else 1.0
+        return [(docs[i] if docs is not None else docstore.search(ids[i]), sign * float(scores[i])) for i in top]
+    
+    def _matching_sources(self, document_filter: Dict[str, Any]) -> List[str]:
+        """Names of the documents whose document-level metadata matches ``document_filter``."""
+        # A single named source is a direct lookup
+        source = document_filter.get("source")
+        if isinstance(source, str):
+            candidates = [source] if source in self._sources else []
+        else:
+            candidates = list(self._sources)
+        return [name for name in candidates if metadata_matches(self._sources[name]["metadata"], document_filter)]
+    
+    def _lexical_search(self, query: str, k: int,
+                        filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """BM25 search; document-level filter conditions select the scored rows by ingest."""
+        ingest_ids = None
+        predicate = None
+        if filter:
+            document_filter = {key: value for key, value in filter.items() if key in DOCUMENT_FILTER_KEYS}
+            chunk_filter = {key: value for key, value in filter.items() if key not in DOCUMENT_FILTER_KEYS}
+            if document_filter:
+                ingest_ids = [self._sources[name]["ingest_id"] for name in self._matching_sources(document_filter)]
+            if chunk_filter:
+                predicate = lambda doc: metadata_matches(doc.metadata, chunk_filter)
+        return self._get_lexical_index().search(query, k, predicate, ingest_ids)
+    
+    def _index_positions(self) -> Dict[str, int]:
+        """Map docstore ids to their current position in the FAISS index."""
+        if self._positions is None:
+            self._positions = {doc_id: position for position, doc_id in self.vector_store.index_to_docstore_id.items()}
+        return self._positions
+    
+    def _reconstruct(self, positions: List[int]) -> np.ndarray:
+        """Read stored vectors back from the index (decoded, for quantized indexes)."""
+        # IVF indexes are given the direct map this needs by _enable_vector_lookup
+        return self.vector_store.index.reconstruct_batch(np.array(positions, dtype=np.int64))
+    
+    def retrieve(self, query: str, k: int = 5, mode: str = "vector",
+                 filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k chunks for a query with their scores, retrieving in a single pass.
+        
+        ``mode`` selects the retriever and the meaning of the score:
+        ``"vector"`` embeds the query once and scores by L2 distance (lower is
+        closer); ``"lexical"`` uses BM25 only, with no embedding call (higher
+        is better); ``"hybrid"`` fuses both rankings with reciprocal rank
+        fusion (higher is better).
+        
+        ``filter`` restricts results to chunks whose metadata matches (see
+        ``metadata_matches``), e.g. ``{"source": "claim_1234.pdf", "page": [1, 2]}``.
+        Chunks carry ``source``, ``page``, ``category`` and ``date`` metadata.
+        """
         if self.vector_store is None:
             return []
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}")
         
+        with self.metrics.time(f"search_{mode}"):
+            return self._retrieve(query, k, mode, filter)
+    
+    def _retrieve(self, query: str, k: int, mode: str,
+                  filter: Optional[Dict[str, Any]]) -> List[Tuple[Document, float]]:
+        if mode == "vector":
+            return self._vector_search(query, k, filter)
+        if mode == "lexical":
+            return self._lexical_search(query, k, filter)
+        
+        candidates = max(k, HYBRID_CANDIDATES)
+        fused: Dict[Tuple[str, int], List[Any]] = {}
+        for ranking in (self._vector_search(query, candidates, filter),
+                        self._lexical_search(query, candidates, filter)):
+            for rank, (doc, _) in enumerate(ranking):
+                key = (doc.metadata.get("ingest_id"), doc.metadata.get("chunk_id"))
+                entry = fused.setdefault(key, [doc, 0.0])
+                entry[1] += 1.0 / (RRF_K + rank + 1)
+        ranked = sorted(fused.values(), key=lambda entry: entry[1], reverse=True)
+        return [(doc, score) for doc, score in ranked[:k]]
+    
+    @staticmethod
+    def format_context(docs: List[Document]) -> str:
+        """Join retrieved chunks into the context block used in chat prompts."""
+        return "\n\n".join([doc.page_content for doc in docs])
+    
+    @classmethod
+    def build_context(cls, docs: List[Document], max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> Dict[str, Any]:
+        """Assemble a prompt context from chunks in relevance order within a token budget.
+        
+        Chunks of the same page that overlap or touch (by their ``start_index``
+        / ``end_index`` offsets) are merged into one passage, so the text the
+        splitter repeats between neighbouring chunks is sent once. Passages are
+        added by the rank of their best chunk; a passage that no longer fits is
+        skipped, and the top passage is truncated when it alone exceeds the
+        budget. Besides the ``context`` text, the result reports
+        ``context_tokens``, the ``naive_tokens`` of joining the chunks as
+        ``format_context`` does, and ``tokens_saved``.
+        """
+        # Group chunks by page, remembering each chunk's rank
+        pages: Dict[Tuple[Any, ...], List[Tuple[int, int, int, str]]] = {}
+        for rank, doc in enumerate(docs):
+            metadata = doc.metadata
+            start = metadata.get("start_index")
+            if start is None:
+                key, start = ("chunk", rank), 0
+            else:
+                key = (metadata.get("source"), metadata.get("ingest_id"), metadata.get("page"))
+            pages.setdefault(key, []).append((start, start + len(doc.page_content), rank, doc.page_content))
+        
+        # Merge overlapping or adjacent spans; a passage ranks as its best chunk
+        passages = []
+        for spans in pages.values():
+            spans.sort()
+            start, end, rank, text = spans[0]
+            for next_start, next_end, next_rank, next_text in spans[1:]:
+                if next_start <= end:
+                    if next_end > end:
+                        text += next_text[end - next_start:]
+                        end = next_end
+                    rank = min(rank, next_rank)
+                else:
+                    passages.append((rank, text))
+                    start, end, rank, text = next_start, next_end, next_rank, next_text
+            passages.append((rank, text))
+        passages.sort()
+        
+        # Fill the budget by relevance
+        selected = []
+        used = 0
+        for _, text in passages:
+            tokens = count_tokens("\n\n" + text if selected else text)
+            if used + tokens <= max_tokens:
+                selected.append(text)
+                used += tokens
+            elif not selected:
+                selected.append(text[:max(0, len(text) * max_tokens // tokens)])
+                used = max_tokens
+        
+        context = "\n\n".join(selected)
+        context_tokens = count_tokens(context) if context else 0
+        naive_tokens = count_tokens(cls.format_context(docs)) if docs else 0
+        return {
+            "context": context,
+            "context_tokens": context_tokens,
+            "naive_tokens": naive_tokens,
+            "tokens_saved": max(0, naive_tokens - context_tokens),
+            "chunks": len(docs),
+            "passages": len(selected)
+        }
+    
+    def search_documents(self, query: str, k: int = 5, mode: str = "vector",
+                         filter: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Search for relevant documents using vector similarity, BM25 or both, optionally filtered (see ``retrieve``)."""
         try:
-            docs = self.vector_store.similarity_search(query, k=k)
-            return docs
+            return [doc for doc, _ in self.retrieve(query, k=k, mode=mode, filter=filter)]
         except Exception as e:
             logger.error(f"Error searching documents: {str(e)}")
             return []
     
-    def get_chat_model(self) -> ChatOpenAI:
+    @staticmethod
+    def create_chat_model(openai_api_key: str) -> ChatOpenAI:
         """Create a chat model for AI responses."""
         try:
             llm = ChatOpenAI(
-                openai_api_key=self.openai_api_key,
+                openai_api_key=openai_api_key,
                 model_name="gpt-3.5-turbo",
                 temperature=0.7
             )
@@ -149,28 +2590,110 @@ class DocumentProcessor:
             logger.error(f"Error creating chat model: {str(e)}")
             return None
     
-    def get_context_for_query(self, query: str, k: int = 5) -> str:
-        """Get relevant context for a query from the vector store."""
-        if self.vector_store is None:
-            return ""
+    def get_chat_model(self) -> ChatOpenAI:
+        """The processor's chat model, created on first use."""
+        if self._chat_model is None:
+            self._chat_model = self.create_chat_model(self.openai_api_key)
+        return self._chat_model
+    
+    @staticmethod
+    def build_chat_prompt(question: str, context: str) -> str:
+        """Fill the chat prompt with retrieved context."""
+        return CHAT_PROMPT_TEMPLATE.format(context=context, question=question)
+    
+    def stream_answer(self, question: str, chat_model: Optional[Any] = None, k: int = 5,
+                      mode: str = "hybrid", filter: Optional[Dict[str, Any]] = None,
+                      use_cache: bool = True, max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> ChatAnswerStream:
+        """Answer a question from the documents, streaming the model's tokens.
         
+        Retrieval runs once; its top three chunks' sources are reported as the
+        answer's sources, and the chunks are assembled into at most
+        ``max_tokens`` of context (see ``build_context``). ``chat_model``
+        defaults to ``get_chat_model()``.
+        Unfiltered questions similar enough to an earlier one on the same
+        documents, asked with the same ``k``, ``mode`` and ``max_tokens``, are
+        answered from ``answer_cache`` without retrieval or a model call;
+        completed answers are stored there.
+        """
+        started = time.perf_counter()
+        on_complete = None
+        if use_cache and not filter:
+            # Answers built from a different retrieval or context budget are not reused
+            fingerprint = f"{self.document_set_fingerprint()}:{k}:{mode}:{max_tokens}"
+            vector = self.embed_query(question)
+            cached = self.answer_cache.get(fingerprint, vector)
+            if cached is not None:
+                self.metrics.increment("answer_cache_hits")
+                return ChatAnswerStream(iter([cached["text"]]), cached["sources"], started, cached=True)
+            self.metrics.increment("answer_cache_misses")
+            
+            def on_complete(answer: ChatAnswerStream):
+                if answer.text:
+                    self.answer_cache.put(fingerprint, vector, {"text": answer.text, "sources": answer.sources})
+        
+        retrieved = self.retrieve(question, k=k, mode=mode, filter=filter)
+        with self.metrics.time("prompt_build"):
+            context = self.build_context([doc for doc, _ in retrieved], max_tokens)
+            prompt = self.build_chat_prompt(question, context["context"])
+        sources = [doc.metadata.get("source", "Unknown") for doc, _ in retrieved[:3]]
+        chat_model = chat_model or self.get_chat_model()
+        if chat_model is None:
+            raise RuntimeError("No chat model available")
+        self.metrics.increment("llm_calls")
+        answer = ChatAnswerStream(chat_model.stream(prompt), sources, started, on_complete=on_complete,
+                                  metrics=self.metrics)
+        answer.context_tokens = context["context_tokens"]
+        answer.tokens_saved = context["tokens_saved"]
+        self.metrics.increment("context_tokens", answer.context_tokens)
+        self.metrics.increment("context_tokens_saved", answer.tokens_saved)
+        return answer
+    
+    def get_context_for_query(self, query: str, k: int = 5, max_tokens: int = DEFAULT_CONTEXT_TOKENS) -> str:
+        """Get relevant context for a query from the vector store, within a token budget."""
         try:
-            docs = self.vector_store.similarity_search(query, k=k)
-            context = "\n\n".join([doc.page_content for doc in docs])
-            return context
+            return self.build_context([doc for doc, _ in self.retrieve(query, k=k)], max_tokens)["context"]
         except Exception as e:
             logger.error(f"Error getting context: {str(e)}")
             return ""
     
+    def document_set_fingerprint(self) -> str:
+        """Hash identifying the indexed documents; it changes whenever one is added, replaced or removed."""
+        digest = hashlib.sha256()
+        for source in sorted(self._sources):
+            digest.update(f"{source}\0{self._sources[source]['ingest_id']}\n".encode("utf-8"))
+        return digest.hexdigest()
+    
+    def metrics_snapshot(self) -> Dict[str, Any]:
+        """Stage timings and counters (see ``PipelineMetrics.snapshot``) plus the statistics of every cache."""
+        snapshot = self.metrics.snapshot()
+        caches = {"query_embedding": self.query_cache.stats(), "answer": self.answer_cache.stats()}
+        if self.embedding_cache is not None:
+            caches["embedding"] = self.embedding_cache.stats()
+        if self.extraction_cache is not None:
+            caches["extraction"] = self.extraction_cache.stats()
+        snapshot["caches"] = caches
+        return snapshot
+    
+    def export_metrics(self, format: str = "json") -> str:
+        """Render ``metrics_snapshot()`` as ``"json"`` or Prometheus text (``"prometheus"``)."""
+        snapshot = self.metrics_snapshot()
+        if format == "json":
+            return json.dumps(snapshot, indent=2)
+        if format == "prometheus":
+            return PipelineMetrics.to_prometheus(snapshot)
+        raise ValueError(f"Unknown metrics format: {format}")
+    
     def get_document_summary(self) -> Dict[str, Any]:
         """Get a summary of all processed documents."""
-        if not self.documents:
+        if not self._sources:
             return {"message": "No documents processed"}
         
         summary = {
-            "total_documents": len(set(doc.metadata.get("source", "unknown") for doc in self.documents)),
-            "total_chunks": len(self.documents),
-            "document_sources": list(set(doc.metadata.get("source", "unknown") for doc in self.documents))
+            "total_documents": len(self._sources),
+            "total_chunks": sum(len(entry["ids"]) for entry in self._sources.values()),
+            "document_sources": list(self._sources),
+            "document_categories": sorted({entry["metadata"]["category"] or DEFAULT_DOCUMENT_CATEGORY
+                                           for entry in self._sources.values()})
         }
         
         return summary
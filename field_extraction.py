@@ -0,0 +1,216 @@
+"""
+Field extraction for processed documents.
+
+``FieldExtractor`` turns a document's text into the fields shown in the
+processing summary: counts, category, key topics, and claim-specific fields
+such as claim number, dates and amounts. The text is lowercased and tokenized
+once. All category keywords are matched in a single scan by one precompiled
+regex. Results are cached by a hash of the text, so Streamlit reruns and
+repeated documents cost a dictionary lookup.
+"""
+
+import re
+import time
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+from typing import List, Dict, Any, Optional, Iterator, Callable, Tuple
+
+# Document categories in priority order, with the keywords that identify each
+DOCUMENT_CATEGORIES = [
+    ("Financial Document", ("invoice", "bill", "receipt")),
+    ("Legal Document", ("contract", "agreement", "terms")),
+    ("Report Document", ("report", "analysis", "summary")),
+    ("Communication Document", ("email", "message", "communication")),
+]
+DEFAULT_DOCUMENT_CATEGORY = "General Document"
+
+# Default number of documents whose extracted fields are kept in memory
+DEFAULT_FIELD_CACHE_SIZE = 4096
+
+# Number of most frequent words reported as key topics
+KEY_TOPIC_COUNT = 5
+
+# Every category keyword in one alternation, so a text is scanned once for all of them.
+# Keywords contain no whitespace, so scanning the distinct words finds the same matches.
+_CATEGORY_PATTERN = re.compile("|".join(re.escape(keyword) for _, keywords in DOCUMENT_CATEGORIES
+                                        for keyword in keywords))
+
+# ISO (2024-03-15) and US (03/15/2024) date candidates; the shape is validated in find_dates.
+# Leading with a character class (no \b or alternation) lets the regex engine skip ahead quickly.
+_DATE_PATTERN = re.compile(r"([0-9]{1,4})([-/])([0-9]{1,2})\2([0-9]{1,4})(?![0-9])")
+
+# Claim identifiers in lowercased text: clm-0042 style, or an identifier following "claim number/no./#"
+_CLAIM_ID_PATTERN = re.compile(r"clm-?[0-9][\w-]*")
+_CLAIM_LABEL_PATTERN = re.compile(r"claim\s*(?:number|no\.?|#)\s*[:#]?\s*([a-z0-9-]*[0-9][a-z0-9-]*)")
+
+# Dollar amounts such as $1,250.00 or $ 300
+_AMOUNT_PATTERN = re.compile(r"\$\s?(\d{1,3}(?:,\d{3})+|\d+)(\.\d{1,2})?")
+
+
+def category_keywords(text: str) -> set:
+    """Category keywords occurring anywhere in the text (case-insensitive)."""
+    return set(_CATEGORY_PATTERN.findall(" ".join(set(text.lower().split()))))
+
+
+def classify_keywords(keywords: set) -> str:
+    """Pick the highest-priority document category matched by a set of keywords."""
+    for category, category_words in DOCUMENT_CATEGORIES:
+        if keywords.intersection(category_words):
+            return category
+    return DEFAULT_DOCUMENT_CATEGORY
+
+
+def find_dates(text: str) -> Iterator[str]:
+    """Valid calendar dates in the text, in order of appearance, as ``YYYY-MM-DD``."""
+    for match in _DATE_PATTERN.finditer(text):
+        if match.start() and text[match.start() - 1].isdigit():
+            continue
+        first, separator, middle, last = match.groups()
+        if separator == "-" and len(first) == 4 and len(last) <= 2:
+            year, month, day = first, middle, last
+        elif separator == "/" and len(last) == 4 and len(first) <= 2:
+            year, month, day = last, first, middle
+        else:
+            continue
+        if 1 <= int(month) <= 12 and 1 <= int(day) <= 31:
+            yield f"{year}-{int(month):02d}-{int(day):02d}"
+
+
+def find_date(text: str) -> Optional[str]:
+    """First valid calendar date in the text, as ``YYYY-MM-DD``."""
+    return next(find_dates(text), None)
+
+
+def extract_claim_number(text: str) -> Optional[str]:
+    """First claim number mentioned in the text."""
+    lowered = text.lower()
+    matches = [match for match in (_CLAIM_ID_PATTERN.search(lowered), _CLAIM_LABEL_PATTERN.search(lowered)) if match]
+    if not matches:
+        return None
+    match = min(matches, key=lambda match: match.start())
+    return match.group(match.lastindex or 0).upper()
+
+
+def extract_dates(text: str) -> Optional[str]:
+    """Distinct dates mentioned in the text, comma separated."""
+    dates = list(dict.fromkeys(find_dates(text)))
+    return ", ".join(dates) if dates else None
+
+
+def extract_amounts(text: str) -> Optional[str]:
+    """Distinct dollar amounts mentioned in the text, comma separated."""
+    amounts = [float(whole.replace(",", "") + (cents or "")) for whole, cents in _AMOUNT_PATTERN.findall(text)]
+    if not amounts:
+        return None
+    return ", ".join(f"${amount:,.2f}" for amount in dict.fromkeys(amounts))
+
+
+# Claims-specific fields added to every extraction: field name -> extractor on the raw text
+CLAIM_EXTRACTORS = [
+    ("Claim Number", extract_claim_number),
+    ("Dates", extract_dates),
+    ("Amounts", extract_amounts),
+]
+
+
+class FieldExtractor:
+    """Extract summary fields from document text, with pluggable extractors and a result cache.
+
+    Extra fields are registered as ``(name, function)`` pairs; each function
+    receives the document text and returns a value, or None to omit the field.
+    Results are kept in an LRU keyed by the SHA-256 of the text.
+    """
+
+    def __init__(self, extractors: Optional[List[Tuple[str, Callable[[str], Any]]]] = None,
+                 cache_size: int = DEFAULT_FIELD_CACHE_SIZE):
+        self.extractors = list(CLAIM_EXTRACTORS if extractors is None else extractors)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, extractor: Callable[[str], Any]):
+        """Add an extractor for a new field; cached results are dropped so it applies everywhere."""
+        self.extractors.append((name, extractor))
+        self.clear()
+
+    def clear(self):
+        """Drop all cached results."""
+        with self._lock:
+            self._cache.clear()
+
+    def _extract(self, text: str) -> Dict[str, Any]:
+        lowered = text.lower()
+        words = lowered.split()
+        word_count = len(words)
+
+        # Key topics: most frequent longer alphabetic words, ties in order of first appearance
+        counts = Counter(words)
+        topics = Counter({word: count for word, count in counts.items() if len(word) > 4 and word.isalpha()})
+
+        fields = {
+            "Total Words": word_count,
+            "Total Characters": len(text),
+            "Estimated Pages": max(1, word_count // 250),
+            "Language": "English",  # Could be enhanced with language detection
+            "Document Type": "PDF Document",
+            # Placeholder keeping the field's position; ``extract`` fills in the current time
+            "Processing Date": None,
+            "Document Category": classify_keywords(set(_CATEGORY_PATTERN.findall(" ".join(counts)))),
+            "Key Topics": ", ".join(word for word, _ in topics.most_common(KEY_TOPIC_COUNT))
+        }
+        for name, extractor in self.extractors:
+            value = extractor(text)
+            if value is not None:
+                fields[name] = value
+        return fields
+
+    def extract(self, text: str, filename: str) -> Dict[str, Any]:
+        """Extract meaningful fields from document text."""
+        key = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            fields = self._cache.get(key)
+            if fields is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        if fields is None:
+            fields = self._extract(text)
+            with self._lock:
+                self.misses += 1
+                self._cache[key] = fields
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        # Only fields derived from the text are cached; the name and processing time are per call
+        return {"Document Name": filename, **fields, "Processing Date": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+    def extract_many(self, documents: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Extract fields for a batch of ``(text, filename)`` pairs."""
+        return [self.extract(text, filename) for text, filename in documents]
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache hit/miss counters."""
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._cache)}
+
+
+# Shared extractor used by the app
+default_extractor = FieldExtractor()
+
+
+def extract_document_fields(text: str, filename: str) -> Dict[str, Any]:
+    """Extract meaningful fields from document text (cached, see ``FieldExtractor``)."""
+    return default_extractor.extract(text, filename)
+
+
+def extract_result_fields(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields of a processed document whose ``text`` may hold only its first pages.
+
+    Counts and the category come from the whole document, as recorded in the
+    processing result; the other fields are read from the text kept.
+    """
+    fields = extract_document_fields(result["text"], result["file_name"])
+    return {**fields, "Total Words": result["word_count"], "Total Characters": result["char_count"],
+            "Estimated Pages": result["page_count"], "Document Category": result["category"]}
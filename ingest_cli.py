@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Headless, resumable batch ingestion of PDF archives.
+
+Walks one or more directory trees, processes the PDFs in batches with
+``DocumentProcessor`` and appends one JSON line per file (fields, chunk and
+page counts, or the error) to a results log. Every ``--checkpoint-every``
+files the index is saved to the workspace and a checkpoint records how much
+of the results log that index covers. A killed run started again with the same
+arguments reloads the workspace, drops log lines written after the last
+checkpoint and continues with the files not yet covered. Documents are named by
+their path relative to the input directory, so equal file names in different
+folders do not collide.
+
+    python ingest_cli.py /data/claims --workspace .cache/workspace
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Callable
+
+from dotenv import load_dotenv
+
+from document_processor import (DocumentProcessor, DEFAULT_FILE_TIMEOUT, DEFAULT_PREVIEW_PAGES, INDEX_TYPES,
+                                EMBEDDING_BACKENDS)
+from field_extraction import extract_result_fields
+
+# Files handed to the processor at once; bounds the text and chunks held in memory
+DEFAULT_BATCH_SIZE = 64
+
+# Files processed between saves of the index (and checkpoints)
+DEFAULT_CHECKPOINT_EVERY = 1024
+
+# Names of the results log and checkpoint inside the workspace
+RESULTS_FILE = "ingest_results.jsonl"
+CHECKPOINT_FILE = "ingest_checkpoint.json"
+
+
+def iter_pdf_files(roots: List[str]) -> Iterator[Tuple[str, str]]:
+    """Yield (path, source name) for every PDF under the roots, in a stable order."""
+    for root in roots:
+        root = os.path.abspath(root)
+        prefix = os.path.basename(root) if len(roots) > 1 else ""
+        for directory, dirs, files in os.walk(root):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    path = os.path.join(directory, name)
+                    yield path, os.path.join(prefix, os.path.relpath(path, root)).replace(os.sep, "/")
+
+
+def file_record(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The results-log line for one processed file."""
+    if result["status"] != "success":
+        return {"source": result["file_name"], "status": result["status"], "error": result.get("error")}
+    return {
+        "source": result["file_name"],
+        "status": "success",
+        "chunk_count": result["chunk_count"],
+        "page_count": result["page_count"],
+        "word_count": result["word_count"],
+        "cache_hit": result.get("cache_hit", False),
+        "fields": extract_result_fields(result)
+    }
+
+
+def _read_checkpoint(workspace: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(workspace, CHECKPOINT_FILE), encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"results_offset": 0, "files": 0}
+
+
+def _write_checkpoint(workspace: str, checkpoint: Dict[str, Any]):
+    path = os.path.join(workspace, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(checkpoint, file)
+    os.replace(path + ".tmp", path)
+
+
+def ingest_directory(roots: List[str], workspace: str, openai_api_key: str,
+                     processor_kwargs: Optional[Dict[str, Any]] = None,
+                     batch_size: int = DEFAULT_BATCH_SIZE, checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+                     parallel: bool = True, max_workers: Optional[int] = None,
+                     file_timeout: Optional[float] = DEFAULT_FILE_TIMEOUT,
+                     progress: Callable[[str], None] = print) -> Dict[str, Any]:
+    """Ingest every PDF under ``roots`` into the workspace, resuming a previous run.
+
+    Returns totals for this run: files processed, failed and skipped (already
+    done), pages, chunks and elapsed seconds.
+    """
+    processor_kwargs = processor_kwargs or {}
+    os.makedirs(workspace, exist_ok=True)
+    results_path = os.path.join(workspace, RESULTS_FILE)
+
+    # Only what the saved index covers counts as done; later log lines are redone
+    checkpoint = _read_checkpoint(workspace)
+    has_index = os.path.exists(os.path.join(workspace, "manifest.json"))
+    if not has_index:
+        checkpoint = {"results_offset": 0, "files": 0}
+    done = set()
+    if os.path.exists(results_path):
+        with open(results_path, "r+b") as file:
+            file.truncate(checkpoint["results_offset"])
+            file.seek(0)
+            for line in file:
+                done.add(json.loads(line)["source"])
+
+    if has_index:
+        processor = DocumentProcessor.load(workspace, openai_api_key, **processor_kwargs)
+        progress(f"♻️ Resuming: {len(done)} files already ingested")
+    else:
+        processor = DocumentProcessor(openai_api_key, **processor_kwargs)
+
+    pending = [(path, name) for path, name in iter_pdf_files(roots) if name not in done]
+    totals = {"processed": 0, "failed": 0, "skipped": len(done), "pages": 0, "chunks": 0}
+    started = time.perf_counter()
+    since_checkpoint = 0
+    progress(f"📂 {len(pending)} PDFs to ingest ({len(done)} already done)")
+
+    # One worker pool serves every batch of the run
+    pool = processor.ingest_pool(max_workers) if parallel else contextlib.nullcontext()
+    with pool, open(results_path, "a", encoding="utf-8") as results_file:
+        def save_checkpoint():
+            processor.save(workspace)
+            results_file.flush()
+            _write_checkpoint(workspace, {"results_offset": results_file.tell(),
+                                          "files": len(done) + totals["processed"],
+                                          "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+
+        for offset in range(0, len(pending), batch_size):
+            batch = pending[offset:offset + batch_size]
+            results = processor.process_multiple_documents(
+                [path for path, _ in batch], parallel=parallel, max_workers=max_workers, file_timeout=file_timeout,
+                append=processor.vector_store is not None, source_names=[name for _, name in batch],
+                preview_pages=DEFAULT_PREVIEW_PAGES)
+            if "vector_store_error" in results:
+                raise RuntimeError(f"Indexing failed: {results['vector_store_error']}")
+
+            for result in results["successful"] + results["failed"]:
+                results_file.write(json.dumps(file_record(result)) + "\n")
+                totals["pages"] += result.get("page_count", 0)
+            totals["processed"] += len(batch)
+            totals["failed"] += len(results["failed"])
+            totals["chunks"] += results["total_chunks"]
+
+            since_checkpoint += len(batch)
+            if since_checkpoint >= checkpoint_every and processor.vector_store is not None:
+                save_checkpoint()
+                since_checkpoint = 0
+
+            elapsed = time.perf_counter() - started
+            progress(f"📄 {totals['processed']}/{len(pending)} files · "
+                     f"{totals['processed'] / elapsed:.1f} docs/s · {totals['pages'] / elapsed:.1f} pages/s · "
+                     f"{totals['failed']} failed")
+
+        if since_checkpoint and processor.vector_store is not None:
+            save_checkpoint()
+
+    totals["seconds"] = time.perf_counter() - started
+    return totals
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Ingest a directory tree of PDFs into a searchable workspace")
+    parser.add_argument("roots", nargs="+", help="Directories to scan for PDF files")
+    parser.add_argument("--workspace", default=os.path.join(".cache", "workspace"),
+                        help="Workspace folder for the index, results log and checkpoint")
+    parser.add_argument("--cache-dir", default=".cache", help="Extraction and embedding cache folder")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help="Files between index saves; a killed run redoes at most this many")
+    parser.add_argument("--workers", type=int, default=None, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--file-timeout", type=float, default=DEFAULT_FILE_TIMEOUT)
+    parser.add_argument("--index-type", default="auto", choices=("auto",) + INDEX_TYPES,
+                        help="FAISS index type; 'auto' picks one from the corpus size and re-selects it as batches are appended")
+    parser.add_argument("--embeddings", default="openai", choices=EMBEDDING_BACKENDS,
+                        help="'local' embeds on this machine without network access or an API key")
+    parser.add_argument("--openai-base-url", default=None, help="Alternative OpenAI-compatible endpoint")
+    args = parser.parse_args(argv)
+
+    openai_api_key = os.getenv("OPENAI_API_KEY", "")
+    if not openai_api_key and args.embeddings == "openai":
+        print("❌ OPENAI_API_KEY is not set (or use --embeddings local)")
+        return 1
+
+    processor_kwargs = {"cache_dir": args.cache_dir, "index_type": args.index_type,
+                        "embedding_backend": args.embeddings}
+    if args.openai_base_url and args.embeddings == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        processor_kwargs["embeddings"] = OpenAIEmbeddings(openai_api_key=openai_api_key, base_url=args.openai_base_url)
+
+    try:
+        totals = ingest_directory(args.roots, args.workspace, openai_api_key, processor_kwargs,
+                                  batch_size=args.batch_size, checkpoint_every=args.checkpoint_every,
+                                  max_workers=args.workers, file_timeout=args.file_timeout)
+    except KeyboardInterrupt:
+        print("\n⏸️ Interrupted; run the same command again to resume from the last checkpoint")
+        return 130
+
+    print(f"✅ Ingested {totals['processed']} files ({totals['failed']} failed, {totals['skipped']} skipped) "
+          f"in {totals['seconds']:.1f}s: {totals['chunks']} chunks, workspace saved to {args.workspace}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Local embedding backend.
+
+``HashingEmbeddings`` turns text into fixed-size vectors on the CPU with the
+hashing trick, so documents can be indexed and searched without network
+access or API cost. It needs no vocabulary or training. Identical text always
+gets the same vector, in any process, so saved workspaces stay searchable.
+
+Word unigrams and adjacent-word bigrams are hashed with CRC-32. The low bits
+pick a column and the top bit a sign. Counts are damped with ``log1p`` and
+rows are L2-normalised, so L2 distance ranks like cosine similarity.
+"""
+
+import os
+import string
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Output width of local embeddings
+DEFAULT_LOCAL_EMBEDDING_DIMENSIONS = 1024
+
+# Texts vectorized together in one NumPy batch
+DEFAULT_LOCAL_EMBEDDING_BATCH_SIZE = 512
+
+# Threads vectorizing batches of a large embed_documents call. Tokenizing holds the GIL;
+# only the NumPy half of each batch runs in parallel, so more threads than cores do not help.
+DEFAULT_LOCAL_EMBEDDING_WORKERS = min(4, os.cpu_count() or 1)
+
+# Distinct words whose hashes are remembered before the table is reset
+FEATURE_TABLE_MAX_SIZE = 1_000_000
+
+# Version tag in the model name; bump when the features change so old vectors are not mixed with new ones
+HASHING_EMBEDDING_VERSION = 1
+
+# Punctuation turned into word breaks before splitting on whitespace (faster than a regex tokenizer)
+_WORD_BREAKS = str.maketrans({character: " " for character in string.punctuation + "“”‘’–—…•·"})
+
+# Odd 32-bit multiplier used to combine the hashes of adjacent words
+_BIGRAM_MULTIPLIER = 0x9E3779B1
+_MASK_32 = 0xFFFFFFFF
+
+
+class _HashTable(dict):
+    """Word -> CRC-32 memo; missing words are hashed on lookup."""
+
+    def __missing__(self, word: str) -> int:
+        value = self[word] = zlib.crc32(word.encode("utf-8"))
+        return value
+
+
+class HashingEmbeddings(Embeddings):
+    """Offline embeddings from hashed word unigrams and bigrams.
+
+    ``embed_documents`` returns lists of floats, as every ``Embeddings``
+    does, and vectorizes in the calling thread. ``embed_matrix`` returns a
+    float32 NumPy array with one row per text instead, without the list
+    conversion. Texts are vectorized ``batch_size`` at a time. Calls to
+    ``embed_matrix`` that span several batches spread them over ``workers``
+    threads.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_LOCAL_EMBEDDING_DIMENSIONS,
+                 batch_size: int = DEFAULT_LOCAL_EMBEDDING_BATCH_SIZE,
+                 workers: int = DEFAULT_LOCAL_EMBEDDING_WORKERS, bigrams: bool = True):
+        if not 0 < dimensions <= 2 ** 31:
+            raise ValueError(f"dimensions must be between 1 and 2**31, not {dimensions}")
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self.workers = workers
+        self.bigrams = bigrams
+        self.model = f"hashing-v{HASHING_EMBEDDING_VERSION}{'-bigrams' if bigrams else ''}"
+        self._hashes = _HashTable()
+
+    def _vectorize(self, texts: List[str]) -> np.ndarray:
+        """Embed one batch of texts into a (len(texts), dimensions) float32 array."""
+        if len(self._hashes) > FEATURE_TABLE_MAX_SIZE:
+            self._hashes = _HashTable()
+        lookup = self._hashes.__getitem__
+
+        words = [text.lower().translate(_WORD_BREAKS).split() for text in texts]
+        counts = np.fromiter(map(len, words), dtype=np.int64, count=len(texts))
+        hashes = np.fromiter(map(lookup, chain.from_iterable(words)), dtype=np.int64, count=int(counts.sum()))
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), counts)
+        weights = np.where(hashes & 0x80000000, 1.0, -1.0)
+
+        if self.bigrams and len(hashes) > 1:
+            # int64 products wrap, but the low 32 bits kept by the mask are exact
+            pairs = (hashes[:-1] * _BIGRAM_MULTIPLIER + hashes[1:]) & _MASK_32
+            # Re-mix so the low bits (the column) depend on both words
+            pairs ^= pairs >> 16
+            pairs = (pairs * _BIGRAM_MULTIPLIER) & _MASK_32
+            # Pairs spanning two texts get zero weight rather than being copied out
+            pair_weights = np.where(pairs & 0x80000000, 1.0, -1.0) * (rows[1:] == rows[:-1])
+            hashes = np.concatenate([hashes, pairs])
+            rows = np.concatenate([rows, rows[1:]])
+            weights = np.concatenate([weights, pair_weights])
+
+        if self.dimensions & (self.dimensions - 1):
+            columns = hashes % self.dimensions
+        else:
+            columns = hashes & (self.dimensions - 1)
+        matrix = np.bincount(rows * self.dimensions + columns, weights=weights,
+                             minlength=len(texts) * self.dimensions).astype(np.float32)
+        matrix = matrix.reshape(len(texts), self.dimensions)
+
+        # Damp repeated features, keeping the sign, then scale rows to unit length
+        np.copysign(np.log1p(np.abs(matrix)), matrix, out=matrix)
+        norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))
+        norms[norms == 0] = 1.0
+        matrix /= norms[:, None]
+        return matrix
+
+    def embed_matrix(self, texts: List[str], workers: Optional[int] = None) -> np.ndarray:
+        """Embed texts into a float32 array, one row per text, over ``workers`` threads (default ``self.workers``).
+        
+        Callers already running on a thread pool pass ``workers=1``.
+        """
+        if not texts:
+            return np.zeros((0, self.dimensions), dtype=np.float32)
+        workers = self.workers if workers is None else workers
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1 or workers <= 1:
+            return np.concatenate([self._vectorize(batch) for batch in batches])
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as executor:
+            return np.concatenate(list(executor.map(self._vectorize, batches)))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed texts, one list of floats per text."""
+        return self.embed_matrix(texts, workers=1).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query."""
+        return self._vectorize([text])[0].tolist()
+
+
+def is_local_embedding_model(model_name: Optional[str]) -> bool:
+    """Whether an embedding model name (as recorded in a workspace) is a ``HashingEmbeddings`` model."""
+    return bool(model_name) and model_name.startswith("hashing-v")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI embeddings endpoint.
+
+Serves deterministic embeddings on ``POST /v1/embeddings`` and can inject
+latency and HTTP 429 rate-limit responses, so the embedding pipeline can be
+exercised without network access or API cost. Point ``OpenAIEmbeddings`` at it
+with ``base_url=server.url``.
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def stub_vector(text: str, dimensions: int) -> np.ndarray:
+    """Deterministic unit vector for a text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class StubEmbeddingServer:
+    """Threaded HTTP server mimicking the OpenAI embeddings API."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, dimensions: int = 32,
+                 latency: float = 0.0, rate_limit_probability: float = 0.0,
+                 retry_after: float = 0.05, seed: int = 0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rate_limited = 0
+        self.inputs_embedded = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL to pass to the OpenAI client."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/embeddings"):
+                    self._reply(404, {"error": {"message": "Not found"}})
+                    return
+
+                with server._lock:
+                    server.requests += 1
+                    limited = server._random.random() < server.rate_limit_probability
+                    if limited:
+                        server.rate_limited += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if limited:
+                    self._reply(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                "code": "rate_limit_exceeded"}},
+                                {"Retry-After": str(server.retry_after)})
+                    return
+
+                inputs = request.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                data = []
+                for i, item in enumerate(inputs):
+                    text = item if isinstance(item, str) else " ".join(map(str, item))
+                    vector = stub_vector(text, server.dimensions)
+                    if request.get("encoding_format") == "base64":
+                        embedding = base64.b64encode(vector.tobytes()).decode()
+                    else:
+                        embedding = vector.tolist()
+                    data.append({"object": "embedding", "index": i, "embedding": embedding})
+                with server._lock:
+                    server.inputs_embedded += len(inputs)
+                self._reply(200, {"object": "list", "data": data, "model": request.get("model", "stub"),
+                                  "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+        return Handler
+
+    def start(self) -> "StubEmbeddingServer":
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Shut the server down."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--rate-limit-probability", type=float, default=0.1,
+                        help="Fraction of requests answered with HTTP 429")
+    args = parser.parse_args()
+
+    server = StubEmbeddingServer(args.host, args.port, args.dimensions, args.latency, args.rate_limit_probability)
+    print(f"🧪 Stub embedding server listening on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped")
+
+
+if __name__ == "__main__":
+    main()
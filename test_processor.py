@@ -4,98 +4,1051 @@ Test script for the DocumentProcessor class
 """
 
 import os
+import json
 import sys
-from document_processor import DocumentProcessor
+import multiprocessing
+import threading
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from langchain_openai import OpenAIEmbeddings
+import document_processor
+from document_processor import DocumentProcessor, EmbeddingPipeline, SemanticAnswerCache, compare_index_types
+from stub_embedding_server import StubEmbeddingServer, stub_vector
+import field_extraction
+from field_extraction import FieldExtractor
+import ingest_cli
+from benchmark import write_pdf, generate_corpus, run_benchmark
 
-def test_document_processor():
-    """Test the document processor with sample PDFs from Downloads."""
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    """Deterministic fake embedder that records every text it is asked to embed."""
+    
+    embedded: list = []
+    queries: list = []
+    
+    def embed_documents(self, texts):
+        self.embedded.extend(texts)
+        return super().embed_documents(texts)
+    
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def make_processor(**kwargs):
+    """Create a processor that embeds offline with a deterministic fake embedder."""
+    kwargs.setdefault("embeddings", DeterministicFakeEmbedding(size=32))
+    return DocumentProcessor("dummy_key", **kwargs)
+
+
+def make_claim_pdfs(directory, count, pages=2):
+    """Write ``count`` small claim PDFs and return their paths."""
+    paths = []
+    for n in range(count):
+        page_texts = [f"Claim number CLM-{n:04d} page {p + 1}\nPolicy holder reported water damage to the kitchen."
+                      for p in range(pages)]
+        paths.append(write_pdf(os.path.join(directory, f"claim_{n}.pdf"), page_texts))
+    return paths
+
+def test_document_processor(tmp_path):
+    """Process a synthetic corpus end to end and search it."""
+    paths = generate_corpus(str(tmp_path), docs=2, pages=2, words_per_page=150)
+    processor = make_processor()
+    results = processor.process_multiple_documents(paths)
+    
+    assert results["total_files"] == 2 and not results["failed"]
+    assert results["total_chunks"] == processor.vector_store.index.ntotal > 0
+    for doc in results["successful"]:
+        assert doc["chunk_count"] > 0 and doc["word_count"] >= 300
+    assert len(processor.search_documents("water damage", k=2)) == 2
+
+
+def test_benchmark_reports_every_stage(tmp_path):
+    """The synthetic corpus is reproducible and the report covers each pipeline stage."""
+    first = generate_corpus(str(tmp_path / "a"), docs=2, pages=2, words_per_page=80, seed=3)
+    second = generate_corpus(str(tmp_path / "b"), docs=2, pages=2, words_per_page=80, seed=3)
+    assert [open(path, "rb").read() for path in first] == [open(path, "rb").read() for path in second]
+    
+    report = run_benchmark(docs=3, pages=2, words_per_page=120, queries=5, dimensions=16, workers=1)
+    stages = report["stages"]
+    assert set(stages) == {"extraction", "chunking", "embedding", "index_build", "ingest", "search_vector",
+                           "search_lexical", "search_hybrid", "field_extraction", "prompt_assembly", "chat"}
+    assert stages["extraction"]["items"] == 3 and stages["chunking"]["items"] == 6
+    assert stages["embedding"]["items"] == stages["chunking"]["chunks"] and stages["ingest"]["failed"] == 0
+    assert stages["index_build"]["vectors"] == stages["chunking"]["chunks"]
+    assert stages["search_hybrid"]["latency_ms"]["p50"] <= stages["search_hybrid"]["latency_ms"]["p99"]
+    assert stages["chat"]["ttft_ms"]["p50"] > 0 and report["peak_rss_mb"] > 0
+    json.dumps(report)
+
+def test_parallel_ingestion_matches_serial(tmp_path):
+    """Process-pool ingestion keeps the serial results shape and input order."""
+    paths = make_claim_pdfs(tmp_path, 4)
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(b"not a pdf")
+    paths.insert(2, str(broken))
+    
+    serial = make_processor().process_multiple_documents(paths)
+    parallel = make_processor().process_multiple_documents(paths, parallel=True, max_workers=2)
+    
+    for key in ("total_files", "total_chunks", "total_words"):
+        assert parallel[key] == serial[key]
+    assert [r["file_name"] for r in parallel["successful"]] == [r["file_name"] for r in serial["successful"]]
+    assert [r["file_name"] for r in parallel["failed"]] == ["broken.pdf"]
+    assert "vector_store_error" not in parallel
+
+
+def test_ingest_pool_serves_every_batch(tmp_path, monkeypatch):
+    """A CLI run starts one worker pool for all its batches and leaves cache eviction to the parent."""
+    archive = tmp_path / "archive"
+    os.makedirs(archive)
+    make_claim_pdfs(archive, 4, pages=2)
+    pools = []
+    class CountingPool(document_processor.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(1)
+            super().__init__(*args, **kwargs)
+    monkeypatch.setattr(document_processor, "ProcessPoolExecutor", CountingPool)
+    
+    workspace = str(tmp_path / "workspace")
+    kwargs = {"embeddings": DeterministicFakeEmbedding(size=32), "cache_dir": str(tmp_path / "cache")}
+    totals = ingest_cli.ingest_directory([str(archive)], workspace, "dummy_key", kwargs, batch_size=2,
+                                         checkpoint_every=4, max_workers=2, progress=lambda message: None)
+    assert totals["processed"] == 4 and totals["failed"] == 0
+    assert len(pools) == 1
+    
+    # Workers never scanned the cache, yet their writes are accounted for by the parent's cache
+    processor = DocumentProcessor("dummy_key", embeddings=DeterministicFakeEmbedding(size=32),
+                                  cache_dir=str(tmp_path / "fresh"))
+    assert processor.extraction_cache.stats()["size_bytes"] == 0
+    paths = sorted(str(path) for path in archive.iterdir())
+    with processor.ingest_pool(2):
+        for batch in (paths[:2], paths[2:]):
+            processor.process_multiple_documents(batch, parallel=True, append=processor.vector_store is not None,
+                                                 source_names=[f"again/{os.path.basename(path)}" for path in batch])
+    assert len(pools) == 2 and processor._pool is None
+    scanned = document_processor.ExtractionCache(str(tmp_path / "fresh" / "extraction")).stats()["size_bytes"]
+    assert processor.extraction_cache.stats()["size_bytes"] == scanned > 0
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != "fork",
+                    reason="relies on workers inheriting the patched reader")
+def test_parallel_ingestion_isolates_crash_and_timeout(tmp_path, monkeypatch):
+    """A crashing or hanging PDF only fails itself."""
+    paths = make_claim_pdfs(tmp_path, 3)
+    crash = write_pdf(tmp_path / "crash.pdf", ["crash"])
+    hang = write_pdf(tmp_path / "hang.pdf", ["hang"])
+    real_reader = document_processor.PyPDF2.PdfReader
+    
+    def pathological_reader(stream, *args, **kwargs):
+        name = os.path.basename(stream.name)
+        if name == "crash.pdf":
+            os._exit(1)
+        if name == "hang.pdf":
+            while True:
+                pass
+        return real_reader(stream, *args, **kwargs)
+    
+    monkeypatch.setattr(document_processor.PyPDF2, "PdfReader", pathological_reader)
+    results = make_processor().process_multiple_documents(
+        paths + [str(crash), str(hang)], parallel=True, max_workers=3, file_timeout=2)
+    
+    assert len(results["successful"]) == 3
+    errors = {r["file_name"]: r["error"] for r in results["failed"]}
+    assert "crashed" in errors["crash.pdf"]
+    assert "timed out" in errors["hang.pdf"]
+
+
+def test_streaming_extraction_tags_pages_and_stops_early(tmp_path):
+    """Chunks carry their page number and extraction can stop after N pages."""
+    pdf = write_pdf(tmp_path / "bundle.pdf", [f"Page {n} of the medical bundle" for n in range(1, 6)])
+    processor = make_processor()
+    
+    result = processor.process_single_document(pdf, "bundle.pdf", preview_pages=2)
+    assert result["page_count"] == 5
+    assert [chunk.metadata["page"] for chunk in result["chunks"]] == [1, 2, 3, 4, 5]
+    assert "Page 2" in result["text"] and "Page 3" not in result["text"]
+    
+    assert [n for n, _ in processor.iter_pdf_pages(pdf, max_pages=3)] == [1, 2, 3]
+    assert processor.extract_text_from_pdf(pdf, max_pages=1).strip() == "Page 1 of the medical bundle"
+    
+    # Batch ingests return only the preview pages, serially and from pool workers alike;
+    # field extraction reads those while its counts still cover the whole document
+    from field_extraction import extract_result_fields
+    for parallel in (False, True):
+        results = processor.process_multiple_documents([pdf, pdf], parallel=parallel, preview_pages=1)
+        assert all(r["text"].strip() == "Page 1 of the medical bundle" for r in results["successful"])
+        assert results["total_chunks"] == 10
+    fields = extract_result_fields(results["successful"][0])
+    assert (fields["Estimated Pages"], fields["Total Words"]) == (5, 30)
+
+
+def test_extraction_cache_hits_and_evicts(tmp_path):
+    """Identical file contents are served from the cache; old entries are evicted."""
+    paths = make_claim_pdfs(tmp_path, 3, pages=3)
+    processor = make_processor()
+    processor.extraction_cache = document_processor.ExtractionCache(str(tmp_path / "cache"))
+    
+    first = processor.process_single_document(paths[0], "claim_0.pdf")
+    second = processor.process_single_document(paths[0], "claim_0.pdf")
+    assert (first["cache_hit"], second["cache_hit"]) == (False, True)
+    assert [c.page_content for c in second["chunks"]] == [c.page_content for c in first["chunks"]]
+    assert [c.metadata for c in second["chunks"]] == [c.metadata for c in first["chunks"]]
+    assert processor.extraction_cache.stats()["hits"] == 1
+    
+    # Changing the chunking parameters must not reuse the entry
+    processor.chunk_size = 500
+    assert processor.process_single_document(paths[0], "claim_0.pdf")["cache_hit"] is False
+    
+    entry_size = processor.extraction_cache.stats()["size_bytes"] // 2
+    processor.extraction_cache.max_bytes = entry_size * 2
+    for path in paths[1:]:
+        processor.process_single_document(path, os.path.basename(path))
+    assert processor.extraction_cache.stats()["size_bytes"] <= entry_size * 2
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+
+def test_embedding_cache_only_embeds_misses(tmp_path):
+    """Unchanged chunks are served from the persistent cache on later runs."""
+    paths = make_claim_pdfs(tmp_path, 3)
+    embedder = CountingEmbedding(size=32, embedded=[])
+    cache_dir = str(tmp_path / "cache")
+    
+    first = make_processor(embeddings=embedder, cache_dir=cache_dir).process_multiple_documents(paths[:2])
+    assert first["embedding_cache"]["hits"] == 0
+    embedded_first = len(embedder.embedded)
+    
+    # A fresh processor (e.g. after a restart) reuses the vectors stored on disk
+    processor = make_processor(embeddings=embedder, cache_dir=cache_dir)
+    second = processor.process_multiple_documents(paths)
+    assert second["embedding_cache"]["hits"] == first["total_chunks"]
+    assert len(embedder.embedded) - embedded_first == second["total_chunks"] - first["total_chunks"]
+    assert 0 < second["embedding_cache"]["hit_ratio"] < 1
+    
+    text = processor.documents[0].page_content
+    assert np.allclose(processor.embeddings.embed_documents([text]), embedder.embed_documents([text]), atol=1e-6)
+
+
+def test_incremental_append_replace_and_compact(tmp_path):
+    """Appending only embeds the delta; replaced documents disappear from search."""
+    paths = make_claim_pdfs(tmp_path, 4, pages=1)
+    embedder = CountingEmbedding(size=32, embedded=[])
+    processor = make_processor(embeddings=embedder)
+    
+    processor.process_multiple_documents(paths[:3])
+    embedded_initially = len(embedder.embedded)
+    processor.process_multiple_documents(paths[3:], append=True)
+    assert len(embedder.embedded) - embedded_initially == 1
+    assert processor.get_document_summary()["total_documents"] == 4
+    
+    # Re-ingest claim_0 with new contents under the same source name
+    old_text = processor.search_documents(processor.documents[0].page_content, k=1)[0].page_content
+    write_pdf(paths[0], ["Claim number CLM-0000 supplemental estimate for roof repairs"])
+    processor.process_multiple_documents(paths[:1], append=True)
     
-    # Check if Downloads folder exists and has PDFs
-    downloads_path = "/Users/macbook/Downloads"
-    if not os.path.exists(downloads_path):
-        print("❌ Downloads folder not found")
-        return False
+    hits = processor.search_documents(old_text, k=4)
+    assert old_text not in [doc.page_content for doc in hits]
+    assert sum(doc.metadata["source"] == "claim_0.pdf" for doc in hits) == 1
+    assert len(processor.documents) == processor.vector_store.index.ntotal - 1
     
-    # Find PDF files
-    pdf_files = [f for f in os.listdir(downloads_path) if f.lower().endswith('.pdf')]
-    if not pdf_files:
-        print("❌ No PDF files found in Downloads folder")
-        return False
+    assert processor.remove_document("claim_1.pdf")
+    assert not processor.remove_document("claim_1.pdf")
+    # Two of five vectors are dead, which is past the compaction threshold
+    assert processor.vector_store.index.ntotal == 3 == len(processor.documents)
+    assert {doc.metadata["source"] for doc in processor.search_documents("claim", k=10)} == \
+        {"claim_0.pdf", "claim_2.pdf", "claim_3.pdf"}
     
-    print(f"✅ Found {len(pdf_files)} PDF files in Downloads")
+    # Different files sharing a name in one batch are indexed as separate documents
+    (tmp_path / "other").mkdir()
+    twin = make_claim_pdfs(tmp_path / "other", 3, pages=2)[2]
+    results = processor.process_multiple_documents([paths[2], twin], append=True)
+    assert [result["file_name"] for result in results["successful"]] == ["claim_2.pdf", "claim_2 (2).pdf"]
+    summary = processor.get_document_summary()
+    assert summary["total_documents"] == 4 and summary["total_chunks"] == len(processor.documents) == 5
+
+
+def test_workspace_save_and_load_roundtrip(tmp_path):
+    """A saved workspace reopens memory-mapped with identical search results."""
+    paths = make_claim_pdfs(tmp_path, 3)
+    processor = make_processor(cache_dir=str(tmp_path / "cache"))
+    processor.process_multiple_documents(paths)
+    processor.remove_document("claim_2.pdf")
+    query = processor.documents[1].page_content
+    workspace = str(tmp_path / "workspace")
+    processor.save(workspace)
     
-    # Test with first 2 PDF files
-    test_files = pdf_files[:2]
-    test_paths = [os.path.join(downloads_path, f) for f in test_files]
+    # Processors opened from one set of chunk records stay independent
+    records = DocumentProcessor.read_chunk_records(workspace)
+    loaded = DocumentProcessor.load(workspace, "dummy_key", chunk_records=records,
+                                    embeddings=DeterministicFakeEmbedding(size=32))
+    other = DocumentProcessor.load(workspace, "dummy_key", chunk_records=records,
+                                   embeddings=DeterministicFakeEmbedding(size=32))
+    assert loaded.get_document_summary()["total_chunks"] == processor.get_document_summary()["total_chunks"]
+    assert [(d.page_content, d.metadata) for d in loaded.search_documents(query, k=3)] == \
+        [(d.page_content, d.metadata) for d in processor.search_documents(query, k=3)]
+    assert [d.page_content for d in loaded.documents] == [d.page_content for d in processor.documents]
     
-    print(f"🧪 Testing with: {', '.join(test_files)}")
+    # The mapped workspace still accepts incremental updates
+    loaded.process_multiple_documents(paths[2:], append=True)
+    loaded.remove_document("claim_0.pdf")
+    loaded.compact()
+    assert sorted(loaded.get_document_summary()["document_sources"]) == ["claim_1.pdf", "claim_2.pdf"]
+    assert sorted(other.get_document_summary()["document_sources"]) == ["claim_0.pdf", "claim_1.pdf"]
+    assert [d.page_content for d in other.documents] == [d.page_content for d in processor.documents]
     
-    # Check if OpenAI API key is available
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key:
-        print("⚠️  No OpenAI API key found. Set OPENAI_API_KEY environment variable.")
-        print("   Testing without AI features...")
+    with pytest.raises(ValueError):
+        DocumentProcessor.load(workspace, "dummy_key", embeddings=DeterministicFakeEmbedding(size=64))
+
+
+def stub_openai_embeddings(server):
+    """OpenAIEmbeddings client pointed at a stub server, with client-side retries disabled."""
+    return OpenAIEmbeddings(openai_api_key="dummy_key", base_url=server.url, model="text-embedding-3-small",
+                            max_retries=0, check_embedding_ctx_length=False)
+
+
+def test_embedding_pipeline_backs_off_on_rate_limits(tmp_path):
+    """Injected 429s are retried with backoff and every chunk still gets its vector."""
+    paths = make_claim_pdfs(tmp_path, 6, pages=3)
+    with StubEmbeddingServer(latency=0.01, rate_limit_probability=0.3, retry_after=0.01, seed=1) as server:
+        processor = make_processor(embeddings=stub_openai_embeddings(server), embedding_concurrency=4,
+                                   embedding_batch_tokens=40)
+        processor.embedding_pipeline.initial_backoff = 0.01
+        results = processor.process_multiple_documents(paths)
+    
+    assert "vector_store_error" not in results
+    assert results["embedding"]["batches"] > 4
+    assert results["embedding"]["rate_limited"] == server.rate_limited > 0
+    doc = processor.documents[5]
+    stored = processor.vector_store.index.reconstruct(5)
+    assert np.allclose(stored, stub_vector(doc.page_content, 32), atol=1e-6)
+
+
+def test_embedding_pipeline_resumes_partial_runs():
+    """Batches finished before a failure are not embedded again on retry."""
+    texts = [f"chunk {n} of the claim archive" for n in range(40)]
+    with StubEmbeddingServer(rate_limit_probability=0.5, seed=3) as server:
+        pipeline = EmbeddingPipeline(stub_openai_embeddings(server), batch_tokens=20, max_retries=0)
+        with pytest.raises(Exception):
+            pipeline.embed(texts)
+        assert 0 < pipeline.stats()["pending_resume"] < len(texts)
         
-        # Test basic PDF processing without AI
-        try:
-            processor = DocumentProcessor("dummy_key")
-            for file_path in test_paths:
-                result = processor.process_single_document(file_path, os.path.basename(file_path))
-                if result["status"] == "success":
-                    print(f"✅ Successfully processed: {result['file_name']}")
-                    print(f"   - Chunks: {result['chunk_count']}")
-                    print(f"   - Words: {result['word_count']}")
-                else:
-                    print(f"❌ Failed to process: {result['file_name']}")
-                    print(f"   - Error: {result['error']}")
-        except Exception as e:
-            print(f"❌ Error during testing: {str(e)}")
-            return False
-    else:
-        print("✅ OpenAI API key found. Testing with full AI features...")
+        server.rate_limit_probability = 0.0
+        vectors = pipeline.embed(texts)
+    
+    assert server.inputs_embedded == len(texts)
+    assert np.allclose(vectors, [stub_vector(text, 32) for text in texts], atol=1e-6)
+
+
+def test_retrieve_embeds_query_once_and_scores_results(tmp_path):
+    """One retrieval pass yields both the prompt context and the displayed sources."""
+    embedder = CountingEmbedding(size=32, embedded=[], queries=[])
+    processor = make_processor(embeddings=embedder)
+    paths = [write_pdf(tmp_path / f"note_{n}.pdf", [f"Adjuster note {n} for claim CLM-{n:04d}"]) for n in range(3)]
+    processor.process_multiple_documents(paths)
+    query = processor.documents[2].page_content
+    
+    retrieved = processor.retrieve(query, k=3)
+    assert embedder.queries == [query]
+    assert retrieved[0][0].page_content == query and retrieved[0][1] == pytest.approx(0.0, abs=1e-5)
+    assert [score for _, score in retrieved] == sorted(score for _, score in retrieved)
+    assert processor.format_context([doc for doc, _ in retrieved]) == processor.get_context_for_query(query, k=3)
+
+
+def test_query_embedding_cache_lru_and_ttl(tmp_path, monkeypatch):
+    """Repeat queries skip the embedder; the cache is bounded and entries expire."""
+    embedder = CountingEmbedding(size=32, embedded=[], queries=[])
+    processor = make_processor(embeddings=embedder, query_cache_size=2, query_cache_ttl=60)
+    processor.process_multiple_documents(make_claim_pdfs(tmp_path, 2))
+    
+    processor.search_documents("water damage", k=2)
+    processor.get_context_for_query("  water   damage ", k=2)
+    assert embedder.queries == ["water damage"]
+    
+    processor.search_documents("roof", k=2)
+    processor.search_documents("kitchen", k=2)
+    processor.search_documents("water damage", k=2)
+    assert embedder.queries == ["water damage", "roof", "kitchen", "water damage"]
+    assert processor.query_cache.stats()["size"] == 2
+    
+    clock = [document_processor.time.monotonic()]
+    monkeypatch.setattr(document_processor.time, "monotonic", lambda: clock[0])
+    processor.query_cache.put(processor.embedding_model, "kitchen", [0.0] * 32)
+    clock[0] += 61
+    processor.search_documents("kitchen", k=2)
+    assert embedder.queries[-1] == "kitchen"
+    assert processor.query_cache.stats()["hits"] == 1
+
+
+def test_lexical_and_hybrid_retrieval(tmp_path):
+    """Exact identifiers are found by BM25 without embedding the query."""
+    embedder = CountingEmbedding(size=32, embedded=[], queries=[])
+    processor = make_processor(embeddings=embedder)
+    paths = make_claim_pdfs(tmp_path, 5, pages=1)
+    processor.process_multiple_documents(paths)
+    
+    lexical = processor.retrieve("status of CLM-0003?", k=3, mode="lexical")
+    assert embedder.queries == []
+    assert lexical[0][0].metadata["source"] == "claim_3.pdf"
+    assert [score for _, score in lexical] == sorted((score for _, score in lexical), reverse=True)
+    
+    hybrid = processor.retrieve("CLM-0003", k=3, mode="hybrid")
+    assert embedder.queries == ["CLM-0003"]
+    assert hybrid[0][0].metadata["source"] == "claim_3.pdf"
+    
+    # Replacing a document updates the lexical index too
+    write_pdf(paths[3], ["Claim number CLM-9999 reassigned"])
+    processor.process_multiple_documents(paths[3:4], append=True)
+    assert processor.retrieve("CLM-0003", k=3, mode="lexical") == []
+    assert processor.search_documents("CLM-9999", k=1, mode="lexical")[0].metadata["source"] == "claim_3.pdf"
+    
+    # Document-level filters score only that document's rows; no other chunk is built
+    looked_up = []
+    lookup = processor.lexical_index._lookup
+    processor.lexical_index._lookup = lambda doc_id: looked_up.append(doc_id) or lookup(doc_id)
+    filtered = processor.retrieve("water damage claim", k=3, mode="lexical", filter={"source": "claim_1.pdf"})
+    assert [doc.metadata["source"] for doc, _ in filtered] == ["claim_1.pdf"] and len(looked_up) == 1
+    assert processor.retrieve("water", mode="lexical", filter={"source": "claim_1.pdf", "page": 2}) == []
+    assert processor.retrieve("water", mode="lexical", filter={"source": "missing.pdf"}) == []
+    
+    with pytest.raises(ValueError):
+        processor.retrieve("CLM-0003", mode="fuzzy")
+
+
+def test_document_set_fingerprint_and_chat_model_reuse(tmp_path):
+    """The fingerprint used to key cached views follows the document set; the chat model is built once."""
+    processor = make_processor()
+    paths = make_claim_pdfs(tmp_path, 2)
+    processor.process_multiple_documents(paths)
+    fingerprint = processor.document_set_fingerprint()
+    assert processor.document_set_fingerprint() == fingerprint
+    
+    processor.process_multiple_documents(paths[:1], append=True)
+    replaced = processor.document_set_fingerprint()
+    assert replaced != fingerprint
+    processor.remove_document("claim_1.pdf")
+    assert processor.document_set_fingerprint() not in (fingerprint, replaced)
+    
+    assert processor.get_chat_model() is processor.get_chat_model()
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat"])
+def test_filtered_retrieval_by_source_category_date_and_page(tmp_path, index_type):
+    """Filters restrict every retrieval mode, also on a loaded (memory-mapped) workspace."""
+    processor = make_processor(index_type=index_type)
+    paths = make_claim_pdfs(tmp_path, 3)
+    write_pdf(paths[1], ["Invoice for claim CLM-0001 dated 03/15/2024", "Receipt for water damage repairs"])
+    write_pdf(paths[2], ["Contract terms for claim CLM-0002, signed 2023-11-02", "Water damage clause"])
+    processor.process_multiple_documents(paths)
+    assert processor.get_document_summary()["document_categories"] == [
+        "Financial Document", "Legal Document", "Report Document"]
+    
+    def check(processor):
+        by_source = processor.retrieve("water damage", k=10, filter={"source": "claim_1.pdf"})
+        assert {doc.metadata["source"] for doc, _ in by_source} == {"claim_1.pdf"} and len(by_source) == 2
+        assert [score for _, score in by_source] == sorted(score for _, score in by_source)
+        
+        query = processor.retrieve("anything", k=10, filter={"source": "claim_2.pdf", "page": 2})[0][0].page_content
+        nearest = processor.retrieve(query, k=1, filter={"category": ["Legal Document", "Financial Document"]})
+        assert nearest[0][0].page_content == query and nearest[0][1] == pytest.approx(0.0, abs=1e-3)
         
-        try:
-            processor = DocumentProcessor(openai_key)
-            results = processor.process_multiple_documents(test_paths)
+        recent = processor.retrieve("claim", k=10, filter={"date": lambda d: d is not None and d >= "2024-01-01"})
+        assert {doc.metadata["date"] for doc, _ in recent} == {"2024-03-15"}
+        
+        pages = processor.search_documents("water damage", k=10, filter={"page": 1})
+        assert len(pages) == 3 and all(doc.metadata["page"] == 1 for doc in pages)
+        
+        for mode in ("lexical", "hybrid"):
+            results = processor.retrieve("CLM-0001 water", k=10, mode=mode, filter={"category": "Legal Document"})
+            assert results and {doc.metadata["source"] for doc, _ in results} == {"claim_2.pdf"}
+        assert processor.retrieve("water", filter={"source": "missing.pdf"}) == []
+    
+    check(processor)
+    processor.save(str(tmp_path / "workspace"))
+    loaded = DocumentProcessor.load(str(tmp_path / "workspace"), "dummy_key", embeddings=DeterministicFakeEmbedding(size=32),
+                                    index_type=index_type)
+    if index_type == "ivf_flat":
+        # The direct map filtered searches read vectors through is saved, so searches never modify the index
+        assert document_processor.faiss.extract_index_ivf(loaded.vector_store.index).direct_map.type != 0
+    check(loaded)
+    assert loaded._mapped_index_path is not None
+
+
+@pytest.mark.parametrize("index_type, index_class", [("hnsw", "IndexHNSWFlat"), ("sq8", "IndexScalarQuantizer")])
+def test_ann_index_types_support_search_and_compaction(tmp_path, index_type, index_class):
+    """Non-flat indexes serve searches and still compact (HNSW by rebuilding)."""
+    processor = make_processor(index_type=index_type, ef_search=128)
+    processor.process_multiple_documents(make_claim_pdfs(tmp_path, 4))
+    assert type(processor.vector_store.index).__name__ == index_class
+    
+    processor.remove_document("claim_0.pdf")
+    processor.remove_document("claim_1.pdf")
+    assert processor.vector_store.index.ntotal == len(processor.documents) == 4
+    query = processor.documents[1].page_content
+    assert processor.search_documents(query, k=1)[0].page_content == query
+
+
+def test_auto_index_upgrades_as_appends_grow_the_corpus(tmp_path, monkeypatch):
+    """An "auto" index is rebuilt as HNSW once appends pass the Flat limit; ivf_pq falls back on tiny corpora."""
+    monkeypatch.setattr(document_processor, "FLAT_INDEX_MAX_VECTORS", 4)
+    paths = make_claim_pdfs(tmp_path, 4)
+    processor = make_processor()
+    processor.process_multiple_documents(paths[:2])
+    assert document_processor.index_type_of(processor.vector_store.index) == "flat"
+    query = processor.documents[0].page_content
+    
+    processor.process_multiple_documents(paths[2:], append=True)
+    assert document_processor.index_type_of(processor.vector_store.index) == "hnsw"
+    assert processor.vector_store.index.ntotal == 8
+    assert processor.search_documents(query, k=1)[0].page_content == query
+    # Dropping back under the limit keeps the upgraded index
+    processor.remove_document("claim_3.pdf")
+    processor.process_multiple_documents(paths[:1], append=True)
+    assert document_processor.index_type_of(processor.vector_store.index) == "hnsw"
+    
+    small = make_processor(index_type="ivf_pq")
+    small.process_multiple_documents(paths[:3])
+    assert document_processor.index_type_of(small.vector_store.index) == "sq8"
+    assert small.search_documents(query, k=1)[0].page_content == query
+
+
+def test_compare_index_types_reports_recall_latency_and_memory():
+    """The report measures each index type against exact search."""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+    queries = vectors[:50] + 0.01 * rng.standard_normal((50, 64)).astype(np.float32)
+    
+    report = {row["index_type"]: row for row in
+              compare_index_types(vectors, queries, k=5, index_types=("flat", "hnsw", "sq8", "ivf_pq"))}
+    assert report["flat"]["recall_at_k"] == 1.0
+    assert report["hnsw"]["recall_at_k"] > 0.9
+    assert report["sq8"]["memory_reduction"] > 3.5
+    assert report["ivf_pq"]["memory_reduction"] > 4
+    assert all(row["p99_ms"] >= row["p50_ms"] > 0 for row in report.values())
+
+
+def test_stream_answer_yields_tokens_with_timing_and_cancels(tmp_path):
+    """Answers stream token by token from a fake model; a cancelled answer keeps its partial text."""
+    processor = make_processor()
+    processor.process_multiple_documents(make_claim_pdfs(tmp_path, 2))
+    answer_text = "The claim covers water damage to the kitchen."
+    
+    answer = processor.stream_answer("What happened?", GenericFakeChatModel(messages=iter([AIMessage(answer_text)])),
+                                     use_cache=False)
+    tokens = list(answer)
+    assert len(tokens) > 1 and "".join(tokens) == answer.text == answer_text
+    assert 0 < answer.ttft <= answer.latency and not answer.cancelled
+    assert set(answer.sources) <= {"claim_0.pdf", "claim_1.pdf"} and answer.sources
+    
+    answer = processor.stream_answer("What happened?", GenericFakeChatModel(messages=iter([AIMessage(answer_text)])),
+                                     use_cache=False)
+    received = []
+    for token in answer:
+        received.append(token)
+        if len(received) == 2:
+            answer.cancel()
+    assert answer.cancelled and answer.text == "".join(received) and len(answer.text) < len(answer_text)
+    
+    # Abandoning the iterator (e.g. an interrupted UI rerun) also ends the turn as cancelled
+    answer = processor.stream_answer("What happened?", GenericFakeChatModel(messages=iter([AIMessage(answer_text)])),
+                                     use_cache=False)
+    next(iter(answer))
+    answer.close()
+    assert answer.cancelled and answer.latency is not None
+    assert "What happened?" in processor.build_chat_prompt("What happened?", "context")
+
+
+def test_semantic_answer_cache_reuses_answers_until_documents_change(tmp_path, monkeypatch):
+    """Repeat questions skip retrieval and the model; similar vectors hit, stale or changed documents miss."""
+    processor = make_processor()
+    paths = make_claim_pdfs(tmp_path, 2)
+    processor.process_multiple_documents(paths)
+    model = GenericFakeChatModel(messages=iter([AIMessage("The date of loss is 2024-03-15."),
+                                                AIMessage("Still 2024-03-15.")]))
+    
+    first = processor.stream_answer("What is the date of loss?", model)
+    assert first.consume() == "The date of loss is 2024-03-15." and not first.cached
+    repeat = processor.stream_answer("What is the  date of loss?", model)
+    assert repeat.consume() == first.text and repeat.cached and repeat.sources == first.sources
+    assert repeat.latency < 0.05
+    assert processor.answer_cache.stats()["hits"] == 1
+    
+    # Other retrieval settings build a different context, so they do not reuse the answer
+    model = GenericFakeChatModel(messages=iter([AIMessage(f"Answer {n}") for n in range(4)]))
+    for settings in ({"k": 2}, {"mode": "vector"}, {"max_tokens": 500}):
+        answer = processor.stream_answer("What is the date of loss?", model, **settings)
+        assert answer.consume().startswith("Answer") and not answer.cached
+    
+    # Changing the documents invalidates stored answers
+    processor.process_multiple_documents(paths[:1], append=True)
+    assert processor.stream_answer("What is the date of loss?", model).consume() == "Answer 3"
+    
+    cache = SemanticAnswerCache(capacity=2, ttl=60, threshold=0.9)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((3, 32))
+    cache.put("docs", vectors[0], {"text": "a"})
+    assert cache.get("docs", vectors[0] + 0.01 * rng.standard_normal(32))["text"] == "a"
+    assert cache.get("docs", vectors[1]) is None and cache.get("other", vectors[0]) is None
+    cache.put("docs", vectors[1], {"text": "b"})
+    cache.put("docs", vectors[2], {"text": "c"})
+    assert cache.get("docs", vectors[0]) is None and cache.stats()["size"] == 2
+    
+    clock = [document_processor.time.monotonic()]
+    monkeypatch.setattr(document_processor.time, "monotonic", lambda: clock[0])
+    cache.put("docs", vectors[0], {"text": "a"})
+    clock[0] += 61
+    assert cache.get("docs", vectors[0]) is None and cache.stats()["size"] == 0
+
+
+def test_build_context_merges_overlapping_chunks_within_budget(tmp_path):
+    """Overlapping chunks of a page are sent once, and the context respects the token budget."""
+    processor = make_processor()
+    lines = [f"Line {n}: the adjuster inspected room {n} and noted water staining on the ceiling." for n in range(40)]
+    long_pdf = write_pdf(tmp_path / "long.pdf", ["\n".join(lines)])
+    processor.process_multiple_documents([long_pdf] + make_claim_pdfs(tmp_path, 1))
+    page_chunks = [doc for doc in processor.documents if doc.metadata["source"] == "long.pdf"]
+    assert len(page_chunks) > 2
+    
+    ranked = page_chunks[::-1] + [doc for doc in processor.documents if doc.metadata["source"] != "long.pdf"]
+    built = processor.build_context(ranked, max_tokens=100000)
+    first, last = page_chunks[0].metadata, page_chunks[-1].metadata
+    assert built["passages"] == 3 and built["chunks"] == len(ranked)
+    assert built["context"].startswith(page_chunks[0].page_content)
+    assert len(built["context"].split("\n\n")[0]) == last["end_index"] - first["start_index"]
+    assert built["tokens_saved"] > 0 and built["context_tokens"] < built["naive_tokens"]
+    
+    small = processor.build_context(ranked, max_tokens=50)
+    assert small["passages"] == 1 and 0 < small["context_tokens"] <= 50
+    assert processor.build_context([], max_tokens=50)["context"] == ""
+
+
+def test_ingest_cli_resumes_after_interruption(tmp_path, monkeypatch):
+    """A killed run resumes from its last checkpoint; every file is logged and indexed exactly once."""
+    archive = tmp_path / "archive"
+    for folder in ("a", "b"):
+        os.makedirs(archive / folder / "nested")
+        make_claim_pdfs(archive / folder, 2, pages=1)
+        make_claim_pdfs(archive / folder / "nested", 1, pages=1)
+    (archive / "b" / "broken.pdf").write_bytes(b"not a pdf")
+    workspace = str(tmp_path / "workspace")
+    kwargs = {"embeddings": DeterministicFakeEmbedding(size=32)}
+    
+    calls = []
+    original = DocumentProcessor.process_multiple_documents
+    def interrupt_fourth_batch(self, *args, **kw):
+        calls.append(1)
+        if len(calls) == 4:
+            raise KeyboardInterrupt
+        return original(self, *args, **kw)
+    monkeypatch.setattr(DocumentProcessor, "process_multiple_documents", interrupt_fourth_batch)
+    with pytest.raises(KeyboardInterrupt):
+        ingest_cli.ingest_directory([str(archive)], workspace, "dummy_key", kwargs, batch_size=2,
+                                    checkpoint_every=4, parallel=False, progress=lambda message: None)
+    monkeypatch.setattr(DocumentProcessor, "process_multiple_documents", original)
+    
+    messages = []
+    totals = ingest_cli.ingest_directory([str(archive)], workspace, "dummy_key", kwargs, batch_size=2,
+                                         checkpoint_every=4, parallel=False, progress=messages.append)
+    assert totals["skipped"] == 4 and totals["processed"] == 3 and totals["failed"] == 0
+    assert any("docs/s" in message and "pages/s" in message for message in messages)
+    
+    with open(os.path.join(workspace, ingest_cli.RESULTS_FILE)) as file:
+        records = [json.loads(line) for line in file]
+    assert sorted(record["source"] for record in records) == sorted(name for _, name in ingest_cli.iter_pdf_files([str(archive)]))
+    assert {record["source"] for record in records if record["status"] != "success"} == {"b/broken.pdf"}
+    assert "a/claim_0.pdf" in {record["source"] for record in records} and "b/claim_0.pdf" in {record["source"] for record in records}
+    assert all(record["fields"]["Claim Number"].startswith("CLM-") for record in records if record["status"] == "success")
+    
+    loaded = DocumentProcessor.load(workspace, "dummy_key", **kwargs)
+    summary = loaded.get_document_summary()
+    assert summary["total_documents"] == 6 and summary["total_chunks"] == 6 == len(loaded.documents)
+    
+    # Nothing left to do on a further run
+    assert ingest_cli.ingest_directory([str(archive)], workspace, "dummy_key", kwargs, parallel=False,
+                                       progress=lambda message: None)["processed"] == 0
+
+
+def test_field_extraction_fields_extractors_and_cache(monkeypatch):
+    """Fields are extracted in one pass, claim fields are pluggable and results are cached by text."""
+    extractor = FieldExtractor()
+    text = ("Invoice for Claim number CLM-0042 dated 03/15/2024. Water damage repairs: $1,250.00 "
+            "plus $300 inspection. Water damage to kitchen, water heater replaced on 2024-03-20.")
+    fields = extractor.extract(text, "claim_42.pdf")
+    assert fields["Document Name"] == "claim_42.pdf"
+    assert fields["Total Words"] == len(text.split())
+    assert fields["Document Category"] == "Financial Document"
+    assert fields["Key Topics"].split(", ")[:2] == ["water", "damage"]
+    assert fields["Claim Number"] == "CLM-0042"
+    assert fields["Dates"] == "2024-03-15, 2024-03-20"
+    assert fields["Amounts"] == "$1,250.00, $300.00"
+    assert "Claim Number" not in extractor.extract("Quarterly summary of operations", "report.pdf")
+    
+    # Same text under another name is served from the cache, stamped with the current processing time
+    monkeypatch.setattr(field_extraction.time, "strftime", lambda fmt: "2030-01-01 00:00:00")
+    copy = extractor.extract(text, "copy.pdf")
+    assert copy["Document Name"] == "copy.pdf" and copy["Processing Date"] == "2030-01-01 00:00:00"
+    assert list(copy).index("Processing Date") == list(fields).index("Document Type") + 1
+    assert extractor.stats()["hits"] == 1 and extractor.stats()["misses"] == 2
+    
+    extractor.register("Adjuster", lambda text: "J. Smith" if "adjuster" in text.lower() else None)
+    assert extractor.extract("Adjuster visit notes", "notes.pdf")["Adjuster"] == "J. Smith"
+    batch = extractor.extract_many([(f"Claim no. 77-{n} closed", f"{n}.pdf") for n in range(3)])
+    assert [fields["Claim Number"] for fields in batch] == ["77-0", "77-1", "77-2"]
+
+
+def test_api_server_serves_concurrent_searches_chat_and_ingest(tmp_path):
+    """One shared index answers concurrent searches, also during an ingest; ingest appends and bad requests get a 400."""
+    import asyncio
+    import aiohttp
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+    
+    paths = make_claim_pdfs(tmp_path, 3)
+    processor = make_processor()
+    processor.process_multiple_documents(paths[:2])
+    chat_model = GenericFakeChatModel(messages=iter([AIMessage("Water damage to the kitchen."),
+                                                     AIMessage("Streamed answer.")]))
+    app = create_app(processor, workspace=str(tmp_path / "workspace"), chat_model=chat_model, threads=4,
+                     ingest_root=str(tmp_path))
+    preparing, release = threading.Event(), threading.Event()
+    prepare_documents = processor.prepare_documents
+    def held_prepare(*args, **kwargs):
+        preparing.set()
+        release.wait(10)
+        return prepare_documents(*args, **kwargs)
+    
+    async def scenario():
+        async with TestClient(TestServer(app)) as client:
+            responses = await asyncio.gather(*[
+                client.post("/search", json={"query": f"claim CLM-000{n % 2} water damage", "k": 3})
+                for n in range(8)])
+            for response in responses:
+                assert response.status == 200
+                results = (await response.json())["results"]
+                assert len(results) == 3 and all("score" in result for result in results)
             
-            print(f"\n📊 Processing Results:")
-            print(f"   - Total files: {results['total_files']}")
-            print(f"   - Successful: {len(results['successful'])}")
-            print(f"   - Failed: {len(results['failed'])}")
-            print(f"   - Total chunks: {results['total_chunks']}")
-            print(f"   - Total words: {results['total_words']}")
+            response = await client.post("/search", json={"query": "water", "filter": {"source": "claim_1.pdf"}})
+            assert {r["metadata"]["source"] for r in (await response.json())["results"]} == {"claim_1.pdf"}
+            assert (await client.post("/search", json={"query": ""})).status == 400
+            assert (await client.post("/search", data=b"not json")).status == 400
             
-            if results['successful']:
-                print(f"\n✅ Successfully processed files:")
-                for doc in results['successful']:
-                    print(f"   - {doc['file_name']}: {doc['chunk_count']} chunks, {doc['word_count']} words")
+            response = await client.post("/chat", json={"question": "What happened?"})
+            answer = await response.json()
+            assert answer["answer"] == "Water damage to the kitchen." and answer["sources"]
+            response = await client.post("/chat", json={"question": "Summarise claim 1", "stream": True})
+            assert await response.text() == "Streamed answer."
+            for bad in ({"mode": "semantic"}, {"k": 0}, {"max_tokens": "lots"}):
+                assert (await client.post("/chat", json={"question": "What happened?", **bad})).status == 400
             
-            if results['failed']:
-                print(f"\n❌ Failed files:")
-                for doc in results['failed']:
-                    print(f"   - {doc['file_name']}: {doc['error']}")
+            # Searches are answered while an ingest is still extracting and embedding
+            processor.prepare_documents = held_prepare
+            ingest = asyncio.ensure_future(client.post("/ingest", json={"paths": [os.path.basename(paths[2])]}))
+            await asyncio.get_running_loop().run_in_executor(None, preparing.wait, 10)
+            assert (await client.post("/search", json={"query": "water", "k": 1})).status == 200
+            assert not ingest.done()
+            release.set()
+            response = await ingest
+            ingested = await response.json()
+            assert response.status == 200 and len(ingested["successful"]) == 1
+            assert "text" not in ingested["successful"][0]
+            assert (await client.post("/ingest", json={"paths": [str(tmp_path / "missing.pdf")]})).status == 400
+            assert (await client.post("/ingest", json={"paths": ["../outside.pdf"]})).status == 403
+            form = aiohttp.FormData()
+            form.add_field("file", open(paths[0], "rb").read(), filename="upload.pdf",
+                           content_type="application/pdf")
+            response = await client.post("/ingest", data=form)
+            assert response.status == 200 and (await response.json())["successful"][0]["file_name"] == "upload.pdf"
             
-            # Test search functionality
-            if processor.vector_store:
-                print(f"\n🔍 Testing search functionality...")
-                search_results = processor.search_documents("test query", k=2)
-                print(f"   - Search returned {len(search_results)} results")
-                
-                # Test conversation chain
-                print(f"\n💬 Testing conversation chain...")
-                conversation_chain = processor.get_conversation_chain()
-                if conversation_chain:
-                    print("   - Conversation chain created successfully")
-                else:
-                    print("   - Failed to create conversation chain")
+            summary = await (await client.get("/summary")).json()
+            assert summary["total_documents"] == 4 and "answer_cache" in summary
+            assert (await (await client.get("/health")).json())["chunks"] == processor.vector_store.index.ntotal
+            metrics = await (await client.get("/metrics")).text()
+            assert 'claims_stage_seconds_count{stage="search_hybrid"}' in metrics
             
-        except Exception as e:
-            print(f"❌ Error during AI testing: {str(e)}")
-            return False
+            app["service"].chat_model = None
+            processor.get_chat_model = lambda: None
+            assert (await client.post("/chat", json={"question": "Anything new?", "k": 2})).status == 503
     
-    print("\n🎉 Test completed successfully!")
-    return True
+    asyncio.run(scenario())
+    assert os.path.exists(tmp_path / "workspace" / "manifest.json")
+
+
+def test_api_server_compacts_replaced_documents_under_the_write_lock(tmp_path):
+    """Searches running alongside an ingest that replaces a document never see the index compacted under them."""
+    import asyncio
+    import aiohttp
+    from aiohttp.test_utils import TestClient, TestServer
+    from api_server import create_app
+    
+    paths = make_claim_pdfs(tmp_path, 6)
+    processor = make_processor()
+    processor.process_multiple_documents(paths)
+    app = create_app(processor, workspace=str(tmp_path / "workspace"), threads=4)
+    service = app["service"]
+    compactions = []
+    compact = processor.compact
+    def checked_compact():
+        if processor._tombstones:
+            compactions.append(service.lock._writer)
+        compact()
+    processor.compact = checked_compact
+    
+    async def scenario():
+        async with TestClient(TestServer(app)) as client:
+            form = aiohttp.FormData()
+            form.add_field("file", open(paths[1], "rb").read(), filename="claim_0.pdf",
+                           content_type="application/pdf")
+            responses = await asyncio.gather(
+                client.post("/ingest", data=form),
+                *[client.post("/search", json={"query": f"claim CLM-000{n % 6} water damage", "k": 3})
+                  for n in range(12)])
+            assert all(response.status == 200 for response in responses)
+            assert len((await responses[0].json())["successful"]) == 1
+    
+    asyncio.run(scenario())
+    assert compactions == [True]
+    assert not processor._tombstones and processor.vector_store.index.ntotal == len(processor.documents)
+    loaded = DocumentProcessor.load(str(tmp_path / "workspace"), "dummy_key", embeddings=DeterministicFakeEmbedding(size=32))
+    assert loaded.vector_store.index.ntotal == processor.vector_store.index.ntotal
+
+
+def test_pipeline_metrics_record_stages_counters_and_exports(tmp_path):
+    """Ingest and chat record per-stage timings and counters; a disabled processor records nothing."""
+    paths = generate_corpus(str(tmp_path), docs=2, pages=2, words_per_page=150)
+    processor = make_processor(cache_dir=str(tmp_path / "cache"))
+    results = processor.process_multiple_documents(paths)
+    assert set(results["timings"]) == {"extraction", "embed", "index_build", "total"}
+    assert results["pages_per_second"] > 0
+    assert results["successful"][0]["timings"]["extract"] > 0 and results["successful"][0]["pages_per_second"] > 0
+    
+    processor.retrieve("water damage", mode="lexical")
+    model = GenericFakeChatModel(messages=iter([AIMessage("Water damage in the kitchen.")]))
+    processor.stream_answer("What happened?", model).consume()
+    processor.stream_answer("What happened?", model).consume()
+    
+    snapshot = processor.metrics_snapshot()
+    assert {"extract", "split", "document", "embed", "index_build", "ingest", "search_lexical", "search_hybrid",
+            "prompt_build", "llm", "llm_first_token"} <= set(snapshot["stages"])
+    assert snapshot["stages"]["extract"]["count"] == 2
+    counters = snapshot["counters"]
+    assert counters["documents_processed"] == 2 and counters["pages_processed"] == 4
+    assert counters["llm_calls"] == 1 and counters["answer_cache_hits"] == 1
+    assert counters["extraction_cache_misses"] == 2 and counters["embedding_api_calls"] >= 1
+    assert counters["context_tokens"] > 0 and "context_tokens_saved" in counters
+    assert snapshot["caches"]["answer"]["hits"] == 1
+    
+    prometheus = processor.export_metrics("prometheus")
+    assert 'claims_stage_seconds_count{stage="extract"} 2' in prometheus
+    assert 'claims_events_total{event="llm_calls"} 1' in prometheus
+    assert 'claims_cache_hits{cache="answer"} 1' in prometheus
+    assert json.loads(processor.export_metrics("json"))["counters"] == counters
+    with pytest.raises(ValueError):
+        processor.export_metrics("xml")
+    
+    # Vectors served from the embedding cache, or computed locally, are not API calls
+    again = processor.process_multiple_documents(paths)
+    assert again["embedding_cache"]["hit_ratio"] == 1.0 and again["embedding"]["api_calls"] == 0
+    assert processor.metrics_snapshot()["counters"]["embedding_api_calls"] == counters["embedding_api_calls"]
+    local = DocumentProcessor("dummy_key", embedding_backend="local")
+    local.process_multiple_documents(paths)
+    local.retrieve("water damage")
+    counters_local = local.metrics_snapshot()["counters"]
+    assert counters_local["embedding_api_calls"] == 0
+    assert "query_embedding_api_calls" not in counters_local
+    
+    quiet = make_processor(enable_metrics=False)
+    assert quiet.process_multiple_documents(paths)["timings"]["total"] > 0
+    quiet.retrieve("water damage")
+    snapshot = quiet.metrics_snapshot()
+    assert snapshot["stages"] == {} and snapshot["counters"] == {}
+
+
+def test_local_hashing_embeddings_index_offline_and_reload(tmp_path):
+    """The local backend embeds deterministically without network access, and saved workspaces reopen with it."""
+    from local_embeddings import HashingEmbeddings
+    
+    embeddings = HashingEmbeddings(dimensions=256, batch_size=2, workers=2)
+    texts = ["Water damage to the kitchen ceiling.", "Rear bumper collision repair estimate.",
+             "Kitchen ceiling water damage!", ""]
+    vectors = embeddings.embed_matrix(texts)
+    assert vectors.shape == (4, 256) and vectors.dtype == np.float32
+    assert np.allclose(np.linalg.norm(vectors[:3], axis=1), 1.0) and not vectors[3].any()
+    # The Embeddings interface returns plain lists, with no threads of its own
+    documents = HashingEmbeddings(dimensions=256).embed_documents(texts)
+    assert isinstance(documents, list) and isinstance(documents[0], list) and np.allclose(documents, vectors)
+    assert embeddings.embed_documents([]) == []
+    query = np.asarray(embeddings.embed_query("water damage in the kitchen"))
+    assert query @ vectors[0] > query @ vectors[1] and query @ vectors[2] > query @ vectors[1]
+    
+    paths = generate_corpus(str(tmp_path / "corpus"), docs=3, pages=2, words_per_page=150)
+    processor = DocumentProcessor("", cache_dir=str(tmp_path / "cache"), embedding_backend="local")
+    assert processor.embedding_cache is None and processor.embedding_pipeline.batch_tokens is None
+    results = processor.process_multiple_documents(paths)
+    assert not results["failed"] and processor.vector_store.index.d == 1024
+    top = processor.retrieve("Claim number CLM-00001 page 2", k=1, mode="vector")[0][0]
+    assert top.metadata["source"] == "claim_00001.pdf"
+    
+    processor.save(str(tmp_path / "workspace"))
+    assert DocumentProcessor.workspace_embedding_backend(str(tmp_path / "workspace")) == "local"
+    reloaded = DocumentProcessor.load(str(tmp_path / "workspace"), "")
+    assert reloaded.embedding_model == processor.embedding_model
+    assert reloaded.retrieve("Claim number CLM-00001 page 2", k=1, mode="vector")[0][0].page_content == top.page_content
+    with pytest.raises(ValueError):
+        DocumentProcessor("", embedding_backend="word2vec")
+
+
+def test_chunk_store_shares_overlapping_text_and_materializes_on_demand(tmp_path):
+    """Chunks are stored once in a byte arena and come back as equal Documents; deletes are reclaimed."""
+    from langchain_core.documents import Document
+    
+    processor = make_processor()
+    lines = [f"Line {n}: the adjuster inspected room {n} and noted water staining on the ceiling." for n in range(40)]
+    long_pdf = write_pdf(tmp_path / "long.pdf", ["\n".join(lines)])
+    result = processor.process_single_document(long_pdf, "long.pdf")
+    processor.process_multiple_documents([long_pdf] + make_claim_pdfs(tmp_path, 2))
+    
+    store = processor.vector_store.docstore
+    assert isinstance(store, document_processor.ChunkStore)
+    stats = store.stats()
+    # Only the non-overlapping part of each chunk of the long page is written
+    assert stats["chunks"] == processor.vector_store.index.ntotal and stats["arena_bytes"] < stats["text_bytes"]
+    stored = [doc for doc in processor.documents if doc.metadata["source"] == "long.pdf"]
+    assert [(doc.page_content, {k: v for k, v in doc.metadata.items() if k != "ingest_id"}) for doc in stored] == \
+        [(chunk.page_content, chunk.metadata) for chunk in result["chunks"]]
+    # The lexical index keeps chunk ids, not the chunks
+    assert all(isinstance(entry, str) for entry in processor.lexical_index._docs)
+    assert processor.retrieve("adjuster inspected room 7", k=1, mode="lexical")[0][0].metadata["source"] == "long.pdf"
+    
+    # Overlaps are shared at byte level, multi-byte characters included; odd metadata is kept as given
+    store = document_processor.ChunkStore()
+    page = "Schadensmeldung für Gebäude – Wasserschaden im Erdgeschoß. " * 4
+    chunks = {f"c{n}": Document(page_content=page[start:start + 80],
+                                metadata={"source": "de.pdf", "page": 1, "start_index": start,
+                                          "end_index": min(start + 80, len(page)), "chunk_id": n, "note": [n]})
+              for n, start in enumerate(range(0, len(page), 60))}
+    store.add(chunks)
+    assert store.stats()["arena_bytes"] == len(page.encode("utf-8"))
+    for doc_id, chunk in chunks.items():
+        assert store.search(doc_id).page_content == chunk.page_content
+        assert store.search(doc_id).metadata == chunk.metadata and store.search(doc_id).id == doc_id
+    with pytest.raises(ValueError):
+        store.add({"c0": chunks["c0"]})
+    
+    store.delete(["c0", "c1", "c2"])
+    assert len(store) == 1 and store.stats()["arena_bytes"] == len(chunks["c3"].page_content.encode("utf-8"))
+    assert store.search("c3").page_content == chunks["c3"].page_content
+    assert store.search("c0") == "ID c0 not found."
+
+
+def test_in_memory_pdf_sources_are_parsed_without_temp_files(tmp_path, monkeypatch):
+    """Bytes, memoryviews and streams are processed like paths; temporary copies are always deleted."""
+    import io
+    import tempfile
+    
+    paths = make_claim_pdfs(tmp_path, 3, pages=2)
+    data = [open(path, "rb").read() for path in paths]
+    processor = make_processor(cache_dir=str(tmp_path / "cache"))
+    expected = processor.process_single_document(paths[0], "claim_0.pdf")
+    
+    class Unseekable(io.RawIOBase):
+        def __init__(self, payload):
+            self._stream = io.BytesIO(payload)
+        
+        def readable(self):
+            return True
+        
+        def readinto(self, target):
+            return self._stream.readinto(target)
+    
+    spool_dir = tmp_path / "spool"
+    spool_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(spool_dir))
+    for source in (data[0], bytearray(data[0]), memoryview(data[0]), io.BytesIO(data[0]), Unseekable(data[0])):
+        result = processor.process_single_document(source, "claim_0.pdf")
+        assert result["status"] == "success" and result["cache_hit"]
+        assert [c.page_content for c in result["chunks"]] == [c.page_content for c in expected["chunks"]]
+    assert processor.extract_text_from_pdf(memoryview(data[1]), max_pages=1).startswith("Claim number CLM-0001 page 1")
+    assert processor.process_single_document(b"not a pdf", "junk.pdf")["status"] == "failed"
+    
+    # An unseekable stream past the spool size goes through a temporary file that is removed afterwards
+    with document_processor.open_pdf_source(Unseekable(data[2]), spool_bytes=16) as stream:
+        assert stream.read() == data[2] and stream._rolled
+    assert not list(spool_dir.iterdir())
+    
+    # Pool workers get small sources as bytes and large ones as temporary files, deleted once processed
+    monkeypatch.setattr(document_processor, "IN_MEMORY_PDF_MAX_BYTES", len(data[1]) - 1)
+    (tmp_path / "small").mkdir()
+    (small_path,) = make_claim_pdfs(tmp_path / "small", 1, pages=1)
+    small = open(small_path, "rb").read()
+    assert len(small) < len(data[1])
+    uploads = [memoryview(small), io.BytesIO(data[1]), paths[2]]
+    fresh = make_processor()
+    results = fresh.process_multiple_documents(uploads, parallel=True, max_workers=2,
+                                               source_names=["claim_0.pdf", "claim_1.pdf", "claim_2.pdf"])
+    assert [r["file_name"] for r in results["successful"]] == ["claim_0.pdf", "claim_1.pdf", "claim_2.pdf"]
+    assert not results["failed"] and not list(spool_dir.iterdir())
+    assert DocumentProcessor.source_name(io.BytesIO(data[0]), 1) == "document_2.pdf"
+    assert DocumentProcessor.source_name(paths[1]) == "claim_1.pdf"
+
+
+def test_text_chunker_spans_units_and_processor_settings(tmp_path):
+    """Chunks respect the size in characters or tokens, overlap at word starts, and follow the processor settings."""
+    import random
+    import re
+    from benchmark import synthetic_page, compare_chunkers
+    from chunking import TextChunker
+    
+    class WordEncoding:
+        """Stand-in tiktoken encoding with one token per word."""
+        
+        def encode(self, text, disallowed_special=()):
+            return [match.start() for match in re.finditer(r"\s*\S+", text)]
+        
+        def decode_with_offsets(self, tokens):
+            return "", list(tokens)
+    
+    rng = random.Random(0)
+    for n in range(50):
+        page = "  " + synthetic_page(rng, n, 1, 400) + "\n\n"
+        for chunker, length in ((TextChunker(300, 60), len), (TextChunker(40, 8, "tokens", WordEncoding()),
+                                                               lambda text: len(text.split()))):
+            spans = chunker.split(page)
+            assert spans[0][0] == 2 and spans[-1][1] == len(page.rstrip())
+            for start, end in spans:
+                assert 0 < length(page[start:end]) <= chunker.chunk_size
+                assert not page[start].isspace() and not page[end - 1].isspace() and page[start - 1].isspace()
+            for (start, end), (next_start, next_end) in zip(spans, spans[1:]):
+                assert start < next_start <= end + 1 and next_end > end
+    # Overlaps never start mid-word, so an unbroken run is cut without one
+    assert TextChunker(10, 2).split(" \n ") == [] and TextChunker(10, 2).split("x" * 25) == [[0, 10], [10, 20], [20, 25]]
+    assert TextChunker(10, 4).split("ab cd ef gh ij kl") == [[0, 8], [6, 14], [12, 17]]
+    with pytest.raises(ValueError):
+        TextChunker(100, 100)
+    with pytest.raises(ValueError):
+        TextChunker(100, 10, "words")
+    
+    path = write_pdf(tmp_path / "claim.pdf", [synthetic_page(rng, 1, 1, 400), synthetic_page(rng, 1, 2, 400)])
+    processor = make_processor(chunk_size=1000)
+    default_chunks = processor.process_single_document(path, "claim.pdf")["chunks"]
+    processor.chunk_size, processor.chunk_overlap = 300, 50
+    chunks = processor.process_single_document(path, "claim.pdf")["chunks"]
+    assert len(chunks) > len(default_chunks) and all(len(chunk.page_content) <= 300 for chunk in chunks)
+    pages = dict(processor.iter_pdf_pages(path))
+    for chunk in chunks:
+        metadata = chunk.metadata
+        assert pages[metadata["page"]][metadata["start_index"]:metadata["end_index"]] == chunk.page_content
+    
+    # Saved workspaces keep chunking later ingests the same way
+    processor.chunk_unit = "tokens"
+    processor.process_multiple_documents([path])
+    processor.save(str(tmp_path / "workspace"))
+    loaded = DocumentProcessor.load(str(tmp_path / "workspace"), "dummy_key", embeddings=processor.embeddings)
+    assert (loaded.chunk_size, loaded.chunk_overlap, loaded.chunk_unit) == (300, 50, "tokens")
+    
+    report = compare_chunkers(400, seed=1, distinct=50)
+    assert report["speedup"] > 1 and report["offset_chunker"]["chunks"] > 0
+
 
 if __name__ == "__main__":
-    success = test_document_processor()
-    sys.exit(0 if success else 1)
+    sys.exit(pytest.main([__file__]))